@@ -0,0 +1,780 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2016 - 2022 Bas van Meerten and Wouter Franssen
+
+# This file is part of ssNake.
+#
+# ssNake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ssNake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ssNake. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Fits spectra without the graphical interface.
+
+The spectra are loaded with the automatic loading routine of ssNake and fitted with the starting values
+and settings of a parameter file as written by 'Parameters to file' in the fitting windows.
+Every trace along the fit dimension is fitted, and the files are divided over a pool of processes.
+The 2D fits (MQMAS) fit the planes spanned by the dimension before the fit dimension and the fit dimension.
+
+Usage:
+    python fitBatch.py -p params.txt -o results.csv [-t fittype] [-a axis] [-w workers] spectrum1 [spectrum2 ...]
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import numpy as np
+import scipy.optimize
+from safeEval import safeEval
+import simFunctions as simFunc
+import specIO as io
+from fitEngine import FittingException, ParamPlan, loadCzjzekLib, readParamFile, runBatchFit, runFit, stackFitArgs
+
+MASTYPES = ["Static", "Finite MAS", "Infinite MAS"]
+DEFNAMES = ["delta_11 - delta_22 - delta_33",
+            "delta_xx - delta_yy - delta_zz",
+            "delta_iso - delta_aniso - eta",
+            "delta_iso - omega - kappa"]
+CZJZEKTYPES = ['Normal', 'Extended']
+
+# The names of the parameters are taken from the parameter file when they are None.
+# The results of the fitted parameters in 'check' are made absolute ('abs'), folded between 0 and 1 ('eta'),
+# between 0 and 90 degrees ('angle') or according to the shift definition ('definition'), as in the fitting windows.
+BATCHFITTYPES = {'relax': {'name': "Relaxation Curve",
+                           'func': simFunc.relaxationFunc,
+                           'singleNames': ['Amplitude', 'Constant'],
+                           'multiNames': ['Coefficient', 'T'],
+                           'spec': None,
+                           'dim': 1,
+                           'check': {'T': 'abs'}},
+                 'diffusion': {'name': "Diffusion Curve",
+                               'func': simFunc.diffusionFunc,
+                               'singleNames': ['Amplitude', 'Constant'],
+                               'multiNames': ['Coefficient', 'D'],
+                               'spec': None,
+                               'dim': 1,
+                               'check': {'D': 'abs'}},
+                 'peakdeconv': {'name': "Lorentzian/Gaussian",
+                                'func': simFunc.peakSim,
+                                'singleNames': ["Offset", "Multiplier"],
+                                'multiNames': ["Position", "Integral", "Lorentz", "Gauss"],
+                                'spec': True,
+                                'dim': 1,
+                                'check': {'Lorentz': 'abs', 'Gauss': 'abs'}},
+                 'csadeconv': {'name': "CSA",
+                               'func': simFunc.csaFunc,
+                               'singleNames': ["Offset", "Multiplier", "Spinspeed"],
+                               'multiNames': ["Definition1", "Definition2", "Definition3", "Integral", "Lorentz", "Gauss"],
+                               'spec': True,
+                               'dim': 1,
+                               'check': {'Lorentz': 'abs', 'Gauss': 'abs', 'Definition3': 'definition'}},
+                 'quaddeconv': {'name': "Quadrupole",
+                                'func': simFunc.quadFunc,
+                                'singleNames': ["Offset", "Multiplier", "Spinspeed"],
+                                'multiNames': ["Position", "Cq", 'eta', "Integral", "Lorentz", "Gauss", "LorentzST"],
+                                'spec': True,
+                                'dim': 1,
+                                'check': {'Lorentz': 'abs', 'LorentzST': 'abs', 'Gauss': 'abs', 'eta': 'eta', 'Cq': 'abs'}},
+                 'quadcsadeconv': {'name': "Quadrupole+CSA",
+                                   'func': simFunc.quadCSAFunc,
+                                   'singleNames': ["Offset", "Multiplier", "Spinspeed"],
+                                   'multiNames': ["Definition1", "Definition2", "Definition3", "Cq", 'eta', "Alpha", "Beta", "Gamma", "Integral", "Lorentz", "Gauss", "LorentzST"],
+                                   'spec': True,
+                                   'dim': 1,
+                                   'check': {'Lorentz': 'abs', 'LorentzST': 'abs', 'Gauss': 'abs', 'eta': 'eta', 'Cq': 'abs', 'Definition3': 'definition',
+                                             'Alpha': 'angle', 'Beta': 'angle', 'Gamma': 'angle'}},
+                 'quadczjzek': {'name': "Czjzek",
+                                'func': simFunc.quadCzjzekFunc,
+                                'singleNames': ["Offset", "Multiplier"],
+                                'multiNames': ["Position", "Sigma", "Cq0", 'eta0', "Integral", "Lorentz", "Gauss"],
+                                'spec': True,
+                                'dim': 1,
+                                'check': {'Lorentz': 'abs', 'Gauss': 'abs', 'Sigma': 'abs', 'Cq0': 'abs', 'eta0': 'eta'}},
+                 'external': {'name': "External",
+                              'func': simFunc.externalFitRunScript,
+                              'singleNames': None,
+                              'multiNames': None,
+                              'spec': None,
+                              'dim': 1,
+                              'check': {'Lorentz': 'abs', 'Gauss': 'abs'}},
+                 'function': {'name': "Function",
+                              'func': simFunc.functionRun,
+                              'singleNames': None,
+                              'multiNames': None,
+                              'spec': None,
+                              'dim': 1,
+                              'check': {}},
+                 'mqmas': {'name': "MQMAS",
+                           'func': simFunc.mqmasFunc,
+                           'singleNames': ["Offset", "Multiplier", "Spinspeed"],
+                           'multiNames': ["Position", "Gauss", "Cq", 'eta', "Integral", "Lorentz", "Lorentz1"],
+                           'spec': True,
+                           'dim': 2,
+                           'check': {'Lorentz1': 'abs', 'Gauss': 'abs', 'Lorentz': 'abs', 'eta': 'eta', 'Cq': 'abs'}},
+                 'mqmasczjzek': {'name': "Czjzek MQMAS",
+                                 'func': simFunc.mqmasCzjzekFunc,
+                                 'singleNames': ["Offset", "Multiplier"],
+                                 'multiNames': ["Position", 'Gauss', "Sigma", "Cq0", 'eta0', "Integral", "Lorentz", "Lorentz1"],
+                                 'spec': True,
+                                 'dim': 2,
+                                 'check': {'Gauss': 'abs', 'Lorentz1': 'abs', 'Lorentz': 'abs', 'eta0': 'eta', 'Cq0': 'abs'}}}
+
+def getFitType(fitType, params):
+    """
+    Returns the key of the batch fit type.
+
+    Parameters
+    ----------
+    fitType : str or None
+        The key of the fit type.
+        When None, the fit type is taken from the name in the parameter file.
+    params : dict
+        The parameters as read by readParamFile.
+
+    Returns
+    -------
+    str
+        The key in BATCHFITTYPES.
+
+    Raises
+    ------
+    FittingException
+        When the fit type is not supported.
+    """
+    if fitType is None:
+        for key in BATCHFITTYPES:
+            if BATCHFITTYPES[key]['name'] == params['fitType']:
+                return key
+        raise FittingException("Fit type '" + str(params['fitType']) + "' of the parameter file is not supported in batch mode")
+    if fitType not in BATCHFITTYPES:
+        raise FittingException("Fit type '" + fitType + "' is not supported in batch mode, use one of: " + ", ".join(BATCHFITTYPES))
+    return fitType
+
+def getNames(fitType, params):
+    """
+    Returns the names of the parameters of a fit type.
+
+    Parameters
+    ----------
+    fitType : str
+        The key in BATCHFITTYPES.
+    params : dict
+        The parameters as read by readParamFile.
+
+    Returns
+    -------
+    tuple
+        The names of the site independent and the site dependent parameters.
+    """
+    singleNames = BATCHFITTYPES[fitType]['singleNames']
+    multiNames = BATCHFITTYPES[fitType]['multiNames']
+    if singleNames is None:
+        singleNames = params['singleNames']
+    if multiNames is None:
+        multiNames = params['multiNames']
+    return singleNames, multiNames
+
+def evalSetting(preParams, name, default):
+    """
+    Evaluates a numerical setting of a parameter file.
+
+    Parameters
+    ----------
+    preParams : dict
+        The extra parameters of the parameter file.
+    name : str
+        The name of the setting.
+    default : str
+        The value used when the file does not have the setting.
+
+    Returns
+    -------
+    float or int
+        The value of the setting.
+
+    Raises
+    ------
+    FittingException
+        When the value is not valid.
+    """
+    inp = safeEval(preParams.get(name, default), Type='FI')
+    if inp is None:
+        raise FittingException("Parameter file: " + name + " value not valid")
+    return inp
+
+def optionSetting(preParams, name, options, default):
+    """
+    Returns the index of a setting of a parameter file in a list of options.
+
+    Parameters
+    ----------
+    preParams : dict
+        The extra parameters of the parameter file.
+    name : str
+        The name of the setting.
+    options : list of str
+        The possible values of the setting.
+    default : str
+        The value used when the file does not have the setting.
+
+    Returns
+    -------
+    int
+        The index of the value in options.
+
+    Raises
+    ------
+    FittingException
+        When the value is not one of the options.
+    """
+    value = preParams.get(name, default)
+    if value not in options:
+        raise FittingException("Parameter file: " + name + " should be one of: " + ", ".join(options))
+    return options.index(value)
+
+def getCzjzekLib(preParams, data, axis, mqmas=False):
+    """
+    Generates or loads the Czjzek library of a parameter file, in the same way as the Czjzek library window.
+
+    Parameters
+    ----------
+    preParams : dict
+        The extra parameters of the parameter file.
+    data : Spectrum
+        The spectrum to be fitted.
+    axis : int
+        The direct dimension of the fit.
+    mqmas : bool, optional
+        True if the library is for an MQMAS fit.
+        By default False.
+
+    Returns
+    -------
+    tuple
+        The FIDs, Cq values and eta values of the library.
+    """
+    libName = preParams.get("Library", "Not available")
+    xax = data.xaxArray[axis]
+    if libName == "Not available":
+        raise FittingException("No library available")
+    if libName != "Generated":
+        return loadCzjzekLib(libName, xax)
+    cheng = int(evalSetting(preParams, "Cheng", "15"))
+    weight = simFunc.zcwOrientations(cheng, 2)[2]
+    D2 = simFunc.zcwTensors(cheng, 2, 2)
+    D4 = simFunc.zcwTensors(cheng, 2, 4)
+    I = evalSetting(preParams, "I", "3/2")
+    if mqmas:
+        extra = [False, I, 2, np.arctan(np.sqrt(2)), D2, D4, weight, 2]
+        spinspeed = np.inf
+    else:
+        satBool = preParams.get("Satellites") == "True"
+        numssb = int(evalSetting(preParams, "Sidebands", "32"))
+        angle = evalSetting(preParams, "Angle", "arctan(sqrt(2))")
+        mas = optionSetting(preParams, "MAS", MASTYPES, "Infinite MAS")
+        extra = [satBool, I, numssb, angle, D2, D4, weight, mas]
+        spinspeed = evalSetting(preParams, "Spinspeed", "10.0")
+    lib = simFunc.genLib(len(xax), evalSetting(preParams, "CQmin", "0.0"), evalSetting(preParams, "CQmax", "4.0"),
+                         evalSetting(preParams, "Etamin", "0.0"), evalSetting(preParams, "Etamax", "1.0"),
+                         int(evalSetting(preParams, "CQgrid", "50")), int(evalSetting(preParams, "Etagrid", "10")),
+                         extra, data.freq[axis], data.sw[axis], spinspeed, cheng=cheng)
+    return lib
+
+def getExtra(fitType, params, data, axis):
+    """
+    Returns the fit function, extra parameters and transform axes of a fit type.
+    The extra parameters are made from the settings of the parameter file in the same way as in the fitting windows.
+
+    Parameters
+    ----------
+    fitType : str
+        The key in BATCHFITTYPES.
+    params : dict
+        The parameters as read by readParamFile.
+    data : Spectrum
+        The spectrum to be fitted.
+    axis : int
+        The direct dimension of the fit.
+
+    Returns
+    -------
+    tuple
+        The fit function, the extra parameters, the FFT axes and the FFT shift axes.
+    """
+    preParams = params['preParams']
+    func = BATCHFITTYPES[fitType]['func']
+    if fitType == 'diffusion':
+        extra = [safeEval(preParams.get("gamma", "42.576")), safeEval(preParams.get("delta", "1.0")), safeEval(preParams.get("DELTA", "1.0"))]
+        return func, extra, (), ()
+    if fitType == 'peakdeconv':
+        if preParams.get("Frequency domain") == "True":
+            return simFunc.peakSimFreq, [], (), ()
+        return func, [], (0,), (0,)
+    if fitType in ('csadeconv', 'quaddeconv', 'quadcsadeconv', 'mqmas'):
+        symm = 1 if fitType == 'quadcsadeconv' else 2
+        cheng = int(evalSetting(preParams, "Cheng", "15"))
+        weight = simFunc.zcwOrientations(cheng, symm)[2]
+        D2 = simFunc.zcwTensors(cheng, symm, 2)
+        D4 = simFunc.zcwTensors(cheng, symm, 4)
+        angle = evalSetting(preParams, "Angle", "arctan(sqrt(2))")
+        numssb = int(evalSetting(preParams, "Sidebands", "32"))
+        shiftdef = optionSetting(preParams, "Definition", DEFNAMES, DEFNAMES[0])
+        satBool = preParams.get("Satellites") == "True"
+        if fitType == 'csadeconv':
+            MAStype = optionSetting(preParams, "MAS", MASTYPES, "Static")
+            return func, [shiftdef, numssb, angle, D2, weight, MAStype], (0,), ()
+        if fitType == 'quaddeconv':
+            MAStype = optionSetting(preParams, "MAS", MASTYPES, "Static")
+            return func, [satBool, evalSetting(preParams, "I", "3/2"), numssb, angle, D2, D4, weight, MAStype], (0,), ()
+        if fitType == 'quadcsadeconv':
+            MAStype = optionSetting(preParams, "MAS", MASTYPES, "Static")
+            return func, [satBool, evalSetting(preParams, "I", "3/2"), numssb, angle, D2, D4, weight, MAStype, shiftdef], (0,), ()
+        MAStype = optionSetting(preParams, "MAS", MASTYPES, "Infinite MAS")
+        I = evalSetting(preParams, "I", "3/2")
+        MQ = int(evalSetting(preParams, "MQ", "3"))
+        if MQ > (I*2):
+            raise FittingException("MQ cannot be larger than I")
+        shear = evalSetting(preParams, "Shear", "0.0")
+        scale = evalSetting(preParams, "ScaleSW", "1.0")
+        return func, [I, MQ, numssb, angle, D2, D4, weight, shear, scale, MAStype], (0, 1), ()
+    if fitType in ('quadczjzek', 'mqmasczjzek'):
+        method = optionSetting(preParams, "Method", CZJZEKTYPES, CZJZEKTYPES[0])
+        d = int(evalSetting(preParams, "d", "5"))
+        lib, cqLib, etaLib = getCzjzekLib(preParams, data, axis, fitType == 'mqmasczjzek')
+        if fitType == 'quadczjzek':
+            return func, [method, d, lib, cqLib, etaLib], (0,), ()
+        I = evalSetting(preParams, "I", "3/2")
+        MQ = int(evalSetting(preParams, "MQ", "3"))
+        if MQ > (I*2):
+            raise FittingException("MQ cannot be larger than I")
+        shear = evalSetting(preParams, "Shear", "0.0")
+        scale = evalSetting(preParams, "ScaleSW", "1.0")
+        return func, [I, MQ, cqLib, etaLib, lib, shear, scale, method, d], (0,), ()
+    if fitType == 'function':
+        if not preParams.get("Function"):
+            raise FittingException("Fitting: No function defined")
+        return func, [params['multiNames'], preParams["Function"]], (), ()
+    if fitType == 'external':
+        script = params['postParams'].get("Script")
+        if not script or script == 'None':
+            raise FittingException("Fitting: No valid script found")
+        return func, [params['multiNames'], preParams.get("Command", "simpson"), script, [b"", b""], bool(data.spec[axis])], (), ()
+    return func, [], (), ()
+
+def getAxMult(spec, axType, ppm, freq, ref=None):
+    """
+    Calculates the x-axis multiplier of the units of the parameter file.
+    The same as getAxMult of the plot frames.
+
+    Parameters
+    ----------
+    spec : bool
+        True if the axis is for a spectrum, False it is for an FID.
+    axType : int
+        The multiplier defined as 1000^axType for spectra and 1000^-axType for FIDs.
+    ppm : bool
+        If True the multiplier is calculated to convert to a ppm axis.
+    freq : float
+        The spectrometer frequency.
+    ref : float, optional
+        The reference frequency if None the spectrometer frequency is used.
+
+    Returns
+    -------
+    float
+        The x-axis multiplier.
+    """
+    if spec:
+        if ppm:
+            if ref is not None:
+                return 1e6 / ref
+            return 1e6 / freq
+        return 1.0 / (1000.0**axType)
+    return 1000.0**axType
+
+def genMask(xax, data, removeLimits):
+    """
+    Generates the mask of the excluded regions, in the same way as the fitting windows.
+
+    Parameters
+    ----------
+    xax : list of ndarray
+        The x-axes of the fit dimensions.
+    data : ndarray
+        The data of the trace.
+    removeLimits : dict
+        The excluded regions as read by readParamFile.
+
+    Returns
+    -------
+    float or ndarray
+        The mask.
+    """
+    if not removeLimits['limits']:
+        return 1.0
+    mask = np.ones_like(data)
+    for limits in removeLimits['limits']:
+        sliceTuple = tuple()
+        for i, ax in enumerate(xax):
+            minInd = np.searchsorted(ax, min(limits[i]))
+            maxInd = np.searchsorted(ax, max(limits[i]))
+            sliceTuple += (slice(minInd, maxInd),)
+        mask[sliceTuple] = 0.0
+    if removeLimits['invert']:
+        mask = np.abs(mask - 1.0)
+    return mask
+
+def buildStructure(fitType, params):
+    """
+    Builds the parameter structure of a fit from the values of a parameter file.
+
+    Parameters
+    ----------
+    fitType : str
+        The key in BATCHFITTYPES.
+    params : dict
+        The parameters as read by readParamFile.
+
+    Returns
+    -------
+    tuple
+        The number of sites, the structure dictionary, the initial guess and the fixed values.
+
+    Raises
+    ------
+    FittingException
+        When a parameter of the fit type is missing in the file.
+    """
+    singleNames, multiNames = getNames(fitType, params)
+    struc = {}
+    for name in singleNames + multiNames:
+        struc[name] = []
+    guess = []
+    argu = []
+
+    def add(name, entry):
+        if entry is None:
+            raise FittingException("Parameter file has no value for " + name)
+        value, fixed = entry
+        if isinstance(value, tuple):
+            struc[name].append((2, value))
+        elif fixed:
+            argu.append(float(value))
+            struc[name].append((0, len(argu) - 1))
+        else:
+            guess.append(float(value))
+            struc[name].append((1, len(guess) - 1))
+
+    singleVals = params['singleVals'][0] if params['singleVals'] else []
+    single = dict(zip(params['singleNames'], singleVals))
+    for name in singleNames:
+        add(name, single.get(name))
+    numExp = len(params['multiVals'])
+    for i in range(numExp):
+        site = dict(zip(params['multiNames'], params['multiVals'][i]))
+        for name in multiNames:
+            add(name, site.get(name))
+    return numExp, struc, guess, argu
+
+def checkResults(fitType, values, struc, numExp, singleNames, multiNames, shiftdef=None):
+    """
+    Fixes the fit results, in the same way as the checkResults of the fitting windows.
+    Only the fitted parameters are changed.
+
+    Parameters
+    ----------
+    fitType : str
+        The key in BATCHFITTYPES.
+    values : ndarray
+        The values of the parameters as returned by ParamPlan.values.
+        Changed in place.
+    struc : dict
+        The structure of the parameters.
+    numExp : int
+        The number of sites.
+    singleNames : list of str
+        The names of the site independent parameters.
+    multiNames : list of str
+        The names of the site dependent parameters.
+    shiftdef : int, optional
+        The index of the shift definition, used for the 'definition' check.
+    """
+    names = list(singleNames) + list(multiNames)
+    for name, kind in BATCHFITTYPES[fitType]['check'].items():
+        if name not in names:
+            continue
+        row = names.index(name)
+        for i in range(1 if name in singleNames else numExp):
+            if struc[name][i][0] != 1:
+                continue
+            val = values[row, i]
+            if kind == 'abs':
+                val = abs(val)
+            elif kind == 'eta':
+                val = 1 - abs(abs(val) % 2 - 1)
+            elif kind == 'angle':
+                val = val % 180
+                if val > 90:
+                    val = 180 - val
+            elif kind == 'definition':
+                if shiftdef == 2:
+                    val = 1 - abs(abs(val) % 2 - 1)
+                elif shiftdef == 3:
+                    val = 1 - abs(abs(val + 1) % 4 - 2)
+            values[row, i] = val
+
+def fitFile(filePath, fitType, params, axis=-1, minmethod='Powell', numfeval=150):
+    """
+    Fits all traces of a spectrum file.
+
+    Parameters
+    ----------
+    filePath : str
+        The path of the spectrum, loaded with specIO.autoLoad.
+    fitType : str
+        The key in BATCHFITTYPES.
+    params : dict
+        The parameters as read by readParamFile.
+    axis : int, optional
+        The dimension along which the traces are fitted.
+        For 2D fits the planes of the dimension before axis and axis are fitted.
+        -1 by default.
+    minmethod : str, optional
+        The minimization method, as in the fitting preferences,
+        or 'Batch' to fit all traces of a file at once with runBatchFit.
+        'Powell' by default.
+    numfeval : int, optional
+        The maximum number of function evaluations per trace,
+        or of the whole batch for the 'Batch' method.
+        150 by default.
+
+    Returns
+    -------
+    list of dict
+        The result of every trace, with the file, trace, status, least squares value,
+        number of evaluations and the value of every parameter of every site.
+        For the 'Batch' method the status and the number of evaluations (batchNfev) are those of the whole batch.
+    """
+    data = io.autoLoad(filePath)
+    if data is None or isinstance(data, int):
+        raise FittingException("Could not load " + filePath)
+    axis = data.checkAxis(axis)
+    dim = BATCHFITTYPES[fitType]['dim']
+    if axis - dim + 1 < 0:
+        raise FittingException("The " + BATCHFITTYPES[fitType]['name'] + " fit needs " + str(dim) + " dimensions up to the fit dimension")
+    axes = list(range(axis - dim + 1, axis + 1))
+    if BATCHFITTYPES[fitType]['spec'] is not None:
+        for ax in axes:
+            if bool(data.spec[ax]) != BATCHFITTYPES[fitType]['spec']:
+                data.complexFourier(ax)
+    func, extra, fftAxes, fftshiftAxes = getExtra(fitType, params, data, axis)
+    numExp, struc, guess, argu = buildStructure(fitType, params)
+    singleNames, multiNames = getNames(fitType, params)
+    shiftdef = optionSetting(params['preParams'], "Definition", DEFNAMES, DEFNAMES[0]) if 'Definition3' in multiNames else None
+    shape = list(data.shape())
+    for ax in axes:
+        shape[ax] = 1
+    traces = []
+    for locList in np.ndindex(*shape):
+        trace = data.getSlice(axes, list(locList))
+        axType = params['axType'] if params['axType'] is not None else 0
+        axMult = getAxMult(trace.spec[-1], axType, params['ppm'], trace.freq[-1], trace.ref[-1])
+        xax = trace.xaxArray[-dim:]
+        fitData = np.real(trace.getHyperData(0))
+        mask = genMask(xax, fitData, params['removeLimits'])
+        args = ([numExp], [struc], [argu + [extra]], [trace.freq], [trace.sw], [axMult], [fftAxes], [fftshiftAxes], [singleNames], [multiNames])
+        fitArgs = ([slice(0, len(guess))],) + args
+        traces.append((locList, xax, fitData, mask, fitArgs))
+    if minmethod == 'Batch':
+        fitVals = fitTracesBatch(traces, guess, func, numfeval)
+    else:
+        fitVals = [runFit([xax], np.array([fitData]), [mask], guess, fitArgs, [func], minmethod, numfeval) for _, xax, fitData, mask, fitArgs in traces]
+    results = []
+    for (locList, _, _, _, fitArgs), fitVal in zip(traces, fitVals):
+        locList = list(locList)
+        for ax in axes:
+            locList[ax] = '*'
+        row = {'file': filePath, 'trace': '(' + ', '.join(str(loc) for loc in locList) + ')'}
+        if fitVal is None or isinstance(fitVal, str):
+            row['status'] = fitVal if fitVal is not None else 'Optimal parameters not found'
+            results.append(row)
+            continue
+        if minmethod == 'Batch':
+            row['status'] = 'ok' if fitVal.success else 'Batch: ' + str(fitVal.message)
+        else:
+            row['status'] = 'ok' if fitVal.success else str(fitVal.message)
+        row['sumSquares'] = float(fitVal.sumSquares)
+        row['batchNfev' if minmethod == 'Batch' else 'nfev'] = int(fitVal.nfev)
+        values = ParamPlan(fitArgs).values(fitVal.x)[0]
+        checkResults(fitType, values, struc, numExp, singleNames, multiNames, shiftdef)
+        for n, name in enumerate(singleNames):
+            row[name] = float(values[n, 0])
+        for i in range(numExp):
+            for n, name in enumerate(multiNames):
+                row[name + ' ' + str(i + 1)] = float(values[len(singleNames) + n, i])
+        results.append(row)
+    return results
+
+def fitTracesBatch(traces, guess, func, numfeval):
+    """
+    Fits traces with the same parameters at once with runBatchFit.
+
+    Parameters
+    ----------
+    traces : list of tuple
+        The (locList, xax, data1D, mask, fitArgs) of every trace.
+    guess : list
+        The initial guess of every trace.
+    func : function
+        The fit function, which should be in simFunctions.BATCHED.
+    numfeval : int
+        The maximum number of function evaluations of the whole batch.
+
+    Returns
+    -------
+    list
+        The result of every trace, as returned by runFit,
+        with the success, message and number of evaluations of the whole batch.
+    """
+    if func not in simFunc.BATCHED:
+        raise FittingException("The batch method is only available for relaxation and diffusion fits")
+    data = np.array([trace[2] for trace in traces], dtype=float)
+    mask = np.array([np.broadcast_to(trace[3], data.shape[1:]) for trace in traces], dtype=float)
+    fixed = stackFitArgs([trace[4] for trace in traces])
+    guesses = np.tile(np.array(guess, dtype=float), (len(traces), 1))
+    fitVal = runBatchFit([traces[0][1]], data, mask, guesses, fixed, traces[0][4], [func], numfeval)
+    if fitVal is None or isinstance(fitVal, str):
+        return [fitVal] * len(traces)
+    return [scipy.optimize.OptimizeResult(x=fitVal.x[i], success=fitVal.success, message=fitVal.message, sumSquares=fitVal.sumSquares[i], nfev=fitVal.nfev) for i in range(len(traces))]
+
+def fitFileTask(task):
+    """
+    Runs fitFile in a pool process, returning errors as a result.
+
+    Parameters
+    ----------
+    task : tuple
+        The arguments of fitFile.
+
+    Returns
+    -------
+    list of dict
+        The results of fitFile, or a single row with the error.
+    """
+    try:
+        return fitFile(*task)
+    except Exception as e:
+        return [{'file': task[0], 'status': 'Error: ' + str(e)}]
+
+def fitFiles(filePaths, paramFile, fitType=None, axis=-1, minmethod='Powell', numfeval=150, numWorkers=None):
+    """
+    Fits all traces of a list of spectrum files in parallel.
+
+    Parameters
+    ----------
+    filePaths : list of str
+        The paths of the spectra.
+    paramFile : str
+        The path of the parameter file with the starting values.
+    fitType : str, optional
+        The key in BATCHFITTYPES.
+        By default the fit type of the parameter file is used.
+    axis : int, optional
+        The dimension along which the traces are fitted.
+        -1 by default.
+    minmethod : str, optional
+        The minimization method, as in the fitting preferences,
+        or 'Batch' to fit all traces of a file at once with runBatchFit.
+        'Powell' by default.
+    numfeval : int, optional
+        The maximum number of function evaluations per trace,
+        or of the whole batch for the 'Batch' method.
+        150 by default.
+    numWorkers : int, optional
+        The number of processes.
+        By default the number of CPUs is used.
+
+    Returns
+    -------
+    list of dict
+        The results of all traces, in the order of the files.
+    """
+    params = readParamFile(paramFile)
+    fitType = getFitType(fitType, params)
+    tasks = [(filePath, fitType, params, axis, minmethod, numfeval) for filePath in filePaths]
+    if numWorkers is None:
+        numWorkers = multiprocessing.cpu_count()
+    numWorkers = max(1, min(numWorkers, len(tasks)))
+    if numWorkers == 1:
+        results = [fitFileTask(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(numWorkers) as pool:
+            results = pool.map(fitFileTask, tasks, chunksize=1)
+    return [row for rows in results for row in rows]
+
+def writeResults(results, fileName):
+    """
+    Writes fit results to a file.
+    Files with a .json extension are written as JSON, all others as CSV.
+
+    Parameters
+    ----------
+    results : list of dict
+        The results as returned by fitFiles.
+    fileName : str
+        The path of the output file.
+    """
+    if os.path.splitext(fileName)[1].lower() == '.json':
+        with open(fileName, 'w') as fp:
+            json.dump(results, fp, indent=1)
+        return
+    header = []
+    for row in results:
+        for key in row:
+            if key not in header:
+                header.append(key)
+    with open(fileName, 'w', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=header)
+        writer.writeheader()
+        writer.writerows(results)
+
+def main(argv=None):
+    """
+    The command line entry point.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments.
+        By default sys.argv is used.
+    """
+    parser = argparse.ArgumentParser(description="Fit spectra with ssNake without the graphical interface.")
+    parser.add_argument('files', nargs='+', help="the spectra to fit")
+    parser.add_argument('-p', '--params', required=True, help="parameter file with the starting values, as written by 'Parameters to file'")
+    parser.add_argument('-o', '--output', required=True, help="output file, written as JSON for .json and as CSV otherwise")
+    parser.add_argument('-t', '--type', default=None, choices=list(BATCHFITTYPES), help="fit type, by default taken from the parameter file")
+    parser.add_argument('-a', '--axis', type=int, default=-1, help="dimension along which the traces are fitted, for MQMAS fits the direct dimension of the planes (default: -1)")
+    parser.add_argument('-m', '--method', default='Powell', choices=['Powell', 'Nelder-Mead', 'Least-squares', 'Batch'], help="minimization method, where Batch fits all relaxation or diffusion traces of a file at once (default: Powell)")
+    parser.add_argument('-n', '--numfeval', type=int, default=150, help="maximum number of function evaluations per trace, or of the whole batch for the Batch method (default: 150)")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="number of processes (default: number of CPUs)")
+    options = parser.parse_args(argv)
+    results = fitFiles(options.files, options.params, options.type, options.axis, options.method, options.numfeval, options.workers)
+    writeResults(results, options.output)
+    failed = [row for row in results if row['status'] != 'ok']
+    print("Fitted " + str(len(results)) + " traces, " + str(len(failed)) + " not converged or failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,629 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2016 - 2022 Bas van Meerten and Wouter Franssen
+
+# This file is part of ssNake.
+#
+# ssNake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ssNake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ssNake. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks the fitting routines on synthetic data.
+
+Every benchmark case simulates a dataset with one of the fit functions of ssNake and a fixed random seed,
+so the datasets are identical between runs and versions.
+For every size of a case the cost of a single fitFunc evaluation and the convergence of a full fit
+(the runFit call that the fitting windows run in a separate process) are measured.
+The number of evaluations, the wall time and the peak memory are written to a JSON report,
+which can be compared with the report of another version.
+
+Usage:
+    python fitBenchmark.py [-o report.json] [-c case ...] [-m method ...] [--quick] [--compare old.json]
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import time
+import tracemalloc
+import numpy as np
+import scipy
+import simFunctions as simFunc
+from fitEngine import FittingException, fitFunc, runFit
+
+REPORTFORMAT = 1
+MAGICANGLE = np.arctan(np.sqrt(2))
+
+def siteSpread(sites, width):
+    """
+    Returns positions of sites that are evenly spread around zero.
+
+    Parameters
+    ----------
+    sites : int
+        The number of sites.
+    width : float
+        The distance between the outer sites.
+
+    Returns
+    -------
+    ndarray
+        The positions.
+    """
+    if sites == 1:
+        return np.zeros(1)
+    return np.linspace(-0.5, 0.5, sites) * width
+
+def peakCase(rng, points, sites):
+    """
+    Lorentzian/Gaussian peaks, simulated in the time domain.
+
+    Parameters
+    ----------
+    rng : Generator
+        The random number generator.
+    points : int
+        The number of points of the spectrum.
+    sites : int
+        The number of peaks.
+
+    Returns
+    -------
+    dict
+        The definition of the fit, see makeProblem.
+    """
+    sw = 50e3
+    x = np.fft.fftshift(np.fft.fftfreq(points, 1.0 / sw))
+    pos = siteSpread(sites, 0.6 * sw) + rng.uniform(-100, 100, sites)
+    multi = [{"Position": pos[i], "Integral": rng.uniform(0.5, 1.5), "Lorentz": rng.uniform(100, 300), "Gauss": rng.uniform(100, 300)} for i in range(sites)]
+    return {'func': simFunc.peakSim, 'xax': [x], 'freq': [100e6], 'sw': [sw], 'extra': [],
+            'fftAxes': (0,), 'fftshiftAxes': (0,),
+            'single': {"Offset": 0.0, "Multiplier": 1.0}, 'multi': multi,
+            'fitted': ["Position", "Integral", "Lorentz", "Gauss"]}
+
+def relaxCase(rng, points, sites):
+    """
+    A multi-exponential relaxation curve.
+
+    Parameters
+    ----------
+    rng : Generator
+        The random number generator.
+    points : int
+        The number of delays.
+    sites : int
+        The number of exponentials.
+
+    Returns
+    -------
+    dict
+        The definition of the fit, see makeProblem.
+    """
+    x = np.logspace(-3, 1, points)
+    T = np.logspace(-2, 0, sites) * rng.uniform(0.8, 1.2, sites)
+    multi = [{'Coefficient': -2.0 / sites, 'T': T[i]} for i in range(sites)]
+    return {'func': simFunc.relaxationFunc, 'xax': [x], 'freq': [100e6], 'sw': [1.0], 'extra': [],
+            'fftAxes': (), 'fftshiftAxes': (),
+            'single': {'Amplitude': 1.0, 'Constant': 1.0}, 'multi': multi,
+            'fitted': ['Amplitude', 'Coefficient', 'T']}
+
+def quadCSACase(rng, points, sites, cheng, mas, numssb=32):
+    """
+    The central transition of a spin 5/2 with quadrupole and CSA interactions.
+
+    Parameters
+    ----------
+    rng : Generator
+        The random number generator.
+    points : int
+        The number of points of the spectrum.
+    sites : int
+        The number of sites.
+    cheng : int
+        The Cheng number of the powder averaging.
+    mas : int
+        The MAS type (0=static, 1=finite MAS, 2=infinite MAS).
+    numssb : int, optional
+        The number of sidebands of a finite MAS simulation.
+
+    Returns
+    -------
+    dict
+        The definition of the fit, see makeProblem.
+    """
+    sw = 100e3
+    x = np.fft.fftshift(np.fft.fftfreq(points, 1.0 / sw))
+    weight = simFunc.zcwOrientations(cheng, 1)[2]
+    D2 = simFunc.zcwTensors(cheng, 1, 2)
+    D4 = simFunc.zcwTensors(cheng, 1, 4)
+    extra = [False, 2.5, numssb, MAGICANGLE, D2, D4, weight, mas, 0]
+    pos = siteSpread(sites, 0.4 * sw) + rng.uniform(-500, 500, sites)
+    multi = []
+    for i in range(sites):
+        multi.append({"Definition1": pos[i] + 1500.0, "Definition2": pos[i] - 500.0, "Definition3": pos[i] - 1000.0,
+                      "Cq": rng.uniform(1.5, 2.5), 'eta': rng.uniform(0.2, 0.8), "Alpha": 0.0, "Beta": 0.0, "Gamma": 0.0,
+                      "Integral": rng.uniform(0.5, 1.5), "Lorentz": rng.uniform(100, 300), "Gauss": 0.0, "LorentzST": 100.0})
+    return {'func': simFunc.quadCSAFunc, 'xax': [x], 'freq': [130e6], 'sw': [sw], 'extra': extra,
+            'fftAxes': (0,), 'fftshiftAxes': (),
+            'single': {"Offset": 0.0, "Multiplier": 1.0, "Spinspeed": 10.0}, 'multi': multi,
+            'fitted': ["Definition1", "Definition2", "Definition3", "Cq", 'eta', "Integral", "Lorentz"]}
+
+def mqmasCase(rng, points, sites, cheng):
+    """
+    A sheared 3QMAS spectrum of a spin 3/2 under infinite MAS.
+
+    Parameters
+    ----------
+    rng : Generator
+        The random number generator.
+    points : list of int
+        The number of points of the indirect and the direct dimension.
+    sites : int
+        The number of sites.
+    cheng : int
+        The Cheng number of the powder averaging.
+
+    Returns
+    -------
+    dict
+        The definition of the fit, see makeProblem.
+    """
+    sw = [20e3, 50e3]
+    x = [np.fft.fftshift(np.fft.fftfreq(points[i], 1.0 / sw[i])) for i in range(2)]
+    weight = simFunc.zcwOrientations(cheng, 2)[2]
+    D2 = simFunc.zcwTensors(cheng, 2, 2)
+    D4 = simFunc.zcwTensors(cheng, 2, 4)
+    extra = [1.5, 3, 32, MAGICANGLE, D2, D4, weight, 0.0, 1.0, 2]
+    pos = siteSpread(sites, 0.1 * sw[1]) + rng.uniform(-200, 200, sites)
+    multi = [{"Position": pos[i], "Gauss": rng.uniform(100, 300), "Cq": rng.uniform(1.5, 2.5), 'eta': rng.uniform(0.2, 0.8),
+              "Integral": rng.uniform(0.5, 1.5), "Lorentz": rng.uniform(50, 150), "Lorentz1": rng.uniform(50, 150)} for i in range(sites)]
+    return {'func': simFunc.mqmasFunc, 'xax': x, 'freq': [130e6, 130e6], 'sw': sw, 'extra': extra,
+            'fftAxes': (0, 1), 'fftshiftAxes': (),
+            'single': {"Offset": 0.0, "Multiplier": 1.0, "Spinspeed": 10.0}, 'multi': multi,
+            'fitted': ["Position", "Gauss", "Cq", 'eta', "Integral", "Lorentz", "Lorentz1"]}
+
+def czjzekCase(rng, points, sites, library, cheng):
+    """
+    A Czjzek distribution of a spin 5/2 under infinite MAS.
+    The library is generated when the case is built, and is not part of the timings.
+
+    Parameters
+    ----------
+    rng : Generator
+        The random number generator.
+    points : int
+        The number of points of the spectrum.
+    sites : int
+        The number of sites.
+    library : int
+        The number of Cq and eta values of the library.
+    cheng : int
+        The Cheng number of the powder averaging of the library.
+
+    Returns
+    -------
+    dict
+        The definition of the fit, see makeProblem.
+    """
+    sw = 100e3
+    freq = 130e6
+    x = np.fft.fftshift(np.fft.fftfreq(points, 1.0 / sw))
+    weight = simFunc.zcwOrientations(cheng, 2)[2]
+    D2 = simFunc.zcwTensors(cheng, 2, 2)
+    D4 = simFunc.zcwTensors(cheng, 2, 4)
+    libExtra = [False, 2.5, 32, MAGICANGLE, D2, D4, weight, 2]
+    lib, cq, eta = simFunc.genLib(points, 0.0, 8.0, 0.0, 1.0, library, library, libExtra, freq, sw, np.inf)
+    pos = siteSpread(sites, 0.4 * sw) + rng.uniform(-500, 500, sites)
+    multi = [{"Position": pos[i], "Sigma": rng.uniform(1.0, 2.0), "Cq0": 0.0, 'eta0': 0.0,
+              "Integral": rng.uniform(0.5, 1.5), "Lorentz": rng.uniform(100, 300), "Gauss": 0.0} for i in range(sites)]
+    return {'func': simFunc.quadCzjzekFunc, 'xax': [x], 'freq': [freq], 'sw': [sw], 'extra': [0, 5, lib, cq, eta],
+            'fftAxes': (0,), 'fftshiftAxes': (),
+            'single': {"Offset": 0.0, "Multiplier": 1.0}, 'multi': multi,
+            'fitted': ["Position", "Sigma", "Integral", "Lorentz"]}
+
+# The benchmark cases, with the builder, the fixed options of the builder and the sizes to benchmark
+BENCHCASES = {'peaks': {'builder': peakCase, 'options': {},
+                        'sizes': [{'points': 1024, 'sites': 1}, {'points': 16384, 'sites': 1}, {'points': 16384, 'sites': 8}]},
+              'relax': {'builder': relaxCase, 'options': {},
+                        'sizes': [{'points': 32, 'sites': 1}, {'points': 512, 'sites': 3}]},
+              'quadcsa-static': {'builder': quadCSACase, 'options': {'mas': 0},
+                                 'sizes': [{'points': 2048, 'sites': 1, 'cheng': 10}, {'points': 2048, 'sites': 1, 'cheng': 15}]},
+              'quadcsa-finite': {'builder': quadCSACase, 'options': {'mas': 1},
+                                 'sizes': [{'points': 2048, 'sites': 1, 'cheng': 10, 'numssb': 16}, {'points': 2048, 'sites': 1, 'cheng': 10, 'numssb': 32}]},
+              'quadcsa-infinite': {'builder': quadCSACase, 'options': {'mas': 2},
+                                   'sizes': [{'points': 2048, 'sites': 1, 'cheng': 10}, {'points': 2048, 'sites': 2, 'cheng': 15}]},
+              'mqmas': {'builder': mqmasCase, 'options': {},
+                        'sizes': [{'points': [64, 256], 'sites': 1, 'cheng': 10}, {'points': [128, 512], 'sites': 2, 'cheng': 10}]},
+              'czjzek': {'builder': czjzekCase, 'options': {},
+                         'sizes': [{'points': 2048, 'sites': 1, 'library': 10, 'cheng': 10}, {'points': 2048, 'sites': 2, 'library': 20, 'cheng': 10}]}}
+
+def makeProblem(spec, rng, noise=0.01, perturb=0.05):
+    """
+    Builds the data, initial guess and arguments of a fit from the definition of a benchmark case.
+    The data is the simulation with the true values plus Gaussian noise,
+    the initial guess the true values of the fitted parameters with a relative random error.
+
+    Parameters
+    ----------
+    spec : dict
+        The definition as returned by the case builders, with the fit function,
+        the axes, frequencies and spectral widths of every dimension, the extra parameters,
+        the transform axes, the true values of the single and site dependent parameters
+        and the names of the parameters that are fitted.
+    rng : Generator
+        The random number generator.
+    noise : float, optional
+        The standard deviation of the noise relative to the maximum of the data.
+    perturb : float, optional
+        The standard deviation of the relative error of the initial guess.
+
+    Returns
+    -------
+    dict
+        The data, mask, initial guess, least squares value of the noise, fit arguments and fit functions.
+    """
+    singleNames = list(spec['single'])
+    multiNames = list(spec['multi'][0])
+    struc = {}
+    for name in singleNames + multiNames:
+        struc[name] = []
+    truth = []
+    argu = []
+
+    def add(name, value):
+        if name in spec['fitted']:
+            truth.append(float(value))
+            struc[name].append((1, len(truth) - 1))
+        else:
+            argu.append(float(value))
+            struc[name].append((0, len(argu) - 1))
+
+    for name in singleNames:
+        add(name, spec['single'][name])
+    for site in spec['multi']:
+        for name in multiNames:
+            add(name, site[name])
+    truth = np.array(truth)
+    args = ([len(spec['multi'])], [struc], [argu + [spec['extra']]], [spec['freq']], [spec['sw']], [1.0],
+            [spec['fftAxes']], [spec['fftshiftAxes']], [singleNames], [multiNames])
+    fitArgs = ([slice(0, len(truth))],) + args
+    funcs = [spec['func']]
+    xax = [spec['xax']]
+    data = fitFunc(funcs, (truth,), xax, fitArgs)
+    if data is None:
+        raise FittingException("Simulation of the benchmark data failed")
+    noise = noise * np.max(np.abs(data[0])) * rng.standard_normal(np.shape(data[0]))
+    guess = truth * (1 + perturb * rng.standard_normal(len(truth)))
+    return {'xax': xax, 'data': np.array([data[0] + noise]), 'mask': [1.0], 'guess': guess, 'noiseSumSquares': float(np.sum(noise**2)), 'args': fitArgs, 'funcs': funcs}
+
+def peakMemory(func):
+    """
+    Runs a function with tracemalloc to measure the peak memory it allocates.
+
+    Parameters
+    ----------
+    func : function
+        The function to run without arguments.
+
+    Returns
+    -------
+    int
+        The peak of the traced memory in bytes.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def benchEvaluation(problem, repeat=5, minTime=0.2, memory=True):
+    """
+    Times the evaluation of fitFunc with the initial guess.
+
+    Parameters
+    ----------
+    problem : dict
+        The fit as returned by makeProblem.
+    repeat : int, optional
+        The number of timing rounds, of which the fastest is used.
+    minTime : float, optional
+        The minimum duration in seconds of a timing round, which sets the number of evaluations per round.
+    memory : bool, optional
+        If True, the peak memory of one evaluation is measured.
+
+    Returns
+    -------
+    dict
+        The time per evaluation in seconds, the number of evaluations per round and the peak memory in bytes.
+    """
+    def evaluate():
+        fitFunc(problem['funcs'], (problem['guess'],), problem['xax'], problem['args'])
+
+    start = time.perf_counter()
+    evaluate()
+    single = max(time.perf_counter() - start, 1e-6)
+    number = max(1, int(minTime / single))
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            evaluate()
+        best = min(best, (time.perf_counter() - start) / number)
+    result = {'evalTime': best, 'evaluations': number}
+    if memory:
+        result['evalPeakMemory'] = peakMemory(evaluate)
+    return result
+
+def benchFit(problem, minmethod, numfeval, memory=True):
+    """
+    Runs a full fit and measures its convergence.
+
+    Parameters
+    ----------
+    problem : dict
+        The fit as returned by makeProblem.
+    minmethod : str
+        The minimization method, as in the fitting preferences.
+    numfeval : int
+        The maximum number of function evaluations.
+    memory : bool, optional
+        If True, the fit is run a second time to measure the peak memory.
+
+    Returns
+    -------
+    dict
+        The status, number of evaluations and iterations, least squares value and its ratio to that of the noise,
+        wall time in seconds and peak memory in bytes.
+    """
+    def fit():
+        return runFit(problem['xax'], problem['data'], problem['mask'], problem['guess'], problem['args'], problem['funcs'], minmethod, numfeval)
+
+    start = time.perf_counter()
+    fitVal = fit()
+    result = {'wallTime': time.perf_counter() - start}
+    if fitVal is None or isinstance(fitVal, str):
+        result['status'] = fitVal if fitVal is not None else 'Optimal parameters not found'
+        return result
+    result['status'] = 'ok' if fitVal.success else str(fitVal.message)
+    result['nfev'] = int(fitVal.nfev)
+    result['nit'] = int(getattr(fitVal, 'nit', 0))
+    result['sumSquares'] = float(fitVal.sumSquares)
+    # The least squares value of the true parameters is that of the noise, so a converged fit has a ratio of about 1
+    result['costRatio'] = result['sumSquares'] / problem['noiseSumSquares']
+    if memory:
+        result['peakMemory'] = peakMemory(fit)
+    return result
+
+def sizeLabel(size):
+    """
+    Returns a readable label of a benchmark size.
+
+    Parameters
+    ----------
+    size : dict
+        The size as given in BENCHCASES.
+
+    Returns
+    -------
+    str
+        The label, for example 'points=1024 sites=2'.
+    """
+    parts = []
+    for key in size:
+        value = size[key]
+        if isinstance(value, (list, tuple)):
+            value = 'x'.join(str(item) for item in value)
+        parts.append(key + '=' + str(value))
+    return ' '.join(parts)
+
+def runBenchmarks(cases=None, methods=('Powell', 'Least-squares'), numfeval=500, repeat=5, quick=False, memory=True, seed=0, log=None):
+    """
+    Runs the benchmark cases.
+
+    Parameters
+    ----------
+    cases : list of str, optional
+        The keys in BENCHCASES to run.
+        By default all cases are run.
+    methods : list of str, optional
+        The minimization methods of the fits.
+    numfeval : int, optional
+        The maximum number of function evaluations of a fit.
+    repeat : int, optional
+        The number of timing rounds of the evaluations.
+    quick : bool, optional
+        If True, only the first size of every case is run.
+    memory : bool, optional
+        If True, the peak memory is measured.
+    seed : int, optional
+        The seed of the random number generator of the datasets.
+    log : function, optional
+        Function that is called with a line of text after every benchmark.
+
+    Returns
+    -------
+    list of dict
+        The results, with the case, the size and its label, the evaluation measurements
+        and the fit measurements per method.
+    """
+    if cases is None:
+        cases = list(BENCHCASES)
+    results = []
+    for case in cases:
+        if case not in BENCHCASES:
+            raise FittingException("Benchmark case '" + case + "' does not exist, use one of: " + ", ".join(BENCHCASES))
+        sizes = BENCHCASES[case]['sizes']
+        if quick:
+            sizes = sizes[:1]
+        for size in sizes:
+            # Every dataset has its own seed, so that selecting cases does not change the data
+            rng = np.random.default_rng([seed, list(BENCHCASES).index(case), BENCHCASES[case]['sizes'].index(size)])
+            options = dict(BENCHCASES[case]['options'], **size)
+            problem = makeProblem(BENCHCASES[case]['builder'](rng, **options), rng)
+            result = {'case': case, 'size': size, 'label': sizeLabel(size), 'numParams': len(problem['guess'])}
+            result.update(benchEvaluation(problem, repeat, memory=memory))
+            result['fits'] = {}
+            for method in methods:
+                result['fits'][method] = benchFit(problem, method, numfeval, memory)
+            results.append(result)
+            if log is not None:
+                log(formatResult(result))
+    return results
+
+def formatResult(result):
+    """
+    Returns a line of text with the main measurements of a benchmark.
+
+    Parameters
+    ----------
+    result : dict
+        A result as returned by runBenchmarks.
+
+    Returns
+    -------
+    str
+        The case, size, evaluation time and the evaluations and wall time per fit method.
+    """
+    line = result['case'] + ' [' + result['label'] + ']: eval ' + '{:.3g}'.format(result['evalTime'] * 1e3) + ' ms'
+    for method, fit in result['fits'].items():
+        line += ', ' + method + ' ' + '{:.3g}'.format(fit['wallTime']) + ' s'
+        if 'nfev' in fit:
+            line += ' (' + str(fit['nfev']) + ' evals)'
+        if fit['status'] != 'ok':
+            line += ' ' + fit['status']
+    return line
+
+def makeReport(results, label=''):
+    """
+    Combines benchmark results with a description of the environment.
+
+    Parameters
+    ----------
+    results : list of dict
+        The results as returned by runBenchmarks.
+    label : str, optional
+        A label for the report, for example the version that is benchmarked.
+
+    Returns
+    -------
+    dict
+        The report.
+    """
+    return {'format': REPORTFORMAT,
+            'label': label,
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'environment': {'python': platform.python_version(),
+                            'numpy': np.__version__,
+                            'scipy': scipy.__version__,
+                            'platform': platform.platform(),
+                            'processor': platform.processor()},
+            'results': results}
+
+def compareReports(old, new):
+    """
+    Compares the results of two benchmark reports.
+    Only the benchmarks that are in both reports are compared.
+
+    Parameters
+    ----------
+    old : dict
+        The reference report.
+    new : dict
+        The report to compare with the reference.
+
+    Returns
+    -------
+    list of tuple
+        Per benchmark and quantity the case, size label, quantity, old value, new value and ratio new/old.
+    """
+    if old.get('format') != REPORTFORMAT:
+        raise FittingException("Benchmark report has an unsupported format")
+    reference = {(result['case'], result['label']): result for result in old['results']}
+    rows = []
+
+    def compare(case, label, name, oldValue, newValue):
+        if oldValue is None or newValue is None:
+            return
+        ratio = newValue / oldValue if oldValue else np.nan
+        rows.append((case, label, name, oldValue, newValue, ratio))
+
+    for result in new['results']:
+        key = (result['case'], result['label'])
+        if key not in reference:
+            continue
+        oldResult = reference[key]
+        compare(key[0], key[1], 'evalTime', oldResult.get('evalTime'), result.get('evalTime'))
+        compare(key[0], key[1], 'evalPeakMemory', oldResult.get('evalPeakMemory'), result.get('evalPeakMemory'))
+        for method, fit in result['fits'].items():
+            oldFit = oldResult['fits'].get(method, {})
+            for name in ['wallTime', 'nfev', 'costRatio', 'peakMemory']:
+                compare(key[0], key[1], method + ' ' + name, oldFit.get(name), fit.get(name))
+    return rows
+
+def formatComparison(rows):
+    """
+    Formats a comparison as a table.
+
+    Parameters
+    ----------
+    rows : list of tuple
+        The comparison as returned by compareReports.
+
+    Returns
+    -------
+    str
+        The table, with a line per row.
+    """
+    lines = []
+    for case, label, name, oldValue, newValue, ratio in rows:
+        lines.append('{:<18} {:<40} {:<26} {:>12.4g} {:>12.4g} {:>7.2f}x'.format(case, label, name, oldValue, newValue, ratio))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    """
+    The command line entry point.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        The command line arguments.
+        By default sys.argv is used.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the fitting of ssNake on synthetic data.")
+    parser.add_argument('-o', '--output', default=None, help="JSON file to write the report to")
+    parser.add_argument('-c', '--cases', nargs='+', default=None, choices=list(BENCHCASES), help="cases to run (default: all)")
+    parser.add_argument('-m', '--methods', nargs='+', default=['Powell', 'Least-squares'], choices=['Powell', 'Nelder-Mead', 'Least-squares'], help="minimization methods of the fits (default: Powell Least-squares)")
+    parser.add_argument('-n', '--numfeval', type=int, default=500, help="maximum number of function evaluations per fit (default: 500)")
+    parser.add_argument('-r', '--repeat', type=int, default=5, help="number of timing rounds of the evaluations (default: 5)")
+    parser.add_argument('-l', '--label', default='', help="label of the report, for example the version")
+    parser.add_argument('-s', '--seed', type=int, default=0, help="seed of the synthetic datasets (default: 0)")
+    parser.add_argument('--quick', action='store_true', help="only run the smallest size of every case")
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="do not measure the peak memory")
+    parser.add_argument('--compare', default=None, help="JSON report to compare the results with")
+    options = parser.parse_args(argv)
+    results = runBenchmarks(options.cases, options.methods, options.numfeval, options.repeat, options.quick, options.memory, options.seed, log=print)
+    report = makeReport(results, options.label)
+    if options.output is not None:
+        with open(options.output, 'w') as fp:
+            json.dump(report, fp, indent=1)
+    if options.compare is not None:
+        with open(options.compare) as fp:
+            old = json.load(fp)
+        print(formatComparison(compareReports(old, report)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1834 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2016 - 2022 Bas van Meerten and Wouter Franssen
+
+# This file is part of ssNake.
+#
+# ssNake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ssNake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ssNake. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import csv
+import multiprocessing
+import queue
+import re
+import time
+import collections
+import numpy as np
+import scipy.optimize
+import scipy.sparse
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:  # Python < 3.8, arrays are pickled instead
+    shared_memory = None
+from safeEval import safeEval
+import simFunctions as simFunc
+import specIO as io
+import spectrum as sc
+
+SHAREDMINSIZE = 2**16  # Arrays of at least this number of bytes are sent to the fit workers via shared memory
+
+
+class FittingException(sc.SpectrumException):
+    pass
+
+
+def checkLinkTuple(inp):
+    if len(inp) == 2:
+        inp += (1, 0, 0)
+    elif len(inp) == 3:
+        inp += (0, 0)
+    return inp
+
+def interpretParam(strList):
+    """
+    Checks a given list of strings to interpret them as fit parameters.
+
+    Parameters
+    ----------
+    strList : list of lists of str
+
+    Returns
+    -------
+    list
+        List of values or tuples (as long as they match a link tuple).
+    """
+    data = []
+    for i, _ in enumerate(strList):
+        tmp = []
+        for j, _ in enumerate(strList[i]):
+            if strList[i][j][0] == '*':
+                tmp.append([safeEval(strList[i][j][1:]), True])
+            else:
+                tmp.append([safeEval(strList[i][j]), False])
+            if isinstance(tmp[-1][0], tuple):
+                tmp[-1][0] = checkLinkTuple(tmp[-1][0])
+        data.append(tmp)
+    return data
+
+def readParamFile(fileName):
+    """
+    Reads the fit parameters from a file as generated by paramToFile.
+
+    Parameters
+    ----------
+    fileName : str
+        The path of the parameter file.
+
+    Returns
+    -------
+    dict
+        The name of the fit type ('fitType'), the extra parameters before and after the fit parameters ('preParams' and 'postParams'),
+        the excluded regions ('removeLimits'), the axis type and ppm setting of the saved values ('axType' and 'ppm'),
+        and the names and values of the site independent ('singleNames' and 'singleVals') and site dependent ('multiNames' and 'multiVals') parameters.
+        The values are lists of [value, fixed] pairs, with one list for singleVals and a list per site for multiVals.
+        axType is None when the file does not contain units.
+    """
+    with open(fileName, "r") as fp:
+        report = fp.read()
+    splitReport = re.split("#{20,}\n", report)
+    postReport = splitReport[1]
+    postReport = re.split("#!", postReport)
+    if len(postReport) == 1:
+        postReport = []
+    else:
+        postReport = postReport[1:]
+    postParams = {}
+    for i, _ in enumerate(postReport):
+        tmp = postReport[i].split('\n', 1)
+        postParams[tmp[0].strip()] = tmp[1].strip()
+    splitReport = re.split("#\?", splitReport[0])
+    preReport = splitReport[0].split('\n')
+    preParams = {}
+    removeLimits = {'invert' : False, 'limits': []}
+    fitType = None
+    savedAxType = None
+    savedPPM = False
+    for line in preReport:
+        tmp = line.strip()
+        if tmp.startswith("#!"):
+            tmp = tmp[2:].strip().split('=', 1)
+            preParams[tmp[0].strip()] = tmp[1].strip()
+        elif tmp.startswith("# Fit:"):
+            fitType = tmp.split(":", 1)[1].strip()
+        elif tmp.startswith("# Excluded:"):
+            if "invert" in tmp:
+                removeLimits["invert"] = True
+            else:
+                removeLimits["limits"] = safeEval(tmp.split(":")[1])
+        elif tmp.startswith("# Units:"):
+            tmp2 = tmp.split(":")[1]
+            if 'ppm' in tmp2:
+                savedPPM = True
+                savedAxType = 0
+            elif 'MHz' in tmp2 or 'us' in tmp2:
+                savedAxType = 2
+            elif 'kHz' in tmp2 or 'ms' in tmp2:
+                savedAxType = 1
+            else:
+                savedAxType = 0
+    singleReport = splitReport[1].split('\n')
+    multiReport = splitReport[2].split('\n')
+    singleNames = singleReport[0].split()
+    singleVals = []
+    for line in singleReport[1:]:
+        tmp = line.strip()
+        if tmp and tmp[0] != '#':
+            singleVals.append(tmp.split())
+    if len(singleVals) > 1:
+        raise FittingException("Incorrect number of parameters in file")
+    singleVals = interpretParam(singleVals)
+    multiNames = multiReport[0].split()
+    multiVals = []
+    for line in multiReport[1:]:
+        tmp = line.strip()
+        if tmp and tmp[0] != '#':
+            multiVals.append(tmp.split())
+    multiVals = interpretParam(multiVals)
+    return {'fitType': fitType, 'preParams': preParams, 'postParams': postParams, 'removeLimits': removeLimits,
+            'axType': savedAxType, 'ppm': savedPPM,
+            'singleNames': singleNames, 'singleVals': singleVals, 'multiNames': multiNames, 'multiVals': multiVals}
+
+def loadCzjzekLib(libName, xax):
+    """
+    Loads a Czjzek library from a set of files named libName-eta-Cq with any extension, with Cq in MHz.
+    The spectra are regridded to the x-axis of the fit and converted to FIDs.
+
+    Parameters
+    ----------
+    libName : str
+        The path of the library files without the eta and Cq values.
+    xax : ndarray
+        The frequency axis of the fitted spectrum.
+
+    Returns
+    -------
+    tuple
+        The FIDs (lib), the Cq values in Hz (cqLib) and the eta values (etaLib) of the library, sorted by eta and Cq.
+
+    Raises
+    ------
+    FittingException
+        When a spectrum is not 1D or the library is not a rectangular grid in Cq and eta.
+    """
+    dirName, libName = os.path.split(libName)
+    cq = []
+    eta = []
+    data = []
+    for name in os.listdir(dirName if dirName else os.curdir):
+        matchName = re.search(re.escape(libName) + r"-(\d+\.\d+)-(\d+\.\d+)\.\w*$", name)
+        if matchName:
+            eta.append(float(matchName.group(1)))
+            cq.append(float(matchName.group(2)))
+            libData = io.autoLoad(os.path.join(dirName, name))
+            if libData.ndim() != 1:
+                raise FittingException("A spectrum in the library is not a 1D spectrum.")
+            if not libData.spec[0]:
+                libData.complexFourier(0)
+            libData.regrid([xax[0], xax[-1]], len(xax), 0)
+            libData.fftshift(0)
+            libData.complexFourier(0)
+            data.append(libData.getHyperData(0))
+            data[-1][0] *= 0.5
+    if not data:
+        raise FittingException("No library files found for " + libName)
+    cq = np.array(cq) * 1e6
+    eta = np.array(eta)
+    data = np.array(data)
+    if len(cq) != len(np.unique(cq)) * len(np.unique(eta)):
+        raise FittingException("Library to be loaded is not of a rectangular grid in Cq and eta.")
+    sortIndex = np.lexsort((cq, eta))
+    return data[sortIndex], cq[sortIndex], eta[sortIndex]
+
+def lstSqrs(dataList, maskList, *args):
+    """
+    Simulates spectra and calculates the least squares value with a given list of data.
+
+    Parameters
+    ----------
+    dataList : list of arrays
+        The list of spectra to compare with the simulations.
+    *args
+        All other arguments are passed to fitFunc.
+
+    Returns
+    -------
+    float
+        The sum of the least squares values of the spectra.
+    """
+    simData = fitFunc(*args)
+    if simData is None:
+        return np.inf
+    costValue = 0
+    for i,_ in enumerate(dataList):
+        costValue += np.sum(maskList[i]*(dataList[i] - simData[i])**2)
+    return costValue
+
+class CostCache(object):
+    """
+    A bounded least recently used cache in front of a cost function.
+    The parameter vectors are rounded to a number of significant digits before lookup,
+    such that (nearly) identical vectors revisited by a derivative-free minimizer are only simulated once.
+    """
+
+    def __init__(self, costFunc, size=1000, digits=12):
+        """
+        Initializes the cache.
+
+        Parameters
+        ----------
+        costFunc : function
+            The cost function, which takes the parameter vector as its only argument.
+        size : int, optional
+            The maximum number of cached values.
+            1000 by default.
+        digits : int, optional
+            The number of significant digits used to compare parameter vectors.
+            12 by default.
+        """
+        self.costFunc = costFunc
+        self.size = size
+        self.digits = digits
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, param):
+        """
+        Returns the cache key of a parameter vector.
+
+        Parameters
+        ----------
+        param : array_like
+            The parameter vector.
+
+        Returns
+        -------
+        bytes
+            The rounded parameter vector as bytes.
+        """
+        param = np.array(param, dtype=float).flatten()
+        nonZero = np.isfinite(param) & (param != 0)
+        scale = np.zeros_like(param)
+        scale[nonZero] = 10.0**(self.digits - 1 - np.floor(np.log10(np.abs(param[nonZero]))))
+        param[nonZero] = np.round(param[nonZero] * scale[nonZero]) / scale[nonZero]
+        param[param == 0] = 0.0  # Avoid a different key for -0.0
+        return param.tobytes()
+
+    def __call__(self, param):
+        """
+        Returns the cost of a parameter vector, from the cache when possible.
+
+        Parameters
+        ----------
+        param : array_like
+            The parameter vector.
+
+        Returns
+        -------
+        float
+            The cost value.
+        """
+        key = self.key(param)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        value = self.costFunc(param)
+        self.cache[key] = value
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+        return value
+
+def lstSqrsResidual(dataList, maskList, *args):
+    """
+    Simulates spectra and calculates the masked residual vector with a given list of data.
+
+    Parameters
+    ----------
+    dataList : list of arrays
+        The list of spectra to compare with the simulations.
+    maskList : list
+        The list with the masks of the spectra.
+    *args
+        All other arguments are passed to fitFunc.
+
+    Returns
+    -------
+    ndarray
+        The concatenated residuals of all spectra, weighted by the square root of the masks.
+    """
+    simData = fitFunc(*args)
+    size = sum([np.size(data) for data in dataList])
+    if simData is None:
+        return np.full(size, 1e100)
+    return np.concatenate([np.ravel(np.sqrt(maskList[i]) * (dataList[i] - simData[i]) * np.ones(np.shape(dataList[i]))) for i, _ in enumerate(dataList)])
+
+def lstSqrsJacobian(dataList, maskList, funcs, params, allX, args, plan):
+    """
+    Calculates the Jacobian of lstSqrsResidual from the analytic derivatives of the fit functions.
+
+    Parameters
+    ----------
+    dataList : list of arrays
+        The list of spectra to compare with the simulations.
+    maskList : list
+        The list with the masks of the spectra.
+    funcs : list of functions
+        The fit functions, all should have an entry in simFunctions.GRADIENTS.
+    params : tuple
+        The tuple with the function parameters.
+    allX : list of arrays
+        The list with x-axes.
+    args : tuple
+        Additional arguments for the fitting functions.
+    plan : ParamPlan
+        The compiled parameter mapping of args.
+
+    Returns
+    -------
+    ndarray
+        The Jacobian with a row per residual and a column per fit parameter.
+    """
+    allValues = plan.values(params[0])
+    numParams = plan.numParams
+    jacList = []
+    for n, _ in enumerate(allX):
+        x = allX[n]
+        shape = [len(item) for item in x]
+        if args[7][n] or args[8][n]:
+            deriv = np.zeros([numParams] + shape, dtype=complex)
+        else:
+            deriv = np.zeros([numParams] + shape)
+        numExp = args[1][n]
+        extra = args[3][n][-1]
+        values = allValues[n]
+        idx = plan.idx[n]
+        mult = plan.mult[n]
+        numSingle = plan.numSingle[n]
+        gradFunc = simFunc.GRADIENTS[funcs[n]]
+        singleVars = values[:numSingle, 0].tolist()
+        for i in range(numExp):
+            inputVars = singleVars + values[numSingle:, i].tolist()
+            grads = gradFunc(x, args[4][n], args[5][n], args[6][n], extra, *inputVars)
+            for row, grad in enumerate(grads):
+                site = 0 if row < numSingle else i
+                if grad is not None and idx[row, site] < numParams:
+                    deriv[idx[row, site]] += mult[row, site] * grad
+        fftAxes = tuple(axis if axis < 0 else axis + 1 for axis in args[7][n])
+        fftshiftAxes = tuple(axis if axis < 0 else axis + 1 for axis in args[8][n])
+        if fftAxes or fftshiftAxes:
+            deriv = transformSim(deriv, fftAxes, fftshiftAxes)
+        deriv = np.real(deriv)
+        offsetRow = plan.offsetRow[n]
+        if offsetRow is not None and idx[offsetRow, 0] < numParams:
+            deriv[idx[offsetRow, 0]] += mult[offsetRow, 0]
+        if plan.crops[n] is not None:
+            deriv = deriv[(slice(None),) + plan.crops[n]]
+        deriv = -np.sqrt(maskList[n]) * deriv * np.ones(np.shape(dataList[n]))
+        jacList.append(deriv.reshape(numParams, -1))
+    return np.concatenate(jacList, axis=1).T
+
+def mpFit(xax, data1D, maskList, guess, args, queue, funcs, minmethod, numfeval, profile=False):
+    """
+    The minimization function running in an separate process.
+
+    Parameters
+    ----------
+    xax : list of arrays
+        List of the x-axes of the data.
+    data1D : array or list of arrays
+        Array with the data to be fit.
+    guess : list
+        List with the initial guess values.
+    args : tuple
+        The tuple with additional values.
+    queue : Queue
+        The queue to communicate with the main process.
+        On success the results are put in this queue.
+        When a SimException is raised, the error message is put on this queue.
+        When the simulation fails otherwise, None is put on this queue.
+    funcs : list of functions
+        The functions to run per data in data1D.
+    minmethod : str
+        The minimization method of Scipy minimize to use.
+    numfeval : int
+        The maximum number of function evaluations.
+    profile : bool, optional
+        If True, the time per stage of the evaluations is measured with a FitProfiler
+        and its summary is returned in the profile of the result.
+    """
+    if profile:
+        queue.put(runProfiled(runFit, xax, data1D, maskList, guess, args, funcs, minmethod, numfeval))
+    else:
+        queue.put(runFit(xax, data1D, maskList, guess, args, funcs, minmethod, numfeval))
+
+def runFit(xax, data1D, maskList, guess, args, funcs, minmethod, numfeval, report=None):
+    """
+    Runs the minimization.
+
+    Parameters
+    ----------
+    xax : list of arrays
+        List of the x-axes of the data.
+    data1D : array or list of arrays
+        Array with the data to be fit.
+    maskList : list
+        The list with the masks of the data.
+    guess : list
+        List with the initial guess values.
+    args : tuple
+        The tuple with additional values.
+    funcs : list of functions
+        The functions to run per data in data1D.
+    minmethod : str
+        The minimization method of Scipy minimize to use.
+        'Least-squares' uses the trust region reflective least-squares solver of Scipy instead,
+        with analytic Jacobians when these are available for all fit functions.
+    numfeval : int
+        The maximum number of function evaluations.
+    report : function, optional
+        Function that is called at regular intervals with a dictionary describing the progress of the fit.
+        See FitProgress for its contents.
+
+    Returns
+    -------
+    OptimizeResult, str or None
+        The result of the fit, with the least squares value in sumSquares
+        and for the derivative-free methods the number of cost function cache hits and misses in cacheHits and cacheMisses.
+        When a SimException is raised, the error message is returned.
+        When the simulation fails otherwise, None is returned.
+    """
+    try:
+        plan = ParamPlan(args)
+        xax, data1D, maskList, plan.crops = cropToMask(xax, data1D, maskList, funcs, args)
+        progress = FitProgress(report)
+        if minmethod == 'Least-squares':
+            if all(func in simFunc.GRADIENTS for func in funcs):
+                jac = progress.countIterations(lambda param: lstSqrsJacobian(data1D, maskList, funcs, (param,), xax, args, plan))
+            else:
+                jac = '2-point'
+            resid = progress.trackResidual(lambda param: lstSqrsResidual(data1D, maskList, funcs, (param,), xax, args, plan))
+            fitVal = scipy.optimize.least_squares(resid, guess, jac=jac, method='trf', x_scale='jac', diff_step=1e-3, max_nfev=numfeval)
+            fitVal.nit = fitVal.njev
+            fitVal.sumSquares = 2 * fitVal.cost
+        else:
+            cost = CostCache(lambda param: lstSqrs(data1D, maskList, funcs, (param,), xax, args, plan))
+            fitVal = scipy.optimize.minimize(progress.trackCost(cost), guess, method=minmethod, callback=progress.iterated, options={'maxfev': numfeval})
+            fitVal.sumSquares = float(fitVal.fun)
+            fitVal.cacheHits = cost.hits
+            fitVal.cacheMisses = cost.misses
+    except simFunc.SimException as e:
+        fitVal = str(e)
+    except Exception:
+        fitVal = None
+    return fitVal
+
+def runBatchFit(xax, data, mask, guesses, fixed, args, funcs, numfeval, report=None):
+    """
+    Fits a set of curves with the same parameter structure at once, each with its own parameters.
+    The curves are fitted as one least-squares problem with a sparse block diagonal Jacobian,
+    using the analytic derivatives of the fit function.
+
+    Parameters
+    ----------
+    xax : list of arrays
+        List with the x-axes of the single spectrum, which are shared by all curves.
+    data : ndarray
+        The curves to be fit, with a row per curve.
+    mask : float or ndarray
+        The mask of the curves, with a row per curve when it is an array.
+    guesses : ndarray
+        The initial guess of the fit parameters, with a row per curve.
+    fixed : ndarray
+        The values of the parameters that are not fitted, with a row per curve, as in ParamPlan.fixed.
+    args : tuple
+        The additional parameters of the fit of the first curve, as passed to fitFunc.
+        Only the structure and extra parameters are used.
+    funcs : list of functions
+        The fit function of the spectrum, which should be in simFunctions.BATCHED.
+    numfeval : int
+        The maximum number of function evaluations.
+    report : function, optional
+        Function that is called at regular intervals with a dictionary describing the progress of the fit.
+        See FitProgress for its contents.
+
+    Returns
+    -------
+    OptimizeResult, str or None
+        The result of the fit, with the parameters in x with a row per curve.
+        The least squares value and RMSD of every curve are given in sumSquares and rmsd.
+        When a SimException is raised, the error message is returned.
+        When the simulation fails otherwise, None is returned.
+    """
+    try:
+        func = funcs[0]
+        gradFunc = simFunc.GRADIENTS[func]
+        plan = ParamPlan(args)
+        numCurves, numPoints = data.shape
+        numParams = plan.numParams
+        idx = plan.idx[0]
+        mult = plan.mult[0]
+        offset = plan.offset[0]
+        numSingle = plan.numSingle[0]
+        offsetRow = plan.offsetRow[0]
+        numExp = args[1][0]
+        extra = args[3][0][-1]
+        inputs = (xax[0], args[4][0], args[5][0], args[6][0], extra)
+        weight = np.broadcast_to(np.sqrt(mask), data.shape)
+        fixed = np.reshape(fixed, (numCurves, -1))
+        rows = np.repeat(np.arange(numCurves * numPoints), numParams)
+        cols = np.broadcast_to((np.arange(numCurves) * numParams)[:, None, None] + np.arange(numParams), (numCurves, numPoints, numParams)).ravel()
+
+        def values(param):
+            full = np.concatenate((np.reshape(param, (numCurves, numParams)), fixed), axis=1)
+            return full[:, idx] * mult + offset
+
+        def simulate(param):
+            vals = values(param)
+            sim = func(*(inputs + tuple(vals[:, row, 0] for row in range(numSingle)) + tuple(vals[:, row] for row in range(numSingle, len(idx)))))
+            if offsetRow is not None:
+                sim = sim + vals[:, offsetRow, :1]
+            return sim
+
+        def residual(param):
+            return np.ravel(weight * (data - simulate(param)))
+
+        def jacobian(param):
+            vals = values(param)
+            deriv = np.zeros((numCurves, numPoints, numParams))
+            for i in range(numExp):
+                inputVars = [vals[:, row, 0] for row in range(numSingle)] + [vals[:, row, i] for row in range(numSingle, len(idx))]
+                grads = gradFunc(*(inputs + tuple(inputVars)))
+                for row, grad in enumerate(grads):
+                    site = 0 if row < numSingle else i
+                    if grad is not None and idx[row, site] < numParams:
+                        deriv[:, :, idx[row, site]] += mult[row, site] * grad
+            if offsetRow is not None and idx[offsetRow, 0] < numParams:
+                deriv[:, :, idx[offsetRow, 0]] += mult[offsetRow, 0]
+            deriv *= -weight[:, :, None]
+            return scipy.sparse.csr_matrix((deriv.ravel(), (rows, cols)), shape=(numCurves * numPoints, numCurves * numParams))
+
+        progress = FitProgress(report)
+        fitVal = scipy.optimize.least_squares(progress.trackResidual(residual), np.ravel(guesses), jac=progress.countIterations(jacobian), method='trf', x_scale='jac', tr_solver='lsmr', max_nfev=numfeval)
+        resid = np.reshape(fitVal.fun, (numCurves, numPoints))
+        fitVal.x = np.reshape(fitVal.x, (numCurves, numParams))
+        fitVal.nit = fitVal.njev
+        fitVal.sumSquares = np.sum(resid**2, axis=1)
+        fitVal.rmsd = np.sqrt(np.mean((data - simulate(fitVal.x))**2, axis=1))
+    except simFunc.SimException as e:
+        fitVal = str(e)
+    except Exception:
+        fitVal = None
+    return fitVal
+
+class FitProgress(object):
+    """
+    Keeps track of the best parameters of a running fit and reports the progress at regular intervals.
+    The reports are dictionaries with the number of iterations ('nit') and cost evaluations ('nfev'),
+    the lowest cost so far ('cost'), the parameters with this cost ('x') and the number of evaluations per second ('rate').
+    """
+
+    def __init__(self, report=None, interval=0.5):
+        """
+        Initializes the progress tracker.
+
+        Parameters
+        ----------
+        report : function, optional
+            The function that is called with the progress reports.
+            No reports are made when None (default).
+        interval : float, optional
+            The minimum number of seconds between two reports.
+            0.5 by default.
+        """
+        self.report = report
+        self.interval = interval
+        self.start = time.time()
+        self.lastReport = self.start
+        self.nit = 0
+        self.nfev = 0
+        self.bestCost = np.inf
+        self.bestX = None
+
+    def evaluated(self, param, cost):
+        """
+        Registers a cost evaluation and reports the progress when the interval has passed.
+
+        Parameters
+        ----------
+        param : array_like
+            The evaluated parameters.
+        cost : float
+            The cost of the parameters.
+        """
+        self.nfev += 1
+        if cost < self.bestCost:
+            self.bestCost = cost
+            self.bestX = np.array(param, dtype=float)
+        if self.report is not None:
+            now = time.time()
+            if now - self.lastReport >= self.interval:
+                self.lastReport = now
+                self.report(self.info(now))
+
+    def iterated(self, *args):
+        """
+        Registers an iteration of the minimizer.
+        """
+        self.nit += 1
+
+    def info(self, now=None):
+        """
+        Returns the progress report.
+
+        Parameters
+        ----------
+        now : float, optional
+            The current time.
+
+        Returns
+        -------
+        dict
+            The progress report.
+        """
+        if now is None:
+            now = time.time()
+        return {'nit': self.nit, 'nfev': self.nfev, 'cost': self.bestCost, 'x': self.bestX, 'rate': self.nfev / max(now - self.start, 1e-9)}
+
+    def trackCost(self, costFunc):
+        """
+        Wraps a cost function such that its evaluations are tracked.
+
+        Parameters
+        ----------
+        costFunc : function
+            The cost function.
+
+        Returns
+        -------
+        function
+            The tracked cost function.
+        """
+        def tracked(param):
+            cost = costFunc(param)
+            self.evaluated(param, cost)
+            return cost
+        return tracked
+
+    def trackResidual(self, residFunc):
+        """
+        Wraps a residual function such that its evaluations are tracked, with the sum of squares as cost.
+
+        Parameters
+        ----------
+        residFunc : function
+            The residual function.
+
+        Returns
+        -------
+        function
+            The tracked residual function.
+        """
+        def tracked(param):
+            resid = residFunc(param)
+            self.evaluated(param, np.sum(resid**2))
+            return resid
+        return tracked
+
+    def countIterations(self, func):
+        """
+        Wraps a function that is called once per iteration, such as a Jacobian, to count the iterations.
+
+        Parameters
+        ----------
+        func : function
+            The function to wrap.
+
+        Returns
+        -------
+        function
+            The wrapped function.
+        """
+        def counted(*args):
+            self.iterated()
+            return func(*args)
+        return counted
+
+def stoppedResult(info):
+    """
+    Returns the result of a stopped fit from its last progress report.
+
+    Parameters
+    ----------
+    info : dict or None
+        The last progress report of the fit, as made by FitProgress.
+
+    Returns
+    -------
+    OptimizeResult or None
+        The result with the best parameters found so far, or None if these are not known.
+    """
+    if info is None or info['x'] is None:
+        return None
+    return scipy.optimize.OptimizeResult(x=info['x'], fun=info['cost'], sumSquares=info['cost'], nit=info['nit'], nfev=info['nfev'], success=False, stopped=True, message='Stopped by the user')
+
+class FitProfiler(object):
+    """
+    Accumulates the time and number of calls of the stages of the fit evaluations.
+    While the profiler is active, the functions of the stages are replaced by timing wrappers,
+    such that fits run without any instrumentation when profiling is off.
+    The time of a stage excludes the time spent in the other stages it calls.
+    """
+
+    # The stages with the owner and name of the timed function, in the order of the summary
+    STAGES = [('Cost reduction', 'fitEngine', 'lstSqrs'),
+              ('Residuals', 'fitEngine', 'lstSqrsResidual'),
+              ('Jacobian', 'fitEngine', 'lstSqrsJacobian'),
+              ('Simulation', 'fitEngine', 'fitFunc'),
+              ('Parameter mapping', 'ParamPlan', 'values'),
+              ('Frequencies (quadFreqBase)', 'simFunctions', 'quadFreqBase'),
+              ('Frequencies (csaFreqBase)', 'simFunctions', 'csaFreqBase'),
+              ('Carousel averaging', 'simFunctions', 'carouselAveraging'),
+              ('Binning', 'simFunctions', 'binFrequencies'),
+              ('Line shape (binnedFid)', 'simFunctions', 'binnedFid'),
+              ('Line shape (makeMQMASSpectrum)', 'simFunctions', 'makeMQMASSpectrum'),
+              ('Czjzek intensities', 'Czjzek', 'czjzekIntensities'),
+              ('FFT', 'fitEngine', 'transformSim')]
+
+    def __init__(self):
+        """
+        Initializes an inactive profiler.
+        """
+        self.times = collections.OrderedDict((stage[0], 0.0) for stage in self.STAGES)
+        self.calls = collections.OrderedDict((stage[0], 0) for stage in self.STAGES)
+        self.stack = []
+        self.patched = []
+        self.start = None
+        self.wallTime = 0.0
+
+    def timed(self, name, func):
+        """
+        Returns a wrapper of a function that adds its duration to a stage.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage.
+        func : function
+            The function to time.
+
+        Returns
+        -------
+        function
+            The timed function.
+        """
+        def wrapper(*args, **kwargs):
+            self.stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.times[name] += elapsed - self.stack.pop()
+                self.calls[name] += 1
+                if self.stack:
+                    self.stack[-1] += elapsed
+        return wrapper
+
+    def __enter__(self):
+        owners = {'fitEngine': sys.modules[__name__], 'ParamPlan': ParamPlan, 'simFunctions': simFunc, 'Czjzek': simFunc.Czjzek}
+        for name, ownerName, attr in self.STAGES:
+            owner = owners[ownerName]
+            original = owner.__dict__[attr]
+            self.patched.append((owner, attr, original))
+            setattr(owner, attr, self.timed(name, original))
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.wallTime += time.perf_counter() - self.start
+        for owner, attr, original in reversed(self.patched):
+            setattr(owner, attr, original)
+        self.patched = []
+
+    def summary(self):
+        """
+        Returns the accumulated profile.
+
+        Returns
+        -------
+        OrderedDict
+            The [number of calls, time in seconds] of the whole fit ('Fit'), of every stage that was called,
+            and of the minimizer itself ('Minimizer'), which is the time outside the stages.
+        """
+        profile = collections.OrderedDict([('Fit', [1, self.wallTime])])
+        for name in self.times:
+            if self.calls[name]:
+                profile[name] = [self.calls[name], self.times[name]]
+        profile['Minimizer'] = [0, max(self.wallTime - sum(self.times.values()), 0.0)]
+        return profile
+
+def runProfiled(fitRun, *args):
+    """
+    Runs a fit with a FitProfiler, and adds the profile to the result.
+
+    Parameters
+    ----------
+    fitRun : function
+        The fit routine, such as runFit.
+    *args
+        The arguments of fitRun.
+
+    Returns
+    -------
+    OptimizeResult, str or None
+        The result of fitRun, with the summary of the profiler in profile when the fit succeeded.
+    """
+    with FitProfiler() as profiler:
+        fitVal = fitRun(*args)
+    if fitVal is not None and not isinstance(fitVal, str):
+        fitVal.profile = profiler.summary()
+    return fitVal
+
+def mergeProfiles(total, profile):
+    """
+    Adds the calls and times of a profile to a total profile.
+
+    Parameters
+    ----------
+    total : OrderedDict or None
+        The total profile, which is updated.
+    profile : OrderedDict
+        The profile to add, as returned by FitProfiler.summary.
+
+    Returns
+    -------
+    OrderedDict
+        The total profile, or a copy of profile when total is None.
+    """
+    if total is None:
+        total = collections.OrderedDict()
+    for name, (calls, seconds) in profile.items():
+        entry = total.setdefault(name, [0, 0.0])
+        entry[0] += calls
+        entry[1] += seconds
+    return total
+
+def cropToMask(xax, data1D, maskList, funcs, args):
+    """
+    Removes the excluded points from the spectra before a fit.
+    For spectra of which the fit function can be evaluated pointwise, the function is only evaluated on the points that contribute to the fit.
+    Other spectra are cropped to the bounding box of the included points,
+    such that the residuals (and their derivatives) only cover this box.
+
+    Parameters
+    ----------
+    xax : list of arrays
+        List of the x-axes of the data.
+    data1D : array or list of arrays
+        Array with the data to be fit.
+    maskList : list
+        The list with the masks of the data.
+    funcs : list of functions
+        The functions to run per data in data1D.
+    args : tuple
+        Additional arguments for the fitting functions.
+
+    Returns
+    -------
+    list of arrays
+        The x-axes.
+    list of arrays
+        The data.
+    list
+        The masks.
+    list
+        For every spectrum the tuple of slices with which the simulation is cropped to the box, or None when the simulation needs no cropping.
+    """
+    xax = list(xax)
+    data1D = list(data1D)
+    maskList = list(maskList)
+    crops = [None] * len(funcs)
+    for n, func in enumerate(funcs):
+        if np.ndim(maskList[n]) == 0:
+            continue
+        select = np.asarray(maskList[n]) != 0
+        if not np.any(select):
+            continue
+        if func in simFunc.POINTWISE and not (args[7][n] or args[8][n]) and len(xax[n]) == 1 and select.ndim == 1:
+            xax[n] = [np.asarray(xax[n][-1])[select]]
+            data1D[n] = np.asarray(data1D[n])[select]
+            maskList[n] = np.asarray(maskList[n])[select]
+            continue
+        crop = ()
+        for axis in range(select.ndim):
+            used = np.nonzero(np.any(select, axis=tuple(i for i in range(select.ndim) if i != axis)))[0]
+            crop += (slice(used[0], used[-1] + 1),)
+        if all(item.stop - item.start == length for item, length in zip(crop, select.shape)):
+            continue
+        data1D[n] = np.asarray(data1D[n])[crop]
+        maskList[n] = np.asarray(maskList[n])[crop]
+        crops[n] = crop
+    return xax, data1D, maskList, crops
+
+def splitFitArgs(args):
+    """
+    Splits the fit arguments in the extra parameters of every spectrum and the remaining arguments.
+    The extra parameters are the last element of the fixed parameter list of every spectrum.
+
+    Parameters
+    ----------
+    args : tuple
+        The tuple with additional values, as passed to fitFunc.
+
+    Returns
+    -------
+    list
+        The extra parameters of every spectrum.
+    tuple
+        The arguments with the extra parameters replaced by None.
+    """
+    extras = [argu[-1] for argu in args[3]]
+    allArgu = [list(argu[:-1]) + [None] for argu in args[3]]
+    return extras, args[:3] + (allArgu,) + args[4:]
+
+def joinFitArgs(extras, args):
+    """
+    Inverse of splitFitArgs.
+
+    Parameters
+    ----------
+    extras : list
+        The extra parameters of every spectrum.
+    args : tuple
+        The arguments with the extra parameters replaced by None.
+
+    Returns
+    -------
+    tuple
+        The full arguments as passed to fitFunc.
+    """
+    allArgu = [list(argu[:-1]) + [extra] for argu, extra in zip(args[3], extras)]
+    return args[:3] + (allArgu,) + args[4:]
+
+def sameContext(first, second):
+    """
+    Checks whether two fit contexts are equal.
+    Arrays are compared by identity first, and by value otherwise.
+
+    Parameters
+    ----------
+    first : object
+        The first context.
+    second : object
+        The second context.
+
+    Returns
+    -------
+    bool
+        True if both contexts are equal.
+    """
+    if first is second:
+        return True
+    if isinstance(first, np.ndarray) or isinstance(second, np.ndarray):
+        if not (isinstance(first, np.ndarray) and isinstance(second, np.ndarray)):
+            return False
+        return first.shape == second.shape and first.dtype == second.dtype and np.array_equal(first, second)
+    if isinstance(first, (list, tuple)):
+        if type(first) is not type(second) or len(first) != len(second):
+            return False
+        return all(sameContext(a, b) for a, b in zip(first, second))
+    if isinstance(first, dict):
+        if not isinstance(second, dict) or first.keys() != second.keys():
+            return False
+        return all(sameContext(first[key], second[key]) for key in first)
+    try:
+        return bool(first == second)
+    except Exception:
+        return False
+
+def stackFitArgs(argsList):
+    """
+    Collects the fixed parameters of fits with the same parameter structure, for a batched fit.
+
+    Parameters
+    ----------
+    argsList : list of tuple
+        The additional parameters of every fit, as passed to fitFunc.
+
+    Returns
+    -------
+    ndarray
+        The values of the parameters that are not fitted, with a row per fit.
+
+    Raises
+    ------
+    FittingException
+        When the fits do not share the fitted and linked parameters or the extra parameters.
+    """
+    first = splitFitArgs(argsList[0])
+    fixed = []
+    for args in argsList:
+        extras, rest = splitFitArgs(args)
+        if not sameContext(first[0], extras) or not sameContext(first[1][:3] + first[1][4:], rest[:3] + rest[4:]):
+            raise FittingException("Fitting: a batched fit needs the same fitted parameters and settings in all slices")
+        fixed.append(ParamPlan(args).fixed)
+    return np.array(fixed, dtype=float)
+
+class SharedArray(object):
+    """
+    A reference to an array in shared memory.
+    It replaces a large array when fit data is sent to the worker processes.
+    """
+
+    def __init__(self, name, shape, dtype):
+        """
+        Initializes the reference.
+
+        Parameters
+        ----------
+        name : str
+            The name of the shared memory block.
+        shape : tuple
+            The shape of the array.
+        dtype : str
+            The data type of the array.
+        """
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+def shareArrays(obj, blocks, minSize=SHAREDMINSIZE):
+    """
+    Copies the large arrays in a nested structure of lists, tuples and dictionaries to shared memory.
+
+    Parameters
+    ----------
+    obj : object
+        The structure with arrays.
+    blocks : list
+        The list to which the created shared memory blocks are appended.
+        The caller is responsible for releasing these.
+    minSize : int, optional
+        The minimum number of bytes of an array to be shared.
+        SHAREDMINSIZE by default.
+
+    Returns
+    -------
+    object
+        The structure with the large arrays replaced by SharedArray references.
+        When shared memory is not available obj is returned unchanged.
+    """
+    if shared_memory is None:
+        return obj
+    if isinstance(obj, np.ndarray):
+        if obj.nbytes < minSize or obj.dtype.hasobject:
+            return obj
+        shm = shared_memory.SharedMemory(create=True, size=obj.nbytes)
+        blocks.append(shm)
+        np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)[...] = obj
+        return SharedArray(shm.name, obj.shape, obj.dtype.str)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(shareArrays(item, blocks, minSize) for item in obj)
+    if isinstance(obj, dict):
+        return {key: shareArrays(obj[key], blocks, minSize) for key in obj}
+    return obj
+
+def attachArrays(obj, blocks):
+    """
+    Inverse of shareArrays: replaces the SharedArray references by read-only arrays in shared memory.
+
+    Parameters
+    ----------
+    obj : object
+        The structure with SharedArray references.
+    blocks : list
+        The list to which the attached shared memory blocks are appended.
+
+    Returns
+    -------
+    object
+        The structure with arrays.
+    """
+    if isinstance(obj, SharedArray):
+        shm = shared_memory.SharedMemory(name=obj.name)
+        blocks.append(shm)
+        array = np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)
+        array.flags.writeable = False
+        return array
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(attachArrays(item, blocks) for item in obj)
+    if isinstance(obj, dict):
+        return {key: attachArrays(obj[key], blocks) for key in obj}
+    return obj
+
+def releaseBlocks(blocks, unlink=False):
+    """
+    Closes shared memory blocks.
+
+    Parameters
+    ----------
+    blocks : list of SharedMemory
+        The blocks to close.
+    unlink : bool, optional
+        If True, the blocks are also destroyed.
+        Should only be used by the process that created the blocks.
+        False by default.
+    """
+    for shm in blocks:
+        try:
+            shm.close()
+        except BufferError:  # Arrays still refer to the block, it is closed when these are deleted
+            pass
+        if unlink:
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+def runFitTask(context, task):
+    """
+    Runs a fit task of a fit worker.
+
+    Parameters
+    ----------
+    context : tuple
+        The fit context (xax, funcs, extras, settings), with the settings of simFunctions.simSettings.
+    task : tuple
+        The task ('fit', taskId, data1D, maskList, guess, args, minmethod, numfeval, profile, report)
+        or ('batch', taskId, data, mask, guesses, fixed, args, numfeval, report).
+
+    Returns
+    -------
+    OptimizeResult, str or None
+        The result of runFit, or of runBatchFit for a batch task.
+        When profile is set, the fit is profiled with a FitProfiler.
+    """
+    blocks = []
+    xax, funcs, extras, settings = context
+    simFunc.setSimSettings(settings)
+    if task[0] == 'batch':
+        data, mask, guesses, fixed, args, numfeval, report = task[2:]
+        data, mask, guesses, fixed = attachArrays((data, mask, guesses, fixed), blocks)
+        try:
+            return runBatchFit(xax, data, mask, guesses, fixed, joinFitArgs(extras, args), funcs, numfeval, report)
+        finally:
+            del data, mask, guesses, fixed
+            releaseBlocks(blocks)
+    data1D, maskList, guess, args, minmethod, numfeval, profile, report = task[2:]
+    data1D, maskList = attachArrays((data1D, maskList), blocks)
+    try:
+        if profile:
+            return runProfiled(runFit, xax, data1D, maskList, guess, joinFitArgs(extras, args), funcs, minmethod, numfeval, report)
+        return runFit(xax, data1D, maskList, guess, joinFitArgs(extras, args), funcs, minmethod, numfeval, report)
+    finally:
+        del data1D, maskList
+        releaseBlocks(blocks)
+
+def fitWorker(taskQueue, resultQueue):
+    """
+    The loop of a persistent fit worker process.
+    The static context of the fits (x-axes, fit functions, extra parameters and simulation settings) is kept between tasks.
+
+    Parameters
+    ----------
+    taskQueue : Queue
+        The queue from which the worker receives its tasks.
+        A task is either ('context', context), ('fit', taskId, data1D, maskList, guess, args, minmethod, numfeval, profile),
+        ('batch', taskId, data, mask, guesses, fixed, args, numfeval) or None to stop the worker.
+        Large arrays in the context and in the data, masks and guesses are passed as SharedArray references.
+    resultQueue : Queue
+        The queue on which the results are put as ('result', taskId, fitVal).
+        Progress reports of the running fit are put as ('progress', taskId, info).
+    """
+    context = None
+    contextBlocks = []
+    while True:
+        task = taskQueue.get()
+        if task is None:
+            break
+        if task[0] == 'context':
+            context = None
+            releaseBlocks(contextBlocks)
+            contextBlocks = []
+            context = attachArrays(task[1], contextBlocks)
+            continue
+        taskId = task[1]
+        report = lambda info: resultQueue.put(('progress', taskId, info))
+        fitVal = runFitTask(context, task + (report,))
+        resultQueue.put(('result', taskId, fitVal))
+    context = None
+    releaseBlocks(contextBlocks)
+
+class FitWorkerPool(object):
+    """
+    A set of persistent processes that perform fits.
+    The static context of a fit is only sent to a worker when it changes, together with the first task for that worker,
+    such that consecutive fits only transfer the data and the initial guesses.
+    Large arrays are placed in shared memory once, instead of being copied to every worker.
+    """
+
+    def __init__(self, numWorkers=1):
+        """
+        Starts the fit workers.
+
+        Parameters
+        ----------
+        numWorkers : int, optional
+            The number of worker processes.
+            1 by default.
+        """
+        self.context = None
+        self.sharedContext = None
+        self.progress = {}
+        self.generation = 0
+        self.contextBlocks = {}
+        self.taskBlocks = {}
+        self.resultQueue = multiprocessing.Queue()
+        self.taskQueues = []
+        self.processes = []
+        if shared_memory is not None and hasattr(resource_tracker, 'ensure_running'):
+            # Start the resource tracker before the workers, such that they share it with this process
+            resource_tracker.ensure_running()
+        for _ in range(max(1, numWorkers)):
+            taskQueue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=fitWorker, args=(taskQueue, self.resultQueue))
+            process.daemon = True
+            process.start()
+            self.taskQueues.append(taskQueue)
+            self.processes.append(process)
+        self.workerGeneration = [0] * len(self.processes)
+        self.sentGeneration = [0] * len(self.processes)
+
+    def __len__(self):
+        return len(self.processes)
+
+    def isAlive(self):
+        """
+        Returns True if all workers are still running.
+        """
+        return all(process.is_alive() for process in self.processes)
+
+    def setContext(self, xax, funcs, args):
+        """
+        Sets the static fit context of the next tasks, if it differs from the current one.
+        The context is sent to a worker together with its next task.
+
+        Parameters
+        ----------
+        xax : list of arrays
+            List of the x-axes of the data.
+        funcs : list of functions
+            The fit function for each of the spectra.
+        args : tuple
+            The additional parameters of the fit.
+            Only the extra parameters are part of the context, together with the settings of simFunctions.
+        """
+        context = (xax, funcs, splitFitArgs(args)[0], simFunc.simSettings())
+        if self.context is not None and sameContext(self.context, context):
+            return
+        self.context = context
+        self.generation += 1
+        blocks = []
+        self.sharedContext = shareArrays(context, blocks)
+        self.contextBlocks[self.generation] = blocks
+        self.releaseContexts()
+
+    def sendContext(self, worker):
+        """
+        Sends the current context to a worker, if it does not have it yet.
+
+        Parameters
+        ----------
+        worker : int
+            The index of the worker.
+        """
+        if self.sentGeneration[worker] != self.generation:
+            self.taskQueues[worker].put(('context', self.sharedContext))
+            self.sentGeneration[worker] = self.generation
+
+    def releaseContexts(self):
+        """
+        Destroys the shared memory of old contexts that are no longer used by any worker.
+        A worker never used a context that was replaced before it was sent to the worker,
+        and it has replaced a context once it returns the result of a task submitted after a newer context.
+        """
+        for generation in list(self.contextBlocks):
+            if generation < self.generation and all(sent < generation or done > generation for sent, done in zip(self.sentGeneration, self.workerGeneration)):
+                releaseBlocks(self.contextBlocks.pop(generation), True)
+
+    def submit(self, worker, taskId, data1D, maskList, guess, args, minmethod, numfeval, profile=False):
+        """
+        Submits a fit to a worker.
+
+        Parameters
+        ----------
+        worker : int
+            The index of the worker.
+        taskId : object
+            The identifier returned together with the result.
+        data1D : array or list of arrays
+            Array with the data to be fit.
+        maskList : list
+            The list with the masks of the data.
+        guess : list
+            List with the initial guess values.
+        args : tuple
+            The additional parameters of the fit.
+            The extra parameters are taken from the context.
+        minmethod : str
+            The minimization method of Scipy minimize to use.
+        numfeval : int
+            The maximum number of function evaluations.
+        profile : bool, optional
+            If True, the fit is profiled and the result has the summary of the profiler in profile.
+        """
+        self.progress.pop(taskId, None)
+        self.sendContext(worker)
+        blocks = []
+        data1D, maskList = shareArrays((data1D, maskList), blocks)
+        self.taskBlocks[taskId] = (worker, self.generation, blocks)
+        self.taskQueues[worker].put(('fit', taskId, data1D, maskList, guess, splitFitArgs(args)[1], minmethod, numfeval, profile))
+
+    def submitBatch(self, worker, taskId, data, mask, guesses, fixed, args, numfeval):
+        """
+        Submits a batched fit of curves with the same parameter structure to a worker.
+        See runBatchFit.
+
+        Parameters
+        ----------
+        worker : int
+            The index of the worker.
+        taskId : object
+            The identifier returned together with the result.
+        data : ndarray
+            The curves to be fit, with a row per curve.
+        mask : float or ndarray
+            The mask of the curves.
+        guesses : ndarray
+            The initial guess of the fit parameters, with a row per curve.
+        fixed : ndarray
+            The values of the parameters that are not fitted, with a row per curve.
+        args : tuple
+            The additional parameters of the fit of the first curve.
+            The extra parameters are taken from the context.
+        numfeval : int
+            The maximum number of function evaluations.
+        """
+        self.progress.pop(taskId, None)
+        self.sendContext(worker)
+        blocks = []
+        data, mask, guesses, fixed = shareArrays((data, mask, guesses, fixed), blocks)
+        self.taskBlocks[taskId] = (worker, self.generation, blocks)
+        self.taskQueues[worker].put(('batch', taskId, data, mask, guesses, fixed, splitFitArgs(args)[1], numfeval))
+
+    def getResult(self, timeout=None):
+        """
+        Returns a finished result.
+        Progress reports that arrive while waiting are stored in the progress dictionary, keyed by taskId.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The number of seconds to wait for a result.
+            By default it waits until a result is available.
+
+        Returns
+        -------
+        tuple or None
+            The tuple (taskId, fitVal), or None if no result was available in time.
+        """
+        if timeout is not None:
+            end = time.time() + timeout
+        while True:
+            try:
+                if timeout is None:
+                    message = self.resultQueue.get()
+                else:
+                    message = self.resultQueue.get(timeout=max(end - time.time(), 0))
+            except queue.Empty:
+                return None
+            if message[0] == 'result':
+                self.progress.pop(message[1], None)
+                if message[1] in self.taskBlocks:
+                    worker, generation, blocks = self.taskBlocks.pop(message[1])
+                    releaseBlocks(blocks, True)
+                    self.workerGeneration[worker] = max(self.workerGeneration[worker], generation)
+                    self.releaseContexts()
+                return message[1:]
+            self.progress[message[1]] = message[2]
+
+    def terminate(self):
+        """
+        Terminates all workers.
+        """
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        for taskQueue in self.taskQueues:
+            # Nothing reads the task queues any more, so waiting for unsent tasks would block forever
+            taskQueue.cancel_join_thread()
+            taskQueue.close()
+        self.resultQueue.close()
+        self.resultQueue.join_thread()
+        for blocks in list(self.contextBlocks.values()) + [item[2] for item in self.taskBlocks.values()]:
+            releaseBlocks(blocks, True)
+        self.contextBlocks = {}
+        self.taskBlocks = {}
+        self.processes = []
+        self.taskQueues = []
+
+def sliceKey(loc):
+    """
+    Returns the text key of a slice location, as used in a results sink.
+
+    Parameters
+    ----------
+    loc : array_like of int
+        The location of the slice, without the fitted axes.
+
+    Returns
+    -------
+    str
+        The indices joined by underscores, or '0' for one-dimensional data.
+    """
+    loc = [str(int(i)) for i in loc]
+    if not loc:
+        return '0'
+    return '_'.join(loc)
+
+def readResultsSink(fileName):
+    """
+    Reads the finished slices from a results file written by ResultsSink.
+
+    Parameters
+    ----------
+    fileName : str
+        The path of the CSV results file.
+
+    Returns
+    -------
+    list of str
+        The parameter labels, or None if the file has no header.
+    dict
+        Dictionary with the slice keys as keys and dictionaries with 'status', 'rmsd', 'sumSquares', 'nfev', 'nit' and 'x' as values.
+        Only the slices that were fitted to the end are included.
+    """
+    done = {}
+    labels = None
+    with open(fileName, newline='') as fp:
+        reader = csv.reader(fp)
+        for row in reader:
+            if not row:
+                continue
+            if labels is None:
+                if row[:len(ResultsSink.COLUMNS)] != ResultsSink.COLUMNS:
+                    raise FittingException("Fitting: " + fileName + " is not a results file")
+                labels = row[len(ResultsSink.COLUMNS):]
+                continue
+            if len(row) != len(ResultsSink.COLUMNS) + len(labels):
+                continue  # A row cut short by an interrupted run
+            if row[1] != 'ok':
+                continue
+            try:
+                done[row[0]] = {'status': row[1],
+                                'rmsd': float(row[2]),
+                                'sumSquares': float(row[3]),
+                                'nfev': int(row[4]),
+                                'nit': int(row[5]),
+                                'x': np.array([float(val) for val in row[len(ResultsSink.COLUMNS):]])}
+            except ValueError:
+                continue
+    return labels, done
+
+class ResultsSink(object):
+    """
+    Appends the results of the slices of a fit all run to a CSV file as they finish.
+    Every row holds the slice, its status, RMSD, least squares value, number of evaluations and iterations and the fitted values.
+    The fitted curves can be written to a series of npz files next to the CSV file,
+    such that they do not need to be kept in memory for all slices.
+    """
+
+    COLUMNS = ['slice', 'status', 'rmsd', 'sumSquares', 'nfev', 'nit']
+    CHUNKSIZE = 64  # Number of slices of curves per npz file
+
+    def __init__(self, fileName, storeCurves=False, resume=False):
+        """
+        Opens the results file.
+
+        Parameters
+        ----------
+        fileName : str
+            The path of the CSV results file.
+        storeCurves : bool, optional
+            When True the fitted curves are written to npz files named after fileName.
+            False by default.
+        resume : bool, optional
+            When True and the file exists, the finished slices are read and new rows are appended.
+            Otherwise the file is overwritten.
+            False by default.
+        """
+        self.fileName = fileName
+        self.storeCurves = storeCurves
+        self.labels = None
+        self.done = {}
+        self.curves = collections.OrderedDict()
+        self.numCurves = 0
+        self.chunk = 0
+        try:
+            if resume and os.path.exists(fileName):
+                self.labels, self.done = readResultsSink(fileName)
+                while os.path.exists(self.curveFileName(self.chunk)):
+                    self.chunk += 1
+                with open(fileName, 'rb') as fp:
+                    fp.seek(0, os.SEEK_END)
+                    complete = fp.tell() == 0
+                    if not complete:
+                        fp.seek(-1, os.SEEK_END)
+                        complete = fp.read(1) in (b'\n', b'\r')
+                self.fp = open(fileName, 'a', newline='')
+                if not complete:
+                    self.fp.write('\n')  # End a row cut short by an interrupted run
+            else:
+                self.fp = open(fileName, 'w', newline='')
+        except OSError as error:
+            raise FittingException("Fitting: could not open " + fileName + ": " + str(error))
+        self.writer = csv.writer(self.fp)
+
+    def curveFileName(self, num):
+        """
+        Returns the path of an npz file with curves.
+
+        Parameters
+        ----------
+        num : int
+            The number of the file.
+
+        Returns
+        -------
+        str
+            The path.
+        """
+        return os.path.splitext(self.fileName)[0] + '_curves' + str(num).zfill(4) + '.npz'
+
+    def record(self, loc, labels, fitVal, rmsd, curves=None):
+        """
+        Appends the result of a slice.
+
+        Parameters
+        ----------
+        loc : array_like of int
+            The location of the slice, without the fitted axes.
+        labels : list of str
+            The labels of the fit parameters.
+        fitVal : OptimizeResult
+            The result of the fit.
+        rmsd : float
+            The root mean square deviation of the fit.
+        curves : list of list of ndarray, optional
+            For every tab the x-axis, the total curve and the curves of the sites.
+            Only written when storeCurves is True.
+
+        Raises
+        ------
+        FittingException
+            When the fit parameters differ from those already in the file.
+        """
+        labels = list(labels)
+        if self.labels is None:
+            self.labels = labels
+            self.writer.writerow(self.COLUMNS + labels)
+        elif labels != self.labels:
+            raise FittingException("Fitting: the fit parameters of slice " + sliceKey(loc) + " differ from those in " + self.fileName)
+        key = sliceKey(loc)
+        status = 'stopped' if fitVal.get('stopped', False) else 'ok'
+        x = np.atleast_1d(fitVal['x'])
+        row = {'status': status, 'rmsd': float(rmsd), 'sumSquares': float(fitVal.get('sumSquares', fitVal['fun'])), 'nfev': int(fitVal.get('nfev', 0)), 'nit': int(fitVal.get('nit', 0)), 'x': x}
+        self.writer.writerow([key, status] + [repr(row[name]) for name in self.COLUMNS[2:]] + [repr(float(val)) for val in x])
+        self.fp.flush()
+        if status == 'ok':
+            self.done[key] = row
+        if self.storeCurves and curves is not None:
+            for tab, (plotx, curve, _, parts) in enumerate(curves):
+                if not isinstance(plotx, list):
+                    plotx = [plotx]
+                for dim, ax in enumerate(plotx):
+                    self.curves['x' + str(dim) + '_' + key + '_t' + str(tab)] = np.asarray(ax)
+                self.curves['y_' + key + '_t' + str(tab)] = np.array([curve] + list(parts))
+            self.numCurves += 1
+            if self.numCurves >= self.CHUNKSIZE:
+                self.flushCurves()
+
+    def flushCurves(self):
+        """
+        Writes the pending curves to the next npz file.
+        The keys are 'x<dim>_<slice>_t<tab>' for the axes and 'y_<slice>_t<tab>' for the curves,
+        where the first entry is the total curve and the others are the curves of the sites.
+        """
+        if not self.curves:
+            return
+        np.savez(self.curveFileName(self.chunk), **self.curves)
+        self.chunk += 1
+        self.curves = collections.OrderedDict()
+        self.numCurves = 0
+
+    def close(self):
+        """
+        Writes the pending curves and closes the results file.
+        """
+        self.flushCurves()
+        self.fp.close()
+
+class ParamPlan(object):
+    """
+    The precompiled mapping from the fit parameters to the input values of the fit functions.
+    Every input value of a spectrum is a gather from the vector of fit parameters followed by the fixed values,
+    multiplied by a scale and shifted by an offset.
+    """
+
+    def __init__(self, args):
+        """
+        Compiles the parameter structure and links of all spectra.
+
+        Parameters
+        ----------
+        args : tuple
+            The additional arguments of the fit, as passed to fitFunc.
+
+        Raises
+        ------
+        SimException
+            When a link refers to a parameter that does not exist or the links are circular.
+        """
+        specSlices = args[0]
+        allNumExp = args[1]
+        allStruc = args[2]
+        allArgu = args[3]
+        self.numParams = max([length.stop for length in specSlices] + [0])
+        fixedStart = []
+        fixed = []
+        for argu in allArgu:
+            fixedStart.append(self.numParams + len(fixed))
+            fixed += list(argu[:-1])
+        self.fixed = np.array(fixed, dtype=float)
+        self.names = []
+        self.numSingle = []
+        self.idx = []
+        self.mult = []
+        self.offset = []
+        self.offsetRow = []
+
+        def resolve(tab, name, site, depth=0):
+            if depth > 100:
+                raise simFunc.SimException("Fitting: Parameters are linked circularly")
+            kind, pos = allStruc[tab][name][site]
+            if kind == 1:
+                return specSlices[tab].start + pos, 1.0, 0.0
+            if kind == 0:
+                return fixedStart[tab] + pos, 1.0, 0.0
+            link = checkLinkTuple(pos)
+            index, mult, offset = resolve(link[4], link[0], link[1], depth + 1)
+            return index, link[2] * mult, link[2] * offset + link[3]
+
+        for n, numExp in enumerate(allNumExp):
+            singleNames = args[9][n]
+            multiNames = args[10][n]
+            names = list(singleNames) + list(multiNames)
+            idx = np.zeros((len(names), numExp), dtype=int)
+            mult = np.ones((len(names), numExp))
+            offset = np.zeros((len(names), numExp))
+            try:
+                for row, name in enumerate(singleNames):
+                    idx[row], mult[row], offset[row] = resolve(n, name, 0)
+                for row, name in enumerate(multiNames, len(singleNames)):
+                    for i in range(numExp):
+                        idx[row, i], mult[row, i], offset[row, i] = resolve(n, name, i)
+            except (KeyError, IndexError):
+                raise simFunc.SimException("Fitting: One of the keywords is not correct")
+            self.names.append(names)
+            self.numSingle.append(len(singleNames))
+            self.idx.append(idx)
+            self.mult.append(mult)
+            self.offset.append(offset)
+            self.offsetRow.append(names.index("Offset") if "Offset" in singleNames else None)
+        self.crops = [None] * len(allNumExp)  # The parts of the simulations that are fitted, set by cropToMask
+
+    def values(self, params):
+        """
+        Returns the input values of the fit functions of every spectrum.
+
+        Parameters
+        ----------
+        params : array_like
+            The fit parameters of all spectra.
+
+        Returns
+        -------
+        list of ndarray
+            For every spectrum an array with a row per parameter name and a column per site.
+        """
+        full = np.concatenate((np.atleast_1d(np.asarray(params, dtype=float)), self.fixed))
+        return [full[idx] * mult + offset for idx, mult, offset in zip(self.idx, self.mult, self.offset)]
+
+def fitFunc(funcs, params, allX, args, plan=None):
+    """
+    Reconstructs all linked parameters and executes the fitting function for each set of data.
+
+    Parameters
+    ----------
+    funcs : list of functions
+        The list of fitting functions to execute.
+    params : tuple
+        The tuple with the function parameters generated by minimize.
+    allX : list of arrays
+        The list with x-axes.
+    args : tuple
+        Additional arguments for the fitting functions.
+    plan : ParamPlan, optional
+        The compiled parameter mapping of args.
+        It is compiled from args when not given.
+
+    Returns
+    -------
+    list of arrays
+        A list with the simulated data.
+    """
+    if plan is None:
+        plan = ParamPlan(args)
+    allValues = plan.values(params[0])
+    fullTestFunc = []
+    for n, _ in enumerate(allX):
+        x = allX[n]
+        testFunc = None
+        numExp = args[1][n]
+        extra = args[3][n][-1]
+        freq = args[4][n]
+        sw = args[5][n]
+        axMult = args[6][n]
+        fft_axes = args[7][n]
+        fftshift_axes = args[8][n]
+        values = allValues[n]
+        numSingle = plan.numSingle[n]
+        singleVars = values[:numSingle, 0].tolist()
+        try:
+            if funcs[n] in simFunc.VECTORIZED:
+                # All sites at once, with an array per site dependent parameter
+                testFunc = funcs[n](x, freq, sw, axMult, extra, *(singleVars + list(values[numSingle:])))
+            else:
+                for i in range(numExp):
+                    inputVars = singleVars + values[numSingle:, i].tolist()
+                    output = funcs[n](x, freq, sw, axMult, extra, *inputVars)
+                    if output is None:
+                        return None
+                    if testFunc is None:
+                        testFunc = output
+                    else:
+                        testFunc = testFunc + output
+        except KeyError:
+            raise(simFunc.SimException("Fitting: One of the keywords is not correct"))
+        if testFunc is None:
+            return None
+        if fft_axes or fftshift_axes:
+            testFunc = transformSim(testFunc, fft_axes, fftshift_axes)
+        testFunc = np.real(testFunc)
+        if plan.offsetRow[n] is not None:
+            testFunc = testFunc + values[plan.offsetRow[n], 0]
+        if plan.crops[n] is not None:
+            testFunc = testFunc[plan.crops[n]]
+        fullTestFunc.append(testFunc)
+    return fullTestFunc
+
+def transformSim(data, fftAxes, fftshiftAxes):
+    """
+    Fourier transforms a simulation to the domain of the data.
+
+    Parameters
+    ----------
+    data : ndarray
+        The simulated data.
+    fftAxes : tuple of int
+        The axes that are Fourier transformed.
+    fftshiftAxes : tuple of int
+        The axes that are shifted after the transform.
+
+    Returns
+    -------
+    ndarray
+        The transformed data.
+    """
+    return np.fft.fftshift(np.fft.fftn(data, axes=fftAxes), axes=fftshiftAxes)
@@ -20,24 +20,22 @@
 
 import multiprocessing
 import re
-import time
 import datetime
 import os
 import copy
+import collections
 import numpy as np
 import matplotlib as mpl
 from matplotlib.figure import Figure
 import matplotlib.patches as mppatches
-import scipy.optimize
 from safeEval import safeEval
 from views import Current1D, CurrentContour
 import widgetClasses as wc
 import functions as func
 import simFunctions as simFunc
-import specIO as io
-import spectrum as sc
 from ssNake import SideFrame, VERSION, QtGui, QtCore, QtWidgets, FigureCanvas
 import Czjzek
+from fitEngine import FittingException, FitWorkerPool, ResultsSink, checkLinkTuple, fitFunc, loadCzjzekLib, mergeProfiles, readParamFile, sameContext, sliceKey, stackFitArgs, stoppedResult
 
 COLORCONVERTER = mpl.colors.ColorConverter()
 
@@ -52,17 +50,6 @@ def isfloat(value):
         return False
 
 
-def checkLinkTuple(inp):
-    if len(inp) == 2:
-        inp += (1, 0, 0)
-    elif len(inp) == 3:
-        inp += (0, 0)
-    return inp
-
-class FittingException(sc.SpectrumException):
-    pass
-
-
 #############################################################################################
 
 
@@ -74,6 +61,19 @@ class TabFittingWindow(QtWidgets.QWidget):
 
     MINMETHOD = 'Powell'
     NUMFEVAL = 150
+    NUMWORKERS = 1
+    WARMSTART = 'None'
+    NUMSTARTS = 1
+    STARTSPREAD = 0.2
+    NUMERRORSAMPLES = 0
+    ERRORMETHOD = 'Bootstrap'
+    SINKFILE = ''
+    SINKCURVES = False
+    SINKRESUME = False
+    BATCHFIT = False
+    PROFILE = False
+    LIVEPREVIEW = True
+    PREVIEWDELAY = 300  # Milliseconds without parameter edits before the preview is simulated
 
     def __init__(self, father, oldMainWindow, mainFitType):
         """
@@ -96,8 +96,14 @@ class TabFittingWindow(QtWidgets.QWidget):
         self.get_current = oldMainWindow.get_current        # Connect function
         self.mainFitType = mainFitType
         self.subFitWindows = []
-        self.process1 = None
-        self.queue = None
+        self.fitPool = None
+        self.running = False
+        self.runningAll = False
+        self.fitStats = None
+        self.sliceStats = []
+        self.fitProfile = None
+        self.fitErrors = None
+        self.simPreview = SimPreview(self)
         self.tabs = QtWidgets.QTabWidget(self)
         self.tabs.setTabPosition(2)
         self.PRECIS = self.father.defaultPrecis
@@ -207,9 +213,40 @@ class TabFittingWindow(QtWidgets.QWidget):
                 self.tabs.removeTab(num)
                 del self.subFitWindows[num - 1]
 
+    def getFitPool(self, numWorkers=1):
+        """
+        Returns the persistent pool of fit workers.
+        A running pool is kept when it has at least the requested number of workers,
+        of which only the first numWorkers should be given tasks.
+        A new pool is started when none is running, when a worker has died or when more workers are needed.
+
+        Parameters
+        ----------
+        numWorkers : int, optional
+            The number of workers that are used.
+            1 by default.
+
+        Returns
+        -------
+        FitWorkerPool
+            The pool of fit workers.
+        """
+        if self.fitPool is None or not self.fitPool.isAlive() or len(self.fitPool) < numWorkers:
+            self.closeFitPool()
+            self.fitPool = FitWorkerPool(numWorkers)
+        return self.fitPool
+
+    def closeFitPool(self):
+        """
+        Terminates the workers of the fit pool.
+        """
+        if self.fitPool is not None:
+            self.fitPool.terminate()
+        self.fitPool = None
+
     def fitProcess(self, xax, data1D, maskList, guess, args, funcs):
         """
-        Creates a new process to fit the spectra.
+        Fits the spectra in a persistent worker process.
 
         Parameters
         ----------
@@ -217,48 +254,295 @@ class TabFittingWindow(QtWidgets.QWidget):
             The list with xaxArrays from the various spectra.
         data1D : ndarray
             The concatenated data from the various spectra.
+        maskList : list
+            The list with the masks of the various spectra.
         guess : list
             The initial guesses of the fit parameters.
         args : tuple
             The additional parameters of the fit.
         funcs : list of functions
             The fit function for each of the spectra.
+
         Returns
         -------
         OptimizeResult
             The results of the fit.
+            When the fit is stopped, the best parameters found so far are returned.
+        """
+        pool = self.getFitPool()
+        pool.setContext(xax, funcs, args)
+        pool.submit(0, 0, data1D, maskList, guess, args, self.MINMETHOD, self.NUMFEVAL, self.PROFILE)
+        return self.waitForFit(pool)
+
+    def waitForFit(self, pool):
+        """
+        Waits for the fit submitted to the first worker of a pool, while showing its progress.
+
+        Parameters
+        ----------
+        pool : FitWorkerPool
+            The pool running the fit with task identifier 0.
+
+        Returns
+        -------
+        OptimizeResult
+            The results of the fit.
+            When the fit is stopped, the best parameters found so far are returned.
         """
-        self.queue = multiprocessing.Queue()
-        self.process1 = multiprocessing.Process(target=mpFit, args=(xax, data1D, maskList, guess, args, self.queue, funcs, self.MINMETHOD, self.NUMFEVAL))
-        self.process1.start()
         self.running = True
         self.mainFitWindow.paramframe.stopButton.show()
+        result = None
         while self.running:
-            if not self.queue.empty():
+            result = pool.getResult(0.1)
+            if result is not None:
                 self.running = False
+            elif not pool.isAlive():
+                self.stopMP()
+                self.showFitProgress(None)
+                raise FittingException('The fitting process stopped unexpectedly')
+            else:
+                self.showFitProgress(pool.progress.get(0))
             QtWidgets.qApp.processEvents()
-            time.sleep(0.1)
-        if self.queue is None:
-            return
-        fitVal = self.queue.get(timeout=2)
-        self.stopMP()
+        self.mainFitWindow.paramframe.stopButton.hide()
+        self.showFitProgress(None)
+        if result is None:
+            return stoppedResult(pool.progress.get(0))
+        fitVal = result[1]
         if fitVal is None:
             raise FittingException('Optimal parameters not found')
         if isinstance(fitVal, str):
             raise FittingException(fitVal)
         return fitVal
 
+    def fitParallel(self, xax, maskList, tasks, args, funcs, title):
+        """
+        Runs fits that share their context in parallel with NUMWORKERS worker processes.
+
+        Parameters
+        ----------
+        xax : list
+            The list with xaxArrays from the various spectra.
+        maskList : list
+            The list with the masks of the various spectra.
+        tasks : list of tuple
+            The data and initial guesses (data1D, guess) of every fit.
+        args : tuple
+            The additional parameters of the fits.
+        funcs : list of functions
+            The fit function for each of the spectra.
+        title : str
+            The name of the fits in the progress display.
+
+        Returns
+        -------
+        list
+            The result (OptimizeResult) of every fit, or None for failed fits.
+            When stopped, the running fits return their best parameters so far, and the fits that did not start return None.
+        bool
+            True if the fits were stopped by the user.
+        """
+        numWorkers = max(1, min(self.NUMWORKERS, len(tasks)))
+        pool = self.getFitPool(numWorkers)
+        pool.setContext(xax, funcs, args)
+        freeWorkers = list(range(numWorkers))
+        busy = {}
+        results = [None] * len(tasks)
+        done = 0
+        nextTask = 0
+        self.running = True
+        self.mainFitWindow.paramframe.stopButton.show()
+        label = self.mainFitWindow.paramframe.fitProgressLabel
+        label.setText(title + ': 0/' + str(len(tasks)))
+        label.show()
+        try:
+            while self.running and (nextTask < len(tasks) or busy):
+                while freeWorkers and nextTask < len(tasks):
+                    worker = freeWorkers.pop(0)
+                    data1D, guess = tasks[nextTask]
+                    pool.submit(worker, nextTask, data1D, maskList, guess, args, self.MINMETHOD, self.NUMFEVAL, self.PROFILE)
+                    busy[nextTask] = worker
+                    nextTask += 1
+                result = pool.getResult(0.1)
+                if result is not None:
+                    num, fitVal = result
+                    freeWorkers.append(busy.pop(num))
+                    if isinstance(fitVal, str):
+                        self.stopMP()
+                        raise FittingException(fitVal)
+                    results[num] = fitVal
+                    done += 1
+                    label.setText(title + ': ' + str(done) + '/' + str(len(tasks)))
+                elif not pool.isAlive():
+                    self.stopMP()
+                    raise FittingException('The fitting process stopped unexpectedly')
+                QtWidgets.qApp.processEvents()
+        finally:
+            label.hide()
+        stopped = not self.running
+        self.running = False
+        self.mainFitWindow.paramframe.stopButton.hide()
+        if stopped:
+            for num in busy:
+                results[num] = stoppedResult(pool.progress.get(num))
+        return results, stopped
+
+    def fitMultiStart(self, xax, data1D, maskList, guess, args, funcs):
+        """
+        Fits the spectra from NUMSTARTS initial guesses in parallel with NUMWORKERS worker processes.
+        The first start is the current guess, the others are drawn uniformly around it within a relative distance of STARTSPREAD.
+
+        Parameters
+        ----------
+        xax : list
+            The list with xaxArrays from the various spectra.
+        data1D : ndarray
+            The concatenated data from the various spectra.
+        maskList : list
+            The list with the masks of the various spectra.
+        guess : list
+            The initial guesses of the fit parameters.
+        args : tuple
+            The additional parameters of the fit.
+        funcs : list of functions
+            The fit function for each of the spectra.
+
+        Returns
+        -------
+        OptimizeResult
+            The result with the lowest least squares value.
+            The least squares values of all starts are given in startCosts.
+            When the fit is stopped, the best parameters found so far are returned.
+        """
+        guess = np.array(guess, dtype=float)
+        spread = self.STARTSPREAD * np.where(guess != 0, np.abs(guess), 1.0)
+        starts = [guess] + [guess + spread * np.random.uniform(-1, 1, guess.shape) for _ in range(1, self.NUMSTARTS)]
+        results, stopped = self.fitParallel(xax, maskList, [(data1D, start) for start in starts], args, funcs, 'Starts')
+        results = [item for item in results if item is not None]
+        if not results:
+            if stopped:
+                return None
+            raise FittingException('Optimal parameters not found')
+        costs = np.array([item.sumSquares for item in results])
+        fitVal = results[int(np.argmin(costs))]
+        fitVal.startCosts = np.sort(costs)
+        profile = None
+        for item in results:
+            if 'profile' in item:
+                profile = mergeProfiles(profile, item['profile'])
+        if profile is not None:
+            fitVal.profile = profile  # The profile of all starts
+        return fitVal
+
+    def estimateErrors(self, xax, data1D, maskList, fitVal, args, funcs):
+        """
+        Estimates the uncertainties of the fit parameters by refitting NUMERRORSAMPLES resampled data sets in parallel.
+        The data sets are the best fit plus the resampled residuals (ERRORMETHOD 'Bootstrap'),
+        or plus Gaussian noise with the standard deviation of the residuals (ERRORMETHOD 'Monte Carlo').
+        All refits start from the best fit.
+
+        Parameters
+        ----------
+        xax : list
+            The list with xaxArrays from the various spectra.
+        data1D : ndarray
+            The concatenated data from the various spectra.
+        maskList : list
+            The list with the masks of the various spectra.
+        fitVal : OptimizeResult
+            The result of the fit.
+        args : tuple
+            The additional parameters of the fit.
+        funcs : list of functions
+            The fit function for each of the spectra.
+
+        Returns
+        -------
+        dict or None
+            The parameter labels ('labels'), the best fit values ('values'), the standard deviations ('std'),
+            the correlation matrix ('corr') and the number of successful refits ('samples').
+            None if fewer than two refits succeeded.
+        """
+        best = np.atleast_1d(np.array(fitVal['x'], dtype=float))
+        simData = fitFunc(funcs, (best,), xax, args)
+        if simData is None:
+            raise FittingException('Fitting: Error estimation failed on the simulation of the best fit')
+        tasks = []
+        for _ in range(self.NUMERRORSAMPLES):
+            sample = []
+            for n, data in enumerate(data1D):
+                sim = np.real(simData[n]) * np.ones(np.shape(data))
+                included = np.broadcast_to(np.asarray(maskList[n]) > 0, np.shape(data))
+                resid = (np.real(data) - sim)[included]
+                newData = np.array(np.real(data), dtype=float)
+                if self.ERRORMETHOD == 'Bootstrap':
+                    newData[included] = sim[included] + np.random.choice(resid, resid.size)
+                else:
+                    newData[included] = sim[included] + np.random.normal(0, np.sqrt(np.mean(resid**2)), resid.size)
+                sample.append(newData)
+            tasks.append((np.array(sample), best))
+        results, stopped = self.fitParallel(xax, maskList, tasks, args, funcs, 'Error samples')
+        samples = np.array([np.atleast_1d(item['x']) for item in results if item is not None and 'stopped' not in item])
+        if len(samples) < 2:
+            return None
+        std = np.std(samples, axis=0, ddof=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = np.atleast_2d(np.corrcoef(samples.T))
+        return {'labels': self.getFitParamLabels(args), 'values': best, 'std': std, 'corr': corr, 'samples': len(samples)}
+
+    def getFitParamLabels(self, args):
+        """
+        Returns a label for every fit parameter.
+
+        Parameters
+        ----------
+        args : tuple
+            The additional parameters of the fit, as passed to fitFunc.
+
+        Returns
+        -------
+        list of str
+            The labels, as 'tab: name' for site independent parameters and 'tab: name site' for the others.
+        """
+        selectList = args[0]
+        tabNames = self.getTabNames()
+        labels = [str(i) for i in range(max([length.stop for length in selectList] + [0]))]
+        for n, struc in enumerate(args[2]):
+            for name in struc:
+                for site, entry in enumerate(struc[name]):
+                    if entry[0] == 1:
+                        label = tabNames[n] + ': ' + name
+                        if name in args[10][n]:
+                            label += ' ' + str(site + 1)
+                        labels[selectList[n].start + entry[1]] = label
+        return labels
+
+    def showFitProgress(self, info):
+        """
+        Shows the progress of the running fit below the buttons.
+
+        Parameters
+        ----------
+        info : dict or None
+            The progress report of the fit, as made by FitProgress.
+            The progress is hidden when None.
+        """
+        label = self.mainFitWindow.paramframe.fitProgressLabel
+        if info is None:
+            label.hide()
+            return
+        text = 'Iteration: ' + str(info['nit']) + '\nEvaluations: ' + str(info['nfev']) + ' (' + ('%.1f' % info['rate']) + '/s)'
+        text += '\nBest cost: ' + ('%#.' + str(self.PRECIS) + 'g') % info['cost']
+        label.setText(text)
+        label.show()
+
     def stopMP(self, *args):
         """
         Stops the running fitting process.
+        The workers are terminated and restarted at the next fit.
+        The best parameters reported by the fit so far are kept.
         """
-        if self.queue is not None:
-            self.process1.terminate()
-            self.queue.close()
-            self.queue.join_thread()
-            self.process1.join()
-        self.queue = None
-        self.process1 = None
+        if self.running:
+            self.closeFitPool()
         self.running = False
         self.mainFitWindow.paramframe.stopButton.hide()
 
@@ -270,34 +554,388 @@ class TabFittingWindow(QtWidgets.QWidget):
         self.stopMP()
         self.mainFitWindow.paramframe.stopAllButton.hide()
 
-    def fitAll(self, *args):
+    def getSliceGrid(self):
         """
-        sequentially opens slices from an ND spectrum and runs a fit.
+        Returns the indices of all slices of the main spectrum.
+
+        Returns
+        -------
+        ndarray
+            Array with the location of a slice on every row.
         """
-        self.runningAll = True
-        self.mainFitWindow.paramframe.stopAllButton.show()
         tmp = np.array(self.mainFitWindow.current.data.shape())
         tmp[self.mainFitWindow.current.axes] = 1
         tmp2 = ()
         for i in tmp:
             tmp2 += (np.arange(i),)
-        grid = np.array([i.flatten() for i in np.meshgrid(*tmp2)]).T
-        for i in grid:
-            QtWidgets.qApp.processEvents()
-            if self.runningAll is False:
-                break
-            self.mainFitWindow.current.setSlice(self.mainFitWindow.current.axes, i)
-            self.fit()
-            self.mainFitWindow.sideframe.upd()
-        self.mainFitWindow.paramframe.stopAllButton.hide()
+        return np.array([i.flatten() for i in np.meshgrid(*tmp2)]).T
 
-    def fit(self):
+    def resetFitStats(self):
         """
-        Fits a spectrum on the current slice.
+        Clears the statistics of the last fit.
+        """
+        self.fitStats = collections.OrderedDict([('Fits', 0), ('Iterations', 0), ('Function evaluations', 0)])
+        self.sliceStats = []
+        self.fitProfile = None
+
+    def addSliceStats(self, fitVal):
+        """
+        Records the number of iterations and evaluations of the fit of the current slice during fitAll.
+
+        Parameters
+        ----------
+        fitVal : OptimizeResult
+            The result of the fit of the slice.
+        """
+        self.sliceStats.append((sliceKey(self.mainFitWindow.current.getRedLocList()), fitVal.get('nit', 0), fitVal.get('nfev', 0)))
+
+    def addFitAllStats(self):
+        """
+        Adds the warm start strategy and the mean cost per slice of fitAll to the statistics.
+        """
+        if not self.sliceStats:
+            return
+        self.fitStats['Warm start'] = self.WARMSTART
+        self.fitStats['Iterations per slice'] = '%.1f' % np.mean([item[1] for item in self.sliceStats])
+        self.fitStats['Evaluations per slice'] = '%.1f' % np.mean([item[2] for item in self.sliceStats])
+
+    def addFitStats(self, fitVal):
+        """
+        Adds the statistics of a finished fit to the statistics of the last fit.
+
+        Parameters
+        ----------
+        fitVal : OptimizeResult
+            The result of the fit.
+        """
+        if self.fitStats is None:
+            self.resetFitStats()
+        self.fitStats['Fits'] += 1
+        self.fitStats['Iterations'] += fitVal.get('nit', 0)
+        self.fitStats['Function evaluations'] += fitVal.get('nfev', 0)
+        if 'cacheHits' in fitVal:
+            # Only the derivative-free methods evaluate the cost through a cache
+            self.fitStats['Cache hits'] = self.fitStats.get('Cache hits', 0) + fitVal['cacheHits']
+            self.fitStats['Cache misses'] = self.fitStats.get('Cache misses', 0) + fitVal['cacheMisses']
+        if 'profile' in fitVal:
+            self.fitProfile = mergeProfiles(self.fitProfile, fitVal['profile'])
+        if 'startCosts' in fitVal:
+            # The spread of the local minima of the last multi-start fit
+            costs = fitVal['startCosts']
+            fmt = '%#.' + str(self.PRECIS) + 'g'
+            self.fitStats['Starts'] = len(costs)
+            self.fitStats['Best minimum'] = fmt % costs[0]
+            self.fitStats['Median minimum'] = fmt % np.median(costs)
+            self.fitStats['Worst minimum'] = fmt % costs[-1]
+            self.fitStats['Starts near best'] = int(np.sum(costs <= costs[0] * 1.01))
+
+    def setFitAllProgress(self, done, total):
+        """
+        Shows the progress of fitAll on the stop all button.
+
+        Parameters
+        ----------
+        done : int
+            The number of finished slices.
+        total : int
+            The total number of slices.
+        """
+        self.mainFitWindow.paramframe.stopAllButton.setText("Stop all (" + str(done) + "/" + str(total) + ")")
+
+    def fitAll(self, *args):
+        """
+        Opens all slices from an ND spectrum and runs a fit.
+        The slices are fitted in parallel when NUMWORKERS is larger than 1, except for multi-start fits.
+        When SINKFILE is set, the results of every slice are appended to that file as the slice finishes.
+        """
+        sink = None
+        if self.SINKFILE:
+            sink = ResultsSink(self.SINKFILE, self.SINKCURVES, self.SINKRESUME)
+        self.runningAll = True
+        self.resetFitStats()
+        grid = self.getSliceGrid()
+        self.mainFitWindow.paramframe.stopAllButton.show()
+        try:
+            if sink is not None and sink.done:
+                grid = self.restoreSinkResults(sink, grid)
+            self.setFitAllProgress(0, len(grid))
+            finished = {}
+            if self.BATCHFIT and not self.subFitWindows and self.mainFitWindow.paramframe.FITFUNC in simFunc.BATCHED and len(grid) > 1:
+                self.fitAllBatch(grid, sink)
+            elif self.NUMWORKERS > 1 and self.NUMSTARTS == 1 and len(grid) > 1:
+                self.fitAllParallel(grid, sink)
+            else:
+                for num, i in enumerate(grid):
+                    QtWidgets.qApp.processEvents()
+                    if self.runningAll is False:
+                        break
+                    self.mainFitWindow.current.setSlice(self.mainFitWindow.current.axes, i)
+                    seed = None
+                    if self.WARMSTART != 'None':
+                        seed = lambda guess, fitArgs, num=num: self.getWarmStart(num, grid, guess, fitArgs, finished)
+                    result = self.fit(seed)
+                    if result is not None:
+                        self.addSliceStats(result[0])
+                        if 'stopped' not in result[0]:
+                            finished[num] = (result[0]['x'], result[1])
+                        if sink is not None:
+                            self.recordSlice(sink, *result)
+                    self.mainFitWindow.sideframe.upd()
+                    self.setFitAllProgress(num + 1, len(grid))
+        finally:
+            self.runningAll = False
+            self.mainFitWindow.paramframe.stopAllButton.hide()
+            if sink is not None:
+                sink.close()
+            self.addFitAllStats()
+        if sink is not None:
+            self.mainFitWindow.sim()  # Only the curves of the displayed slice are kept
+
+    def recordSlice(self, sink, fitVal, fitArgs, rmsd=None):
+        """
+        Appends the result of the current slice to a results sink.
+        The curves of the slice are removed from memory afterwards.
+
+        Parameters
+        ----------
+        sink : ResultsSink
+            The sink to write to.
+        fitVal : OptimizeResult
+            The result of the fit of the slice.
+        fitArgs : tuple
+            The fit arguments of the slice.
+        rmsd : float, optional
+            The RMSD of the fit.
+            By default it is determined from the simulated curves of the slice.
+        """
+        current = self.mainFitWindow.current
+        locList = current.getRedLocList()
+        curves = [current.fitDataList[locList]]
+        curves += [window.current.fitDataList[window.current.getRedLocList()] for window in self.subFitWindows]
+        if any(item is None for item in curves):
+            curves = None
+        if rmsd is None:
+            rmsd = self.mainFitWindow.paramframe.getRMSD()
+        if rmsd is None:
+            rmsd = np.nan
+        sink.record(locList, self.getFitParamLabels(fitArgs), fitVal, rmsd, curves)
+        current.fitDataList[locList] = None
+
+    def restoreSinkResults(self, sink, grid):
+        """
+        Sets the results of the slices that were already fitted in a resumed results sink.
+
+        Parameters
+        ----------
+        sink : ResultsSink
+            The sink with the finished slices.
+        grid : ndarray
+            Array with the location of a slice on every row.
+
+        Returns
+        -------
+        ndarray
+            The rows of grid that still need to be fitted.
+        """
+        current = self.mainFitWindow.current
+        todo = []
+        for loc in grid:
+            current.setSlice(current.axes, loc, False)
+            result = sink.done.get(sliceKey(current.getRedLocList()))
+            problem = None
+            if result is not None:
+                problem = self.prepareFit()
+            if problem is None or self.getFitParamLabels(problem[4]) != sink.labels:
+                todo.append(loc)
+                continue
+            self.setFitResults(result['x'], problem[6], problem[7])
+            current.fitDataList[current.getRedLocList()] = None
+        return np.array(todo, dtype=int).reshape(-1, grid.shape[1])
+
+    def fitAllBatch(self, grid, sink=None):
+        """
+        Fits all slices at once as a single least-squares problem, with independent parameters per slice.
+        This requires the same fitted parameters in all slices and a fit function in simFunctions.BATCHED.
+        Only the displayed slice is simulated afterwards.
+
+        Parameters
+        ----------
+        grid : ndarray
+            Array with the location of a slice on every row.
+        sink : ResultsSink, optional
+            When given, the result of every slice is appended to this sink.
+        """
+        current = self.mainFitWindow.current
+        oldLocList = np.array(current.locList, dtype=int)
+        try:
+            problems = []
+            for loc in grid:
+                current.setSlice(current.axes, loc, False)
+                problem = self.prepareFit()
+                if problem is None:
+                    return
+                problems.append(problem)
+            xax, _, _, _, fitArgs, funcs, _, _ = problems[0]
+            fixed = stackFitArgs([problem[4] for problem in problems])
+            data = np.array([problem[1][0] for problem in problems], dtype=float)
+            masks = [problem[2][0] for problem in problems]
+            if all(np.ndim(mask) == 0 and mask == 1.0 for mask in masks):
+                mask = 1.0
+            else:
+                mask = np.array([np.broadcast_to(mask, data.shape[1:]) for mask in masks], dtype=float)
+            guesses = np.array([problem[3] for problem in problems], dtype=float)
+            pool = self.getFitPool()
+            pool.setContext(xax, funcs, fitArgs)
+            pool.submitBatch(0, 0, data, mask, guesses, fixed, fitArgs, self.NUMFEVAL)
+            fitVal = self.waitForFit(pool)
+            if fitVal is None:
+                return
+            self.addFitStats(fitVal)
+            values = np.reshape(fitVal['x'], (len(grid), -1))
+            sumSquares = np.broadcast_to(fitVal['sumSquares'] if np.ndim(fitVal['sumSquares']) else np.nan, len(grid))
+            rmsd = fitVal.get('rmsd', np.full(len(grid), np.nan))
+            simulate = sink is not None and sink.storeCurves  # The curves of a slice are only needed to store them
+            for num, loc in enumerate(grid):
+                current.setSlice(current.axes, loc, False)
+                _, _, _, _, fitArgs, _, selectList, args = problems[num]
+                self.setFitResults(values[num], selectList, args, simulate)
+                if sink is not None:
+                    sliceVal = {'x': values[num], 'fun': sumSquares[num], 'sumSquares': sumSquares[num], 'nfev': fitVal['nfev'], 'stopped': fitVal.get('stopped', False)}
+                    self.recordSlice(sink, sliceVal, fitArgs, rmsd[num])
+                else:
+                    current.fitDataList[current.getRedLocList()] = None
+            self.setFitAllProgress(len(grid), len(grid))
+        finally:
+            current.setSlice(current.axes, oldLocList)
+        self.mainFitWindow.sim()
+
+    def fitAllParallel(self, grid, sink=None):
+        """
+        Fits the slices of an ND spectrum in parallel with NUMWORKERS worker processes.
+        The results are stored in the parameter lists of the slices as they finish.
+
+        Parameters
+        ----------
+        grid : ndarray
+            Array with the location of a slice on every row.
+        sink : ResultsSink, optional
+            When given, the result of every slice is appended to this sink.
+        """
+        current = self.mainFitWindow.current
+        oldLocList = np.array(current.locList, dtype=int)
+        pool = self.getFitPool(self.NUMWORKERS)
+        freeWorkers = list(range(max(1, self.NUMWORKERS)))
+        busy = {}
+        finished = {}
+        nextSlice = 0
+        self.running = True
+        try:
+            while self.runningAll and (nextSlice < len(grid) or busy):
+                while freeWorkers and nextSlice < len(grid):
+                    current.setSlice(current.axes, grid[nextSlice], False)
+                    problem = self.prepareFit()
+                    if problem is None:
+                        self.stopAll()
+                        return
+                    xax, data1D, maskList, guess, fitArgs, funcs, selectList, args = problem
+                    if self.WARMSTART != 'None':
+                        guess = self.getWarmStart(nextSlice, grid, guess, fitArgs, finished)
+                    worker = freeWorkers.pop(0)
+                    pool.setContext(xax, funcs, fitArgs)
+                    pool.submit(worker, nextSlice, data1D, maskList, guess, fitArgs, self.MINMETHOD, self.NUMFEVAL, self.PROFILE)
+                    busy[nextSlice] = (worker, fitArgs, selectList, args)
+                    nextSlice += 1
+                result = pool.getResult(0.1)
+                if result is not None:
+                    num, fitVal = result
+                    worker, fitArgs, selectList, args = busy.pop(num)
+                    freeWorkers.append(worker)
+                    if fitVal is None:
+                        self.stopAll()
+                        raise FittingException('Optimal parameters not found')
+                    if isinstance(fitVal, str):
+                        self.stopAll()
+                        raise FittingException(fitVal)
+                    finished[num] = (fitVal['x'], fitArgs)
+                    self.addFitStats(fitVal)
+                    current.setSlice(current.axes, grid[num], False)
+                    self.addSliceStats(fitVal)
+                    self.setFitResults(fitVal['x'], selectList, args)
+                    if sink is not None:
+                        self.recordSlice(sink, fitVal, fitArgs)
+                    self.mainFitWindow.sideframe.upd()
+                    self.setFitAllProgress(len(finished), len(grid))
+                elif not pool.isAlive():
+                    self.stopAll()
+                    raise FittingException('The fitting process stopped unexpectedly')
+                QtWidgets.qApp.processEvents()
+        finally:
+            self.running = False
+            current.setSlice(current.axes, oldLocList)
+
+    def getWarmStart(self, num, grid, guess, fitArgs, finished):
+        """
+        Returns the initial guess of a slice derived from the finished slices, according to WARMSTART.
+        The distance between slices is measured with their locations in the spectrum.
+        With 'Previous' the result of the nearest finished slice is used.
+        With 'Linear' the results of the two nearest finished slices on a line through the slice along one dimension are extrapolated linearly to the slice.
+        The dimension with the nearest pair of finished slices is used.
+        When no dimension has two finished slices, the result of the nearest finished slice is used.
+
+        Parameters
+        ----------
+        num : int
+            The index of the slice to be fitted.
+        grid : ndarray
+            Array with the location of a slice on every row.
+        guess : list
+            The initial guess of the slice.
+        fitArgs : tuple
+            The fit arguments of the slice.
+        finished : dict
+            Dictionary with the fit results and arguments of the finished slices, with their index in grid as key.
+
+        Returns
+        -------
+        list
+            The initial guess.
+            The original guess is returned when no finished slice has the same parameter structure.
+        """
+        keys = [key for key, (fitVal, doneArgs) in finished.items() if np.size(fitVal) == len(guess) and sameContext(doneArgs[:3], fitArgs[:3])]
+        if not keys:
+            return guess
+        keys = np.array(keys, dtype=int)
+        diff = grid[keys] - grid[num]
+        if self.WARMSTART == 'Linear':
+            best = None
+            for axis in range(grid.shape[1]):
+                line = np.nonzero(np.all(np.delete(diff, axis, axis=1) == 0, axis=1))[0]
+                if len(line) < 2:
+                    continue
+                line = line[np.argsort(np.abs(diff[line, axis]), kind='stable')[:2]]
+                dist = abs(diff[line[1], axis])
+                if best is None or dist < best[0]:
+                    best = (dist, line, axis)
+            if best is not None:
+                _, (near1, near2), axis = best
+                val1 = np.atleast_1d(finished[keys[near1]][0])
+                val2 = np.atleast_1d(finished[keys[near2]][0])
+                return list(val1 - (val1 - val2) * diff[near1, axis] / float(diff[near1, axis] - diff[near2, axis]))
+        nearest = np.lexsort((np.abs(keys - num), np.sum(diff**2, axis=1)))[0]
+        return list(np.atleast_1d(finished[keys[nearest]][0]))
+
+    def prepareFit(self):
+        """
+        Collects the data and parameters of all tabs for a fit of the current slice.
+
+        Returns
+        -------
+        tuple or None
+            The tuple (xax, data1D, maskList, guess, fitArgs, funcs, selectList, args), or None if the parameters are not valid.
         """
         value = self.mainFitWindow.paramframe.getFitParams()
         if value is None:
-            return
+            return None
         xax, data1D, guess, args, out, mask = value
         xax = [xax]
         data1D = [data1D]
@@ -316,11 +954,61 @@ class TabFittingWindow(QtWidgets.QWidget):
             for n, _ in enumerate(args):
                 new_args += (args[n] + args_tmp[n],)
             args = new_args  # tuples are immutable
-        new_args = (selectList,) + args
-        allFitVal = self.fitProcess(xax, np.array(data1D), maskList, guess, new_args, funcs)
+        fitArgs = (selectList,) + args
+        return xax, np.array(data1D), maskList, guess, fitArgs, funcs, selectList, args
+
+    def fit(self, seed=None):
+        """
+        Fits a spectrum on the current slice.
+
+        Parameters
+        ----------
+        seed : function, optional
+            Function seed(guess, fitArgs) that returns the initial guess of the fit.
+            By default the values of the parameter frames are used.
+
+        Returns
+        -------
+        tuple or None
+            The tuple (fitVal, fitArgs) with the result and arguments of the fit, or None if no fit was done.
+        """
+        problem = self.prepareFit()
+        if problem is None:
+            return None
+        xax, data1D, maskList, guess, fitArgs, funcs, selectList, args = problem
+        if seed is not None:
+            guess = seed(guess, fitArgs)
+        if self.NUMSTARTS > 1:
+            allFitVal = self.fitMultiStart(xax, data1D, maskList, guess, fitArgs, funcs)
+        else:
+            allFitVal = self.fitProcess(xax, data1D, maskList, guess, fitArgs, funcs)
         if allFitVal is None:
-            return
-        allFitVal = allFitVal['x']
+            return None
+        if not self.runningAll:
+            self.resetFitStats()
+        self.addFitStats(allFitVal)
+        self.setFitResults(allFitVal['x'], selectList, args)
+        self.fitErrors = None
+        if self.NUMERRORSAMPLES > 1 and not self.runningAll and 'stopped' not in allFitVal:
+            self.fitErrors = self.estimateErrors(xax, data1D, maskList, allFitVal, fitArgs, funcs)
+        return allFitVal, fitArgs
+
+    def setFitResults(self, allFitVal, selectList, args, simulate=True):
+        """
+        Sets the fit results in the parameter frames of all tabs.
+
+        Parameters
+        ----------
+        allFitVal : ndarray
+            The fitted values of all tabs.
+        selectList : list of slice
+            The parts of allFitVal belonging to each tab.
+        args : tuple
+            The additional parameters of the fit.
+        simulate : bool, optional
+            When True the spectra are simulated with the new parameters.
+            True by default.
+        """
         fitVal = []
         for length in selectList:
             if allFitVal.ndim == 0:
@@ -330,12 +1018,12 @@ class TabFittingWindow(QtWidgets.QWidget):
         args_out = []
         for n, _ in enumerate(args):
             args_out.append([args[n][0]])
-        self.mainFitWindow.paramframe.setResults(fitVal[0], args_out)
+        self.mainFitWindow.paramframe.setResults(fitVal[0], args_out, simulate)
         for i, _ in enumerate(self.subFitWindows):
             args_out = []
             for n, _ in enumerate(args):
                 args_out.append([args[n][i + 1]])
-            self.subFitWindows[i].paramframe.setResults(fitVal[i + 1], args_out)
+            self.subFitWindows[i].paramframe.setResults(fitVal[i + 1], args_out, simulate)
 
     def getNum(self, paramfitwindow):
         """
@@ -384,6 +1072,7 @@ class TabFittingWindow(QtWidgets.QWidget):
         **kwargs
             All keyword arguments are passed to the disp functions of the parameter frames.
         """
+        self.simPreview.cancel()
         self.mainFitWindow.paramframe.simBusyButton.show()
         QtWidgets.qApp.processEvents()
         try:
@@ -398,16 +1087,215 @@ class TabFittingWindow(QtWidgets.QWidget):
         finally:
             self.mainFitWindow.paramframe.simBusyButton.hide()
 
+    def previewSim(self, report=True, delay=0):
+        """
+        Requests a simulation of all spectra that runs in the background.
+        Requests made before the simulation starts are combined, and the results of outdated simulations are discarded.
+
+        Parameters
+        ----------
+        report : bool, optional
+            When True errors of the simulation are raised, otherwise these are ignored.
+            True by default.
+        delay : int, optional
+            The number of milliseconds to wait for further requests before the simulation starts.
+            0 by default.
+        """
+        self.simPreview.request(report, delay)
+
+    def getSimJobs(self):
+        """
+        Collects the simulation inputs of all tabs.
+
+        Returns
+        -------
+        list of tuple or None
+            The parameter frame and the input of its simulation for every tab that has something to simulate,
+            or None if the parameters are not valid.
+        """
+        params = self.getParams()
+        if params is None:
+            return None
+        frames = [self.mainFitWindow.paramframe] + [window.paramframe for window in self.subFitWindows]
+        jobs = []
+        for num, frame in enumerate(frames):
+            simInput = frame.getSimInput(params, num)
+            if simInput is not None:
+                jobs.append((frame, simInput))
+        return jobs
+
     def kill(self):
         """
         Closes the fitting window.
         """
         self.tabs.currentChanged.disconnect() # Prevent call for data on close
+        self.simPreview.cancel(True)
+        self.closeFitPool()
         self.mainFitWindow.kill()
 
 ##############################################################################
 
 
+class SimThread(QtCore.QThread):
+    """
+    The thread that runs the simulations of a preview.
+    """
+
+    def __init__(self, parent, jobs, generation, report):
+        """
+        Initializes the thread.
+
+        Parameters
+        ----------
+        parent : TabFittingWindow
+            The fitting window.
+        jobs : list of tuple
+            The parameter frames and simulation inputs, as returned by getSimJobs.
+        generation : int
+            The number of the request of this simulation.
+        report : bool
+            True if errors of the simulation should be raised.
+        """
+        super(SimThread, self).__init__(parent)
+        self.jobs = jobs
+        self.generation = generation
+        self.report = report
+        self.results = None
+        self.error = None
+
+    def run(self):
+        """
+        Simulates all jobs.
+        """
+        try:
+            self.results = [frame.calcSim(simInput) for frame, simInput in self.jobs]
+        except Exception as e:
+            self.error = e
+
+##############################################################################
+
+
+class SimPreview(object):
+    """
+    Runs the simulation previews of a fitting window in a background thread.
+    Requests are debounced with a timer, only one simulation runs at a time,
+    and a simulation of which the parameters have changed since the request is discarded.
+    """
+
+    def __init__(self, tabWindow):
+        """
+        Initializes the preview.
+
+        Parameters
+        ----------
+        tabWindow : TabFittingWindow
+            The fitting window.
+        """
+        self.tabWindow = tabWindow
+        self.timer = QtCore.QTimer(tabWindow)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.start)
+        self.thread = None
+        self.staleThreads = []
+        self.generation = 0
+        self.report = False
+        self.pending = False
+
+    def request(self, report=True, delay=0):
+        """
+        Requests a simulation, which replaces any earlier request.
+
+        Parameters
+        ----------
+        report : bool, optional
+            When True errors of the simulation are raised.
+        delay : int, optional
+            The number of milliseconds before the simulation starts.
+        """
+        self.generation += 1
+        self.report = self.report or report
+        self.timer.start(delay)
+
+    def start(self):
+        """
+        Starts the simulation of the latest request.
+        When a simulation is still running, the request starts once it is finished.
+        """
+        if self.thread is not None:
+            self.pending = True
+            return
+        report = self.report
+        self.report = False
+        try:
+            jobs = self.tabWindow.getSimJobs()
+        except Exception:
+            if report:
+                raise
+            return
+        if not jobs:
+            return
+        thread = SimThread(self.tabWindow, jobs, self.generation, report)
+        thread.finished.connect(lambda: self.finished(thread))
+        self.thread = thread
+        self.tabWindow.mainFitWindow.paramframe.simBusyButton.show()
+        thread.start()
+
+    def finished(self, thread):
+        """
+        Displays the results of a finished simulation when these are not outdated.
+
+        Parameters
+        ----------
+        thread : SimThread
+            The finished thread.
+        """
+        thread.deleteLater()
+        if thread is not self.thread:  # Cancelled
+            if thread in self.staleThreads:
+                self.staleThreads.remove(thread)
+            return
+        self.thread = None
+        pending = self.pending
+        self.pending = False
+        self.tabWindow.mainFitWindow.paramframe.simBusyButton.hide()
+        if pending:
+            self.start()
+        if thread.generation != self.generation:
+            return
+        if thread.error is not None:
+            if thread.report:
+                raise thread.error
+            return
+        for (frame, simInput), fitData in zip(thread.jobs, thread.results):
+            frame.setSim(simInput, fitData)
+
+    def cancel(self, wait=False):
+        """
+        Cancels all requests.
+        A running simulation is left to finish in the background, after which its result is discarded.
+
+        Parameters
+        ----------
+        wait : bool, optional
+            When True, waits for the running simulations to finish, which is needed before the window is closed.
+            False by default.
+        """
+        self.generation += 1
+        self.timer.stop()
+        self.report = False
+        self.pending = False
+        if self.thread is not None:
+            self.staleThreads.append(self.thread)
+            self.thread = None
+            self.tabWindow.mainFitWindow.paramframe.simBusyButton.hide()
+        if wait:
+            for thread in self.staleThreads:
+                thread.wait()
+            self.staleThreads = []
+
+##############################################################################
+
+
 class ResultsExportWindow(QtWidgets.QWidget):
     """
     The window for exporting or importing parameters.
@@ -447,9 +1335,60 @@ class ResultsExportWindow(QtWidgets.QWidget):
         importGrid.addWidget(self.fileToParButton, 3, 0)
         importGroup.setLayout(importGrid)
         grid.addWidget(importGroup, 1, 0)
+        fitStats = self.father.rootwindow.tabWindow.fitStats
+        if fitStats is not None:
+            statsGroup = QtWidgets.QGroupBox("Last fit:")
+            statsGrid = QtWidgets.QGridLayout()
+            for row, key in enumerate(fitStats):
+                statsGrid.addWidget(wc.QLabel(key + ':'), row, 0)
+                statsGrid.addWidget(wc.QLabel(str(fitStats[key])), row, 1)
+            evals = fitStats.get('Cache hits', 0) + fitStats.get('Cache misses', 0)
+            if evals > 0:
+                statsGrid.addWidget(wc.QLabel('Cache hit rate:'), len(fitStats), 0)
+                statsGrid.addWidget(wc.QLabel('%.1f %%' % (100.0 * fitStats['Cache hits'] / evals)), len(fitStats), 1)
+            statsGroup.setLayout(statsGrid)
+            grid.addWidget(statsGroup, 2, 0)
+        fitErrors = self.father.rootwindow.tabWindow.fitErrors
+        if fitErrors is not None:
+            errorGroup = QtWidgets.QGroupBox("Uncertainties (" + str(fitErrors['samples']) + " samples):")
+            errorGrid = QtWidgets.QGridLayout()
+            labels = fitErrors['labels']
+            table = QtWidgets.QTableWidget(len(labels), 2 + len(labels))
+            table.setHorizontalHeaderLabels(['Value', 'Std. dev.'] + ['Corr. ' + str(i + 1) for i in range(len(labels))])
+            table.setVerticalHeaderLabels([str(i + 1) + ' ' + label for i, label in enumerate(labels)])
+            fmt = '%#.' + str(self.father.rootwindow.tabWindow.PRECIS) + 'g'
+            for row, _ in enumerate(labels):
+                values = [fitErrors['values'][row], fitErrors['std'][row]] + list(fitErrors['corr'][row])
+                for col, val in enumerate(values):
+                    item = QtWidgets.QTableWidgetItem(fmt % val if col < 2 else '%.3f' % val)
+                    item.setFlags(QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled)
+                    table.setItem(row, col, item)
+            table.resizeColumnsToContents()
+            errorGrid.addWidget(table, 0, 0)
+            errorGroup.setLayout(errorGrid)
+            grid.addWidget(errorGroup, 3, 0)
+        fitProfile = self.father.rootwindow.tabWindow.fitProfile
+        if fitProfile is not None:
+            profileGroup = QtWidgets.QGroupBox("Profile:")
+            profileGrid = QtWidgets.QGridLayout()
+            table = QtWidgets.QTableWidget(len(fitProfile), 4)
+            table.setHorizontalHeaderLabels(['Calls', 'Time [s]', 'Per call [ms]', 'Share [%]'])
+            table.setVerticalHeaderLabels(list(fitProfile))
+            total = max(fitProfile['Fit'][1], 1e-12)
+            for row, key in enumerate(fitProfile):
+                calls, seconds = fitProfile[key]
+                values = [str(calls) if calls else '', '%.3f' % seconds, '%.3f' % (1e3 * seconds / calls) if calls else '', '%.1f' % (100.0 * seconds / total)]
+                for col, val in enumerate(values):
+                    item = QtWidgets.QTableWidgetItem(val)
+                    item.setFlags(QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled)
+                    table.setItem(row, col, item)
+            table.resizeColumnsToContents()
+            profileGrid.addWidget(table, 0, 0)
+            profileGroup.setLayout(profileGrid)
+            grid.addWidget(profileGroup, 4, 0)
         cancelButton = QtWidgets.QPushButton("&Cancel")
         cancelButton.clicked.connect(self.closeEvent)
-        grid.addWidget(cancelButton, 4, 0)
+        grid.addWidget(cancelButton, 5, 0)
         grid.setRowStretch(100, 1)
         self.show()
         self.setGeometry(self.frameSize().width() - self.geometry().width(), self.frameSize().height() - self.geometry().height(), 0, 0)
@@ -712,6 +1651,13 @@ class FittingWindow(QtWidgets.QWidget):
         self.tabWindow.disp(**kwargs)
         self.paramframe.togglePick()
 
+    def previewSim(self, *args):
+        """
+        Perform a simulation in the background.
+        """
+        self.tabWindow.previewSim()
+        self.paramframe.togglePick()
+
     def removeSpectrum(self):
         """
         Removes itself from the tabs.
@@ -864,7 +1810,7 @@ class FitPlotFrame(Current1D):
         """
         return tuple(np.delete(self.locList, self.axes))
 
-    def setSlice(self, axes, locList):
+    def setSlice(self, axes, locList, display=True):
         """
         Changes the displayed slice.
 
@@ -874,10 +1820,18 @@ class FitPlotFrame(Current1D):
             The list of axes of the slice to be displayed.
         locList : array_like of int
             The location of the slice to be displayed.
+        display : bool, optional
+            When False the data of the slice is loaded without redrawing the plot.
+            Only possible when the axes do not change.
+            True by default.
         """
         self.rootwindow.paramframe.checkInputs()
         self.pickWidth = False
-        super(FitPlotFrame, self).setSlice(axes, locList)
+        if display or not np.array_equal(self.axes, axes):
+            super(FitPlotFrame, self).setSlice(axes, locList)
+        else:
+            self.locList = locList
+            self.upd()
         self.rootwindow.paramframe.checkFitParamList(self.getRedLocList())
         self.rootwindow.paramframe.dispParams()
         self.rootwindow.paramframe.togglePick()
@@ -1023,7 +1977,7 @@ class AbstractParamFrame(QtWidgets.QWidget):
         self.frame2.setAlignment(QtCore.Qt.AlignTop)
         self.frame3.setAlignment(QtCore.Qt.AlignTop)
         self.simButton = QtWidgets.QPushButton("Sim")
-        self.simButton.clicked.connect(self.rootwindow.sim)
+        self.simButton.clicked.connect(self.rootwindow.previewSim)
         self.frame1.addWidget(self.simButton, 0, 0, 1, 1)
         self.simBusyButton = QtWidgets.QPushButton("Busy")
         self.simBusyButton.setEnabled(False)
@@ -1070,6 +2024,10 @@ class AbstractParamFrame(QtWidgets.QWidget):
         self.frame1.addWidget(cancelButton, 4, 0, 1, 2)
         rmsdFrame = QtWidgets.QGridLayout()
         self.frame1.addLayout(rmsdFrame, 5, 0, 1, 2)
+        if self.isMain:
+            self.fitProgressLabel = wc.QLabel('')
+            self.frame1.addWidget(self.fitProgressLabel, 6, 0, 1, 2)
+            self.fitProgressLabel.hide()
         self.rmsdLabel = QtWidgets.QLabel('RMSD:')
         rmsdFrame.addWidget(self.rmsdLabel, 0, 0)
         self.rmsdEdit = wc.QLineEdit()
@@ -1195,6 +2153,7 @@ class AbstractParamFrame(QtWidgets.QWidget):
         Closes the fitting window.
         """
         self.rootwindow.tabWindow.stopMP()
+        self.rootwindow.tabWindow.closeFitPool()
         self.rootwindow.cancel()
 
     def copyParams(self):
@@ -1366,7 +2325,7 @@ class AbstractParamFrame(QtWidgets.QWidget):
         mask = self.genMask()
         return (self.parent.data1D.xaxArray[-self.DIM:], self.parent.getData1D(), guess, args, out, mask)
 
-    def setResults(self, fitVal, args):
+    def setResults(self, fitVal, args, simulate=True):
         """
         Set the results in the fit parameter list based on the given fit results.
 
@@ -1376,6 +2335,9 @@ class AbstractParamFrame(QtWidgets.QWidget):
             The results of the fit.
         args : list
             The arguments to the fit.
+        simulate : bool, optional
+            When True the spectrum is simulated with the new parameters.
+            True by default.
         """
         locList = self.getRedLocList()
         numExp = args[0][0]
@@ -1389,12 +2351,21 @@ class AbstractParamFrame(QtWidgets.QWidget):
                     self.fitParamList[locList][name][i][0] = fitVal[struc[name][i][1]]
         self.checkResults(numExp, struc)
         self.dispParams()
-        self.rootwindow.sim()
+        if simulate:
+            self.rootwindow.sim()
 
     def checkResults(self, numExp, struc):
         # A dummy function that is replaced by a function that checks the fit results (e.g., makes values absolute, etc)
         pass
 
+    def paramEdited(self):
+        """
+        Requests a background simulation after the user edited a parameter, when live previews are enabled.
+        """
+        tabWindow = self.rootwindow.tabWindow
+        if tabWindow.LIVEPREVIEW:
+            tabWindow.previewSim(False, tabWindow.PREVIEWDELAY)
+
     def getSimParams(self):
         """
         Returns the dictionary with simulation parameters.
@@ -1534,70 +2505,13 @@ class AbstractParamFrame(QtWidgets.QWidget):
             fileName = fileName[0]
         if not fileName:
             return False
-        with open(fileName, "r") as fp:
-            report = fp.read()
-        splitReport = re.split("#{20,}\n", report)
-        postReport = splitReport[1]
-        postReport = re.split("#!", postReport)
-        if len(postReport) == 1:
-            postReport = []
-        else:
-            postReport = postReport[1:]
-        postParams = {}
-        for i, _ in enumerate(postReport):
-            tmp = postReport[i].split('\n', 1)
-            postParams[tmp[0].strip()] = tmp[1].strip()
-        splitReport = re.split("#\?", splitReport[0])
-        preReport = splitReport[0].split('\n')
-        preParams = {}
-        removeLimits = {'invert' : False, 'limits': []}
-        savedAxType = None
-        savedPPM = False
-        for line in preReport:
-            tmp = line.strip()
-            if tmp.startswith("#!"):
-                tmp = tmp[2:].strip().split('=')
-                preParams[tmp[0].strip()] = tmp[1].strip()
-            elif tmp.startswith("# Excluded:"):
-                if "invert" in tmp:
-                    removeLimits["invert"] = True
-                else:
-                    removeLimits["limits"] = safeEval(tmp.split(":")[1])
-            elif tmp.startswith("# Units:"):
-                tmp2 = tmp.split(":")[1]
-                if 'ppm' in tmp2:
-                    savedPPM = True
-                    savedAxType = 0
-                elif 'MHz' in tmp2 or 'us' in tmp2:
-                    savedAxType = 2
-                elif 'kHz' in tmp2 or 'ms' in tmp2:
-                    savedAxType = 1
-                else:
-                    savedAxType = 0
-        singleReport = splitReport[1].split('\n')
-        multiReport = splitReport[2].split('\n')
-        singleNames = singleReport[0].split()
-        singleVals = []
-        for line in singleReport[1:]:
-            tmp = line.strip()
-            if tmp and tmp[0] != '#':
-                singleVals.append(tmp.split())
-        if len(singleVals) > 1:
-            raise FittingException("Incorrect number of parameters in file")
-        singleVals = self.__interpretParam(singleVals)
-        multiNames = multiReport[0].split()
-        multiVals = []
-        for line in multiReport[1:]:
-            tmp = line.strip()
-            if tmp and tmp[0] != '#':
-                multiVals.append(tmp.split())
-        multiVals = self.__interpretParam(multiVals)
-        self.extraFileToParam(preParams, postParams)
-        self.setParamFromList(singleNames, singleVals, multiNames, multiVals, removeLimits)
-        if savedAxType is not None:
+        params = readParamFile(fileName)
+        self.extraFileToParam(params['preParams'], params['postParams'])
+        self.setParamFromList(params['singleNames'], params['singleVals'], params['multiNames'], params['multiVals'], params['removeLimits'])
+        if params['axType'] is not None:
             savedAxMult = self.parent.getAxMult(self.parent.spec(),
-                                                savedAxType,
-                                                savedPPM,
+                                                params['axType'],
+                                                params['ppm'],
                                                 self.parent.freq(),
                                                 self.parent.ref())
             self.changeAxMult(savedAxMult)
@@ -1605,32 +2519,6 @@ class AbstractParamFrame(QtWidgets.QWidget):
         self.parent.showFid()
         return True
 
-    def __interpretParam(self, strList):
-        """
-        Checks a given list of strings to interpret them as fit parameters.
-
-        Parameters
-        ----------
-        strList : list of lists of str
-
-        Returns
-        -------
-        list
-            List of values or tuples (as long as they match a link tuple).
-        """
-        data = []
-        for i, _ in enumerate(strList):
-            tmp = []
-            for j, _ in enumerate(strList[i]):
-                if strList[i][j][0] == '*':
-                    tmp.append([safeEval(strList[i][j][1:]), True])
-                else:
-                    tmp.append([safeEval(strList[i][j]), False])
-                if isinstance(tmp[-1][0], tuple):
-                    tmp[-1][0] = checkLinkTuple(tmp[-1][0])
-            data.append(tmp)
-        return data
-
     def setParamFromList(self, singleNames, singleVals, multiNames, multiVals, removeLimits=None):
         """
         Set the values in the fit parameter list to the given values.
@@ -1859,6 +2747,31 @@ class AbstractParamFrame(QtWidgets.QWidget):
             When True the simulated data will also be displayed.
             True by default.
         """
+        simInput = self.getSimInput(params, num, display)
+        if simInput is not None:
+            self.setSim(simInput, self.calcSim(simInput))
+
+    def getSimInput(self, params, num, display=True):
+        """
+        Collects everything needed to simulate the spectrum, with the linked parameters resolved.
+        The simulation itself (calcSim) does not access the widgets, such that it can run in a background thread.
+
+        Parameters
+        ----------
+        params : list
+            The list of parameters of all tabs.
+        num : int
+            The tab number.
+            The parameters at position num in params belong to this tab.
+        display : bool, optional
+            When True the simulation is done on the x-axis of the plot.
+            True by default.
+
+        Returns
+        -------
+        dict or None
+            The input of calcSim, or None if there is nothing to simulate.
+        """
         out = params[num]
         try:
             for name in self.SINGLENAMES:
@@ -1867,7 +2780,7 @@ class AbstractParamFrame(QtWidgets.QWidget):
                     inp = checkLinkTuple(inp)
                     out[name][0] = inp[2] * params[inp[4]][inp[0]][inp[1]] + inp[3]
             if not self.MULTINAMES: #Abort if no names
-                return
+                return None
             numExp = len(out[self.MULTINAMES[0]])
             for i in range(numExp):
                 for name in self.MULTINAMES:
@@ -1883,6 +2796,26 @@ class AbstractParamFrame(QtWidgets.QWidget):
             tmpx = self.getDispX()
         else:
             tmpx = self.parent.data1D.xaxArray[-self.DIM:]
+        return {'out': out, 'x': tmpx, 'display': display, 'locList': self.getRedLocList(),
+                'func': self.FITFUNC, 'fftAxes': self.FFT_AXES, 'fftshiftAxes': self.FFTSHIFT_AXES,
+                'freq': self.parent.data1D.freq, 'sw': self.parent.data1D.sw, 'axMult': self.axMult}
+
+    def calcSim(self, simInput):
+        """
+        Simulates the spectrum.
+
+        Parameters
+        ----------
+        simInput : dict
+            The input as returned by getSimInput.
+
+        Returns
+        -------
+        list
+            The x-axis of the plot, the total simulation, and the x-axis and simulation of every site.
+        """
+        out = simInput['out']
+        tmpx = simInput['x']
         if "Offset" in out.keys():
             offset = out["Offset"][0]
         else:
@@ -1898,25 +2831,51 @@ class AbstractParamFrame(QtWidgets.QWidget):
             x.append(plotx)
             inputVars = [out[name][0] for name in self.SINGLENAMES]
             inputVars += [out[name][i] for name in self.MULTINAMES]
-            y = self.FITFUNC(tmpx, self.parent.data1D.freq, self.parent.data1D.sw, self.axMult, out['extra'], *inputVars)
+            y = simInput['func'](tmpx, simInput['freq'], simInput['sw'], simInput['axMult'], out['extra'], *inputVars)
             if y is None:
                 raise FittingException("Fitting: The fitting function didn't output anything")
-            y = np.real(np.fft.fftshift(np.fft.fftn(y, axes=self.FFT_AXES), axes=self.FFTSHIFT_AXES))
+            y = np.real(np.fft.fftshift(np.fft.fftn(y, axes=simInput['fftAxes']), axes=simInput['fftshiftAxes']))
             outCurvePart.append(offset + y)
             outCurve += y
-        locList = self.getRedLocList()
-        self.parent.fitDataList[locList] = [plotx, outCurve, x, outCurvePart]
-        if display:
-            if self.DIM == 1: # One dimensional data can have additional datapoints for plot
-                if len(plotx) > len(self.parent.xax()):
-                    rmsd = np.sum((outCurve[np.searchsorted(plotx, self.parent.xax())] - self.parent.getData1D())**2)
-                else:
-                    rmsd = np.sum((outCurve - self.parent.getData1D())**2)
+        return [plotx, outCurve, x, outCurvePart]
+
+    def setSim(self, simInput, fitData):
+        """
+        Stores the simulation of a slice and displays it when that was requested.
+
+        Parameters
+        ----------
+        simInput : dict
+            The input of the simulation, as returned by getSimInput.
+        fitData : list
+            The simulation, as returned by calcSim.
+        """
+        self.parent.fitDataList[simInput['locList']] = fitData
+        if simInput['display'] and simInput['locList'] == self.getRedLocList():
+            self.setRMSD(self.getRMSD())
+            self.parent.showFid()
+
+    def getRMSD(self):
+        """
+        Returns the root mean square deviation between the data and the simulation of the current slice.
+
+        Returns
+        -------
+        float or None
+            The RMSD, or None if the current slice has not been simulated.
+        """
+        fitData = self.parent.fitDataList[self.getRedLocList()]
+        if fitData is None:
+            return None
+        plotx, outCurve = fitData[:2]
+        if self.DIM == 1: # One dimensional data can have additional datapoints for plot
+            if len(plotx) > len(self.parent.xax()):
+                rmsd = np.sum((outCurve[np.searchsorted(plotx, self.parent.xax())] - self.parent.getData1D())**2)
             else:
                 rmsd = np.sum((outCurve - self.parent.getData1D())**2)
-            rmsd = np.sqrt(rmsd/float(self.parent.getData1D().size))
-            self.setRMSD(rmsd)
-            self.parent.showFid()
+        else:
+            rmsd = np.sum((outCurve - self.parent.getData1D())**2)
+        return np.sqrt(rmsd/float(self.parent.getData1D().size))
 
     def genMask(self):
         removeLimits = self.removeLimits[self.getRedLocList()]
@@ -1977,157 +2936,15 @@ class AbstractParamFrame(QtWidgets.QWidget):
 
 ##############################################################################
 
-def lstSqrs(dataList, maskList, *args):
-    """
-    Simulates spectra and calculates the least squares value with a given list of data.
-
-    Parameters
-    ----------
-    dataList : list of arrays
-        The list of spectra to compare with the simulations.
-    *args
-        All other arguments are passed to fitFunc.
-
-    Returns
-    -------
-    float
-        The sum of the least squares values of the spectra.
-    """
-    simData = fitFunc(*args)
-    if simData is None:
-        return np.inf
-    costValue = 0
-    for i,_ in enumerate(dataList):
-        costValue += np.sum(maskList[i]*(dataList[i] - simData[i])**2)
-    return costValue
-
-def mpFit(xax, data1D, maskList, guess, args, queue, funcs, minmethod, numfeval):
-    """
-    The minimization function running in an separate process.
-
-    Parameters
-    ----------
-    xax : list of arrays
-        List of the x-axes of the data.
-    data1D : array or list of arrays
-        Array with the data to be fit.
-    guess : list
-        List with the initial guess values.
-    args : tuple
-        The tuple with additional values.
-    queue : Queue
-        The queue to communicate with the main process.
-        On success the results are put in this queue.
-        When a SimException is raised, the error message is put on this queue.
-        When the simulation fails otherwise, None is put on this queue.
-    funcs : list of functions
-        The functions to run per data in data1D.
-    minmethod : str
-        The minimization method of Scipy minimize to use.
-    numfeval : int
-        The maximum number of function evaluations.
-    """
-    try:
-        fitVal = scipy.optimize.minimize(lambda *param: lstSqrs(data1D, maskList, funcs, param, xax, args), guess, method=minmethod, options={'maxfev': numfeval})
-    except simFunc.SimException as e:
-        fitVal = str(e)
-    except Exception:
-        fitVal = None
-    queue.put(fitVal)
-
-def fitFunc(funcs, params, allX, args):
-    """
-    Reconstructs all linked parameters and executes the fitting function for each set of data.
-
-    Parameters
-    ----------
-    funcs : list of functions
-        The list of fitting functions to execute.
-    params : tuple
-        The tuple with the function parameters generated by minimize.
-    allX : list of arrays
-        The list with x-axes.
-    args : tuple
-        Additional arguments for the fitting functions.
-
-    Returns
-    -------
-    list of arrays
-        A list with the simulated data.
-    """
-    params = params[0]
-    specSlices = args[0]
-    allParam = []
-    for length in specSlices:
-        allParam.append(params[length])
-    allStruc = args[2]
-    allArgu = args[3]
-    fullTestFunc = []
-    for n, _ in enumerate(allX):
-        x = allX[n]
-        testFunc = np.zeros([len(item) for item in x], dtype=complex)
-        param = allParam[n]
-        numExp = args[1][n]
-        struc = allStruc[n]
-        argu = allArgu[n]
-        extra = argu[-1]
-        freq = args[4][n]
-        sw = args[5][n]
-        axMult = args[6][n]
-        fft_axes = args[7][n]
-        fftshift_axes = args[8][n]
-        singleNames = args[9][n]
-        multiNames = args[10][n]
-        parameters = {}
-        try:
-            for name in singleNames:
-                if struc[name][0][0] == 1:
-                    parameters[name] = param[struc[name][0][1]]
-                elif struc[name][0][0] == 0:
-                    parameters[name] = argu[struc[name][0][1]]
-                else:
-                    altStruc = struc[name][0][1]
-                    if struc[altStruc[0]][altStruc[1]][0] == 1:
-                        parameters[name] = altStruc[2] * allParam[altStruc[4]][struc[altStruc[0]][altStruc[1]][1]] + altStruc[3]
-                    elif struc[altStruc[0]][altStruc[1]][0] == 0:
-                        parameters[name] = altStruc[2] * allArgu[altStruc[4]][struc[altStruc[0]][altStruc[1]][1]] + altStruc[3]
-            for i in range(numExp):
-                for name in multiNames:
-                    if struc[name][i][0] == 1:
-                        parameters[name] = param[struc[name][i][1]]
-                    elif struc[name][i][0] == 0:
-                        parameters[name] = argu[struc[name][i][1]]
-                    else:
-                        altStruc = struc[name][i][1]
-                        strucTarget = allStruc[altStruc[4]]
-                        if strucTarget[altStruc[0]][altStruc[1]][0] == 1:
-                            parameters[name] = altStruc[2] * allParam[altStruc[4]][strucTarget[altStruc[0]][altStruc[1]][1]] + altStruc[3]
-                        elif strucTarget[altStruc[0]][altStruc[1]][0] == 0:
-                            parameters[name] = altStruc[2] * allArgu[altStruc[4]][strucTarget[altStruc[0]][altStruc[1]][1]] + altStruc[3]
-                inputVars = [parameters[name] for name in singleNames]
-                inputVars += [parameters[name] for name in multiNames]
-                output = funcs[n](x, freq, sw, axMult, extra, *inputVars)
-                if output is None:
-                    return None
-                #output[np.isnan(output)] = 0
-                testFunc += output
-            testFunc = np.real(np.fft.fftshift(np.fft.fftn(testFunc, axes=fft_axes), axes=fftshift_axes))
-        except KeyError:
-            raise(simFunc.SimException("Fitting: One of the keywords is not correct"))
-        if "Offset" in parameters.keys():
-            testFunc += parameters["Offset"]
-        fullTestFunc.append(testFunc)
-    return fullTestFunc
-
-##############################################################################
-
 
 class PrefWindow(QtWidgets.QWidget):
     """
     Window for setting the fitting preferences.
     """
 
-    METHODLIST = ['Powell', 'Nelder-Mead']
+    METHODLIST = ['Powell', 'Nelder-Mead', 'Least-squares']
+    ERRORMETHODLIST = ['Bootstrap', 'Monte Carlo']
+    WARMSTARTLIST = ['None', 'Previous', 'Linear']
 
     def __init__(self, parent):
         """
@@ -2149,6 +2966,7 @@ class PrefWindow(QtWidgets.QWidget):
         self.minmethodBox = QtWidgets.QComboBox(self)
         self.minmethodBox.addItems(self.METHODLIST)
         self.minmethodBox.setCurrentIndex(self.METHODLIST.index(self.father.MINMETHOD))
+        self.minmethodBox.setToolTip("Least-squares uses a trust region solver on the residuals, with analytic derivatives for peak, relaxation and diffusion fits")
         grid.addWidget(self.minmethodBox, 0, 1)
         grid.addWidget(wc.QLabel("Significant digits:"), 1, 0)
         self.precisBox = QtWidgets.QSpinBox(self)
@@ -2160,6 +2978,81 @@ class PrefWindow(QtWidgets.QWidget):
         self.numFevalBox.setMinimum(1)
         self.numFevalBox.setValue(self.father.NUMFEVAL)
         grid.addWidget(self.numFevalBox, 2, 1)
+        grid.addWidget(wc.QLabel("Workers:"), 3, 0)
+        self.numWorkersBox = QtWidgets.QSpinBox(self)
+        self.numWorkersBox.setMinimum(1)
+        self.numWorkersBox.setMaximum(max(1, multiprocessing.cpu_count()))
+        self.numWorkersBox.setValue(self.father.NUMWORKERS)
+        self.numWorkersBox.setToolTip("Number of processes used to fit the slices in parallel with 'Fit all', the starts of a multi-start fit, or to generate a Czjzek library")
+        grid.addWidget(self.numWorkersBox, 3, 1)
+        grid.addWidget(wc.QLabel("Warm start:"), 4, 0)
+        self.warmStartBox = QtWidgets.QComboBox(self)
+        self.warmStartBox.addItems(self.WARMSTARTLIST)
+        self.warmStartBox.setCurrentIndex(self.WARMSTARTLIST.index(self.father.WARMSTART))
+        self.warmStartBox.setToolTip("Initial guess of the slices in 'Fit all'. Previous uses the result of the nearest finished slice, Linear extrapolates the results of the two nearest finished slices along one dimension of the spectrum")
+        grid.addWidget(self.warmStartBox, 4, 1)
+        grid.addWidget(wc.QLabel("# starts:"), 5, 0)
+        self.numStartsBox = QtWidgets.QSpinBox(self)
+        self.numStartsBox.setMinimum(1)
+        self.numStartsBox.setMaximum(10000)
+        self.numStartsBox.setValue(self.father.NUMSTARTS)
+        self.numStartsBox.setToolTip("Number of initial guesses of a fit. With more than one start, the best result is kept")
+        grid.addWidget(self.numStartsBox, 5, 1)
+        grid.addWidget(wc.QLabel("Start spread:"), 6, 0)
+        self.startSpreadBox = QtWidgets.QDoubleSpinBox(self)
+        self.startSpreadBox.setMinimum(0.0)
+        self.startSpreadBox.setMaximum(100.0)
+        self.startSpreadBox.setSingleStep(0.05)
+        self.startSpreadBox.setValue(self.father.STARTSPREAD)
+        self.startSpreadBox.setToolTip("Maximum distance of the extra starts from the current values, relative to these values")
+        grid.addWidget(self.startSpreadBox, 6, 1)
+        grid.addWidget(wc.QLabel("Error samples:"), 7, 0)
+        self.numErrorSamplesBox = QtWidgets.QSpinBox(self)
+        self.numErrorSamplesBox.setMinimum(1)  # The minimum is shown as Off, as at least two samples are needed
+        self.numErrorSamplesBox.setMaximum(100000)
+        self.numErrorSamplesBox.setSpecialValueText("Off")
+        self.numErrorSamplesBox.setValue(max(self.father.NUMERRORSAMPLES, 1))
+        self.numErrorSamplesBox.setToolTip("Number of refits of resampled data used to estimate the uncertainties after a fit. At least 2 samples are needed, Off disables the estimation")
+        grid.addWidget(self.numErrorSamplesBox, 7, 1)
+        grid.addWidget(wc.QLabel("Error method:"), 8, 0)
+        self.errorMethodBox = QtWidgets.QComboBox(self)
+        self.errorMethodBox.addItems(self.ERRORMETHODLIST)
+        self.errorMethodBox.setCurrentIndex(self.ERRORMETHODLIST.index(self.father.ERRORMETHOD))
+        self.errorMethodBox.setToolTip("Bootstrap resamples the residuals of the fit, Monte Carlo adds Gaussian noise with the standard deviation of the residuals")
+        grid.addWidget(self.errorMethodBox, 8, 1)
+        grid.addWidget(wc.QLabel("Results file:"), 9, 0)
+        sinkFrame = QtWidgets.QHBoxLayout()
+        self.sinkFileEntry = QtWidgets.QLineEdit(self.father.SINKFILE)
+        self.sinkFileEntry.setToolTip("CSV file to which 'Fit all' appends the results of every slice as it finishes. Leave empty to keep the results in memory only")
+        sinkFrame.addWidget(self.sinkFileEntry)
+        sinkButton = QtWidgets.QPushButton("Browse")
+        sinkButton.clicked.connect(self.browseSinkFile)
+        sinkFrame.addWidget(sinkButton)
+        grid.addLayout(sinkFrame, 9, 1)
+        self.sinkCurvesCheck = QtWidgets.QCheckBox("Store curves")
+        self.sinkCurvesCheck.setChecked(self.father.SINKCURVES)
+        self.sinkCurvesCheck.setToolTip("Also write the fitted curves to npz files next to the results file. Only the curves of the displayed slice are kept in memory")
+        grid.addWidget(self.sinkCurvesCheck, 10, 0, 1, 2)
+        self.sinkResumeCheck = QtWidgets.QCheckBox("Resume from results file")
+        self.sinkResumeCheck.setChecked(self.father.SINKRESUME)
+        self.sinkResumeCheck.setToolTip("Skip the slices that are already in the results file and append the others, instead of overwriting the file")
+        grid.addWidget(self.sinkResumeCheck, 11, 0, 1, 2)
+        self.batchFitCheck = QtWidgets.QCheckBox("Batch fit all")
+        self.batchFitCheck.setChecked(self.father.BATCHFIT)
+        self.batchFitCheck.setToolTip("Fit all relaxation or diffusion curves at once as one least-squares problem. All slices need the same fitted parameters")
+        grid.addWidget(self.batchFitCheck, 12, 0, 1, 2)
+        self.profileCheck = QtWidgets.QCheckBox("Profile fits")
+        self.profileCheck.setChecked(self.father.PROFILE)
+        self.profileCheck.setToolTip("Measure the time spent in every stage of the fit evaluations. The breakdown is shown in the export window")
+        grid.addWidget(self.profileCheck, 13, 0, 1, 2)
+        self.livePreviewCheck = QtWidgets.QCheckBox("Preview on edit")
+        self.livePreviewCheck.setChecked(self.father.LIVEPREVIEW)
+        self.livePreviewCheck.setToolTip("Simulate the spectra in the background when a parameter is edited")
+        grid.addWidget(self.livePreviewCheck, 14, 0, 1, 2)
+        self.linearBinningCheck = QtWidgets.QCheckBox("Linear binning")
+        self.linearBinningCheck.setChecked(simFunc.LINEARBINNING)
+        self.linearBinningCheck.setToolTip("Divide every simulated frequency over the two nearest points of the spectrum, instead of putting it in the nearest point. Reduces the binning artefacts of powder spectra at low Cheng numbers")
+        grid.addWidget(self.linearBinningCheck, 15, 0, 1, 2)
         cancelButton = QtWidgets.QPushButton("&Cancel")
         cancelButton.clicked.connect(self.closeEvent)
         layout.addWidget(cancelButton, 4, 0)
@@ -2184,8 +3077,34 @@ class PrefWindow(QtWidgets.QWidget):
         self.father.PRECIS = self.precisBox.value()
         self.father.MINMETHOD = self.METHODLIST[self.minmethodBox.currentIndex()]
         self.father.NUMFEVAL = self.numFevalBox.value()
+        self.father.NUMWORKERS = self.numWorkersBox.value()
+        self.father.WARMSTART = self.WARMSTARTLIST[self.warmStartBox.currentIndex()]
+        self.father.NUMSTARTS = self.numStartsBox.value()
+        self.father.STARTSPREAD = self.startSpreadBox.value()
+        self.father.NUMERRORSAMPLES = self.numErrorSamplesBox.value()
+        if self.father.NUMERRORSAMPLES < 2:
+            self.father.NUMERRORSAMPLES = 0
+        self.father.ERRORMETHOD = self.ERRORMETHODLIST[self.errorMethodBox.currentIndex()]
+        self.father.SINKFILE = self.sinkFileEntry.text().strip()
+        self.father.SINKCURVES = self.sinkCurvesCheck.isChecked()
+        self.father.SINKRESUME = self.sinkResumeCheck.isChecked()
+        self.father.BATCHFIT = self.batchFitCheck.isChecked()
+        self.father.PROFILE = self.profileCheck.isChecked()
+        self.father.LIVEPREVIEW = self.livePreviewCheck.isChecked()
+        simFunc.setSimSettings({'linearBinning': self.linearBinningCheck.isChecked()})
         self.closeEvent()
 
+    def browseSinkFile(self, *args):
+        """
+        Asks for the results file of fit all.
+        """
+        fileName = QtWidgets.QFileDialog.getSaveFileName(self, 'Results file', self.father.father.lastLocation + os.path.sep + 'fitResults.csv', 'CSV (*.csv)', options=QtWidgets.QFileDialog.DontConfirmOverwrite)
+        if isinstance(fileName, tuple):
+            fileName = fileName[0]
+        if not fileName:
+            return
+        self.sinkFileEntry.setText(fileName)
+
 ##############################################################################
 
 
@@ -2618,6 +3537,10 @@ class PeakDeconvParamFrame(AbstractParamFrame):
         self.pickTick = QtWidgets.QCheckBox("Pick")
         self.pickTick.stateChanged.connect(self.togglePick)
         self.frame1.addWidget(self.pickTick, 0, 2)
+        self.freqDomainTick = QtWidgets.QCheckBox("Freq. domain")
+        self.freqDomainTick.setToolTip("Evaluate the Voigt lines directly in the frequency domain, without Fourier transform.\nExcluded regions are then skipped during the fit.")
+        self.freqDomainTick.stateChanged.connect(self.setFreqDomain)
+        self.optframe.addWidget(self.freqDomainTick, 0, 0)
         self.frame2.addWidget(wc.QLabel("Offset:"), 0, 0, 1, 2)
         self.ticks["Offset"].append(QtWidgets.QCheckBox(''))
         self.frame2.addWidget(self.ticks["Offset"][0], 1, 0)
@@ -2653,6 +3576,32 @@ class PeakDeconvParamFrame(AbstractParamFrame):
     def togglePick(self):
         self.parent.togglePick(self.pickTick.isChecked())
 
+    def setFreqDomain(self, *args):
+        """
+        Switches between the time domain and the frequency domain simulation of the peaks.
+        """
+        if self.freqDomainTick.isChecked():
+            self.FITFUNC = simFunc.peakSimFreq
+            self.FFT_AXES = ()
+            self.FFTSHIFT_AXES = ()
+        else:
+            self.FITFUNC = simFunc.peakSim
+            self.FFT_AXES = type(self).FFT_AXES
+            self.FFTSHIFT_AXES = type(self).FFTSHIFT_AXES
+
+    def extraParamToFile(self):
+        """
+        Extra parameters to export.
+        """
+        return ({"Frequency domain": str(self.freqDomainTick.isChecked())}, {})
+
+    def extraFileToParam(self, preParams, postParams):
+        """
+        Extra parameters to import.
+        """
+        if "Frequency domain" in preParams.keys():
+            self.freqDomainTick.setChecked(preParams["Frequency domain"] == "True")
+
     def checkResults(self, numExp, struc):
         """
         Sets the Lorentzian and Gaussian broadenings to absolute values.
@@ -3025,8 +3974,8 @@ class CsaDeconvParamFrame(AbstractParamFrame):
         if angle is None:
             raise FittingException("Fitting: Rotor Angle is not valid")
         cheng = safeEval(self.entries['cheng'][-1].text())
-        alpha, beta, weight = simFunc.zcw_angles(cheng, 2)
-        D2 = simFunc.D2tens(alpha, beta, np.zeros_like(alpha))
+        weight = simFunc.zcwOrientations(cheng, 2)[2]
+        D2 = simFunc.zcwTensors(cheng, 2, 2)
         numssb = self.entries['numssb'][0].value()
         MAStype = self.entries['spinType'][-1].currentIndex()
         out['extra'] = [shiftdef, numssb, angle, D2, weight, MAStype]
@@ -3251,9 +4200,9 @@ class QuadDeconvParamFrame(AbstractParamFrame):
             raise FittingException("Fitting: Rotor Angle is not valid")
         I = self.entries['I'][-1].currentIndex() * 0.5 + 1
         cheng = safeEval(self.entries['cheng'][-1].text())
-        alpha, beta, weight = simFunc.zcw_angles(cheng, 2)
-        D2 = simFunc.D2tens(alpha, beta, np.zeros_like(alpha))
-        D4 = simFunc.D4tens(alpha, beta, np.zeros_like(alpha))
+        weight = simFunc.zcwOrientations(cheng, 2)[2]
+        D2 = simFunc.zcwTensors(cheng, 2, 2)
+        D4 = simFunc.zcwTensors(cheng, 2, 4)
         numssb = self.entries['numssb'][-1].value()
         MAStype = self.entries['spinType'][-1].currentIndex()
         out['extra'] = [satBool, I, numssb, angle, D2, D4, weight, MAStype]
@@ -3613,9 +4562,9 @@ class QuadCSADeconvParamFrame(AbstractParamFrame):
             raise FittingException("Fitting: Rotor Angle is not valid")
         I = self.entries['I'][-1].currentIndex() * 0.5 + 0.5
         cheng = safeEval(self.entries['cheng'][-1].text())
-        alpha, beta, weight = simFunc.zcw_angles(cheng, 1)
-        D2 = simFunc.D2tens(alpha, beta, np.zeros_like(alpha))
-        D4 = simFunc.D4tens(alpha, beta, np.zeros_like(alpha))
+        weight = simFunc.zcwOrientations(cheng, 1)[2]
+        D2 = simFunc.zcwTensors(cheng, 1, 2)
+        D4 = simFunc.zcwTensors(cheng, 1, 4)
         numssb = self.entries['numssb'][-1].value()
         MAStype = self.entries['spinType'][-1].currentIndex()
         out['extra'] = [satBool, I, numssb, angle, D2, D4, weight, MAStype, shiftdef]
@@ -3797,10 +4746,14 @@ class CzjzekPrefWindow(QtWidgets.QWidget):
         genButton.clicked.connect(self.generate)
         genButton.setFocus()
         layout.addWidget(genButton, 4, 1)
-        self.busyButton = QtWidgets.QPushButton("Busy", self)
-        self.busyButton.hide()
-        self.busyButton.setEnabled(False)
-        layout.addWidget(self.busyButton, 4, 1)
+        self.stopButton = QtWidgets.QPushButton("&Stop", self)
+        self.stopButton.clicked.connect(self.stop)
+        self.stopButton.hide()
+        layout.addWidget(self.stopButton, 4, 1)
+        self.progressBar = QtWidgets.QProgressBar(self)
+        self.progressBar.hide()
+        layout.addWidget(self.progressBar, 4, 3)
+        self.running = False
         self.loadButton = QtWidgets.QPushButton("&Load", self)
         self.loadButton.clicked.connect(self.loadLib)
         layout.addWidget(self.loadButton, 4, 2)
@@ -3976,58 +4929,100 @@ class CzjzekPrefWindow(QtWidgets.QWidget):
         """
         self.deleteLater()
 
+    def stop(self, *args):
+        """
+        Stops the generation of the library.
+        """
+        self.running = False
+
+    def showProgress(self, done, total):
+        """
+        Shows the progress of the library generation and processes the events of the window.
+
+        Parameters
+        ----------
+        done : int
+            The number of generated spectra.
+        total : int
+            The number of spectra in the library.
+
+        Returns
+        -------
+        bool
+            True if the generation should be cancelled.
+        """
+        self.progressBar.setMaximum(total)
+        self.progressBar.setValue(done)
+        QtWidgets.qApp.processEvents()
+        return not self.running
+
     def generate(self, *args):
         """
         Generate the Czjzek library.
         """
-        self.busyButton.show()
+        self.stopButton.show()
+        self.libLabel.hide()
+        self.progressBar.setValue(0)
+        self.progressBar.show()
         self.loadButton.setEnabled(False)
         self.cancelButton.setEnabled(False)
+        self.running = True
         QtWidgets.qApp.processEvents()
         try:
-            self.father.cqsteps = self.cqsteps.value()
-            self.father.etasteps = self.etasteps.value()
-            self.father.cheng = self.chengEntry.value()
+            # The settings are only applied to the fit frame when the library is generated
+            settings = {'cqsteps': self.cqsteps.value(), 'etasteps': self.etasteps.value(), 'cheng': self.chengEntry.value()}
             if not self.mqmas:
-                self.father.I = self.Ientry.currentIndex() * 0.5 + 1.0
-                self.father.mas = self.masEntry.currentIndex()
+                settings['I'] = self.Ientry.currentIndex() * 0.5 + 1.0
+                settings['mas'] = self.masEntry.currentIndex()
                 inp = safeEval(self.spinEntry.text(), Type='FI')
                 if inp is None:
                     raise FittingException("Spin speed value not valid.")
-                self.father.spinspeed = inp
-                self.father.angle = self.angleEntry.text()
-                self.father.numssb = self.numssbEntry.value()
-                self.father.satBool = self.satBoolEntry.isChecked()
-                # satBool
+                settings['spinspeed'] = inp
+                settings['angle'] = self.angleEntry.text()
+                settings['numssb'] = self.numssbEntry.value()
+                settings['satBool'] = self.satBoolEntry.isChecked()
             else:
-                self.father.I = self.Ientry.currentIndex() + 1.5
+                settings['I'] = self.Ientry.currentIndex() + 1.5
             inp = safeEval(self.cqmax.text(), Type='FI')
             if inp is None:
                 raise FittingException(u"C_Q_max value not valid.")
-            self.father.cqmax = abs(safeEval(self.cqmax.text()))
-            inp = abs(safeEval(self.cqmin.text(), Type='FI'))
+            settings['cqmax'] = abs(inp)
+            inp = safeEval(self.cqmin.text(), Type='FI')
             if inp is None:
                 raise FittingException(u"C_Q_min value not valid.")
-            self.father.cqmin = abs(safeEval(self.cqmin.text()))
+            settings['cqmin'] = abs(inp)
             #eta
             inp = safeEval(self.etamax.text(), Type='FI')
             if inp is None:
                 raise FittingException(u"η_max value not valid.")
             if inp < 0.0 or inp > 1.0:
                 raise FittingException(u"η_max value not valid.")
-            self.father.etamax = abs(float(inp))
+            settings['etamax'] = abs(float(inp))
             inp = safeEval(self.etamin.text(), Type='FI')
             if inp is None:
                 raise FittingException(u"η_min value not valid.")
             if inp < 0.0 or inp > 1.0:
                 raise FittingException(u"η_min value not valid.")
-            self.father.etamin = abs(float(inp))
-            self.father.libName = "Generated"
-            self.father.simLib()
+            settings['etamin'] = abs(float(inp))
+            oldSettings = {name: getattr(self.father, name) for name in settings}
+            for name, value in settings.items():
+                setattr(self.father, name, value)
+            generated = False
+            try:
+                generated = self.father.simLib(self.showProgress)
+            finally:
+                if not generated:  # Keep the settings that describe the current library
+                    for name, value in oldSettings.items():
+                        setattr(self.father, name, value)
+            if generated:
+                self.father.libName = "Generated"
         except Exception:
             raise
         finally:
-            self.busyButton.hide()
+            self.running = False
+            self.stopButton.hide()
+            self.progressBar.hide()
+            self.libLabel.show()
             self.loadButton.setEnabled(True)
             self.cancelButton.setEnabled(True)
             self.upd()
@@ -4043,41 +5038,14 @@ class CzjzekPrefWindow(QtWidgets.QWidget):
         nameSearch = re.search("(.*)-\d+\.\d+-\d+\.\d+\.\w*$", shortName)
         if not nameSearch:
             raise FittingException("Not a valid library file name")
-        libName = nameSearch.group(1)
-        nameList = os.listdir(dirName)
-        cq = []
-        eta = []
-        data = []
-        for name in nameList:
-            matchName = re.search(libName + "-(\d+\.\d+)-(\d+\.\d+)\.\w*$", name)
-            if matchName:
-                eta.append(float(matchName.group(1)))
-                cq.append(float(matchName.group(2)))
-                fullName = os.path.join(dirName, name)
-                libData = io.autoLoad(fullName)
-                if libData.ndim() != 1:
-                    raise FittingException("A spectrum in the library is not a 1D spectrum.")
-                if not libData.spec[0]:
-                    libData.complexFourier(0)
-                libData.regrid([self.father.parent.xax()[0], self.father.parent.xax()[-1]], len(self.father.parent.xax()), 0)
-                libData.fftshift(0)
-                libData.complexFourier(0)
-                data.append(libData.getHyperData(0))
-                data[-1][0] *= 0.5
-        cq = np.array(cq) * 1e6
-        eta = np.array(eta)
-        data = np.array(data)
-        numCq = len(np.unique(cq))
-        numEta = len(np.unique(eta))
-        if len(cq) != numCq * numEta:
-            raise FittingException("Library to be loaded is not of a rectangular grid in Cq and eta.")
-        sortIndex = np.lexsort((cq, eta))
-        self.father.cqLib = cq[sortIndex]
-        self.father.etaLib = eta[sortIndex]
-        self.father.lib = data[sortIndex]
-        self.father.libName = os.path.join(dirName, libName)
-        self.father.cqsteps = numCq
-        self.father.etasteps = numEta
+        libName = os.path.join(dirName, nameSearch.group(1))
+        lib, cq, eta = loadCzjzekLib(libName, self.father.parent.xax())
+        self.father.cqLib = cq
+        self.father.etaLib = eta
+        self.father.lib = lib
+        self.father.libName = libName
+        self.father.cqsteps = len(np.unique(cq))
+        self.father.etasteps = len(np.unique(eta))
         self.father.cqmax = np.max(cq) * 1e-6
         self.father.cqmin = np.min(cq) * 1e-6
         self.father.etamax = np.max(eta)
@@ -4222,16 +5190,32 @@ class QuadCzjzekParamFrame(AbstractParamFrame):
     def createCzjzekPrefWindow(self, *args):
         CzjzekPrefWindow(self)
 
-    def simLib(self):
+    def simLib(self, progress=None):
         """
         Simulate the spectra for the Czjzek library.
+
+        Parameters
+        ----------
+        progress : function, optional
+            Called with the number of simulated spectra and the size of the library.
+            When it returns True, the simulation is cancelled.
+
+        Returns
+        -------
+        bool
+            False if the simulation was cancelled.
         """
         angle = safeEval(self.angle, Type='FI')
-        alpha, beta, weight = simFunc.zcw_angles(self.cheng, 2)
-        D2 = simFunc.D2tens(alpha, beta, np.zeros_like(alpha))
-        D4 = simFunc.D4tens(alpha, beta, np.zeros_like(alpha))
+        weight = simFunc.zcwOrientations(self.cheng, 2)[2]
+        D2 = simFunc.zcwTensors(self.cheng, 2, 2)
+        D4 = simFunc.zcwTensors(self.cheng, 2, 4)
         extra = [self.satBool, self.I, self.numssb, angle, D2, D4, weight, self.mas]
-        self.lib, self.cqLib, self.etaLib = simFunc.genLib(len(self.parent.xax()), self.cqmin, self.cqmax, self.etamin, self.etamax, self.cqsteps, self.etasteps, extra, self.parent.freq(), self.parent.sw(), self.spinspeed)
+        lib = simFunc.genLib(len(self.parent.xax()), self.cqmin, self.cqmax, self.etamin, self.etamax, self.cqsteps, self.etasteps, extra, self.parent.freq(), self.parent.sw(), self.spinspeed,
+                             cheng=self.cheng, numWorkers=self.rootwindow.tabWindow.NUMWORKERS, progress=progress)
+        if lib is None:
+            return False
+        self.lib, self.cqLib, self.etaLib = lib
+        return True
 
     def extraParamToFile(self):
         """
@@ -4946,9 +5930,9 @@ class MqmasDeconvParamFrame(AbstractParamFrame):
         if MQ > (I*2):
             raise RuntimeError("MQ cannot be larger than I")
         cheng = safeEval(self.entries['cheng'][-1].text())
-        alpha, beta, weight = simFunc.zcw_angles(cheng, 2)
-        D2 = simFunc.D2tens(alpha, beta, np.zeros_like(alpha))
-        D4 = simFunc.D4tens(alpha, beta, np.zeros_like(alpha))
+        weight = simFunc.zcwOrientations(cheng, 2)[2]
+        D2 = simFunc.zcwTensors(cheng, 2, 2)
+        D4 = simFunc.zcwTensors(cheng, 2, 4)
         numssb = self.entries['numssb'][-1].value()
         MAStype = self.entries['spinType'][-1].currentIndex()
         shear = safeEval(self.entries['shear'][-1].text())
@@ -5153,16 +6137,32 @@ class MqmasCzjzekParamFrame(AbstractParamFrame):
     def createCzjzekPrefWindow(self, *args):
         CzjzekPrefWindow(self, mqmas=True)
 
-    def simLib(self):
+    def simLib(self, progress=None):
         """
         Simulate the spectra for the Czjzek library.
+
+        Parameters
+        ----------
+        progress : function, optional
+            Called with the number of simulated spectra and the size of the library.
+            When it returns True, the simulation is cancelled.
+
+        Returns
+        -------
+        bool
+            False if the simulation was cancelled.
         """
         angle = np.arctan(np.sqrt(2))
-        alpha, beta, weight = simFunc.zcw_angles(self.cheng, 2)
-        D2 = simFunc.D2tens(alpha, beta, np.zeros_like(alpha))
-        D4 = simFunc.D4tens(alpha, beta, np.zeros_like(alpha))
+        weight = simFunc.zcwOrientations(self.cheng, 2)[2]
+        D2 = simFunc.zcwTensors(self.cheng, 2, 2)
+        D4 = simFunc.zcwTensors(self.cheng, 2, 4)
         extra = [False, self.I, 2, angle, D2, D4, weight, 2]
-        self.lib, self.cqLib, self.etaLib = simFunc.genLib(len(self.parent.xax()), self.cqmin, self.cqmax, self.etamin, self.etamax, self.cqsteps, self.etasteps, extra, self.parent.freq(), self.parent.sw(), np.inf)
+        lib = simFunc.genLib(len(self.parent.xax()), self.cqmin, self.cqmax, self.etamin, self.etamax, self.cqsteps, self.etasteps, extra, self.parent.freq(), self.parent.sw(), np.inf,
+                             cheng=self.cheng, numWorkers=self.rootwindow.tabWindow.NUMWORKERS, progress=progress)
+        if lib is None:
+            return False
+        self.lib, self.cqLib, self.etaLib = lib
+        return True
 
     def extraParamToFile(self):
         """
@@ -18,10 +18,55 @@
 # along with ssNake. If not, see <http://www.gnu.org/licenses/>.
 
 import re
+import functools
 import numpy as np
 import scipy.special
+import scipy.integrate
 import hypercomplex as hc
 
+KILOPATTERN = re.compile('([0-9]+)[kK]')
+PARAMPATTERN = re.compile('@(\\w+)@')
+
+@functools.lru_cache(maxsize=None)
+def evalEnvironment():
+    """
+    Returns the restricted namespace in which strings are evaluated.
+    The namespace is built once and should not be modified; callers evaluate in a copy.
+
+    Returns
+    -------
+    dict
+        The namespace with the contents of numpy, hypercomplex, scipy.special and scipy.integrate.
+    """
+    env = vars(np).copy()
+    env.update(vars(hc).copy())
+    env.update(vars(scipy.special).copy())
+    env.update(vars(scipy.integrate).copy())
+    env["locals"] = None
+    env["globals"] = None
+    env["__name__"] = None
+    env["__file__"] = None
+    env["__builtins__"] = {'None': None, 'False': False, 'True':True} # None
+    env["slice"] = slice
+    return env
+
+@functools.lru_cache(maxsize=256)
+def compileString(inp):
+    """
+    Compiles a string for evaluation, after replacing the kilo suffixes (e.g. 4k is 4*1024).
+
+    Parameters
+    ----------
+    inp : str
+        String to compile.
+
+    Returns
+    -------
+    code
+        The compiled expression.
+    """
+    return compile(KILOPATTERN.sub('\\g<1>*1024', inp), '<string>', 'eval')
+
 def safeEval(inp, length=None, Type='All', x=None):
     """
     Creates a more restricted eval environment.
@@ -46,23 +91,13 @@ def safeEval(inp, length=None, Type='All', x=None):
     Object
         The result of the evaluated string.
     """
-    env = vars(np).copy()
-    env.update(vars(hc).copy())
-    env.update(vars(scipy.special).copy())
-    env.update(vars(scipy.integrate).copy())
-    env["locals"] = None
-    env["globals"] = None
-    env["__name__"] = None
-    env["__file__"] = None
-    env["__builtins__"] = {'None': None, 'False': False, 'True':True} # None
-    env["slice"] = slice
+    env = evalEnvironment().copy()
     if length is not None:
         env["length"] = length
     if x is not None:
         env["x"] = x
-    inp = re.sub('([0-9]+)[kK]', '\g<1>*1024', str(inp))
     try:
-        val = eval(inp, env)
+        val = eval(compileString(str(inp)), env)
         if isinstance(val, str):
             return None
         if Type == 'All':
@@ -77,3 +112,53 @@ def safeEval(inp, length=None, Type='All', x=None):
             return None
     except Exception:
         return None
+
+@functools.lru_cache(maxsize=64)
+def compileFunction(inp, names):
+    """
+    Compiles a string with parameters between @ symbols (e.g. @amp@*exp(-x/@T@)) into a function.
+    The string is only parsed once, such that repeated evaluations with different parameter values are plain function calls.
+
+    Parameters
+    ----------
+    inp : str
+        String to compile.
+    names : tuple of str
+        The names of the parameters, in the order in which their values are passed to the function.
+
+    Returns
+    -------
+    function
+        The function f(parameters, length=None, x=None), which returns the result of the evaluated string,
+        or None when the evaluation fails or results in a string.
+        The variables length and x are set as in safeEval.
+    """
+    index = {name: i for i, name in enumerate(names)}
+
+    def replace(match):
+        if match.group(1) not in index:
+            return match.group(0)
+        return '_fitParam' + str(index[match.group(1)])
+
+    try:
+        code = compileString(PARAMPATTERN.sub(replace, str(inp)))
+    except Exception:
+        code = None
+    paramNames = ['_fitParam' + str(i) for i in range(len(names))]
+    baseEnv = evalEnvironment()
+
+    def func(parameters, length=None, x=None):
+        if code is None:
+            return None
+        env = dict(baseEnv)  # A namespace per call, such that the function can be evaluated in several threads at once
+        env.update(zip(paramNames, parameters))
+        env["length"] = length
+        env["x"] = x
+        try:
+            val = eval(code, env)
+        except Exception:
+            return None
+        if isinstance(val, str):
+            return None
+        return val
+    return func
@@ -19,14 +19,29 @@
 
 import tempfile
 import os
+import hashlib
+import multiprocessing
 import shutil
+import threading
+import warnings
 import subprocess
 import numpy as np
-from safeEval import safeEval
+from scipy.special import wofz
+from safeEval import compileFunction
 import functions as func
 import specIO as io
 import Czjzek
 
+CACHEDIR = None       # Directory in which the orientation sets are stored, None to keep them in memory only
+PERSISTCHENG = 10     # Minimum Cheng number of the orientation sets stored in CACHEDIR
+ORIENTATIONCACHE = {} # Orientation sets of this process, with (Cheng, symmetry, rank) as key
+ORIENTATIONLOCK = threading.RLock()
+LIBCHUNKSIZE = 2**21  # Maximum number of frequencies calculated at once when generating a Czjzek library
+LIBBLOCKSIZE = 64     # Maximum number of FIDs of a Czjzek library that are generated together
+LIBCACHESIZE = 2**30  # Maximum total size in bytes of the Czjzek libraries stored in CACHEDIR
+LIBVERSION = 1        # Part of the key of the stored libraries, increase when genLib gives different libraries
+LINEARBINNING = False # Divide the simulated frequencies over the two nearest bins, instead of using the bin that contains them
+
 class SimException(Exception):
     pass
 
@@ -311,6 +326,28 @@ def secQuadSpin(I, m1, m2):
     spin40_2 = m2 * (18 * I * (I + 1) - 34 * m2**2 - 5)
     return spin00_1 - spin00_2, spin20_1 - spin20_2, spin40_1 - spin40_2
 
+def siteBlocks(numSites, length, maxSize=2**16):
+    """
+    Divides the sites in blocks for evaluation with a sites axis,
+    such that the temporary arrays have at most maxSize elements.
+
+    Parameters
+    ----------
+    numSites : int
+        The number of sites.
+    length : int
+        The number of points per site.
+    maxSize : int, optional
+        The maximum number of elements in a block.
+
+    Returns
+    -------
+    list of slice
+        The slices of the sites of each block.
+    """
+    step = max(1, maxSize // max(1, length))
+    return [slice(i, i + step) for i in range(0, numSites, step)]
+
 def relaxationFunc(x, freq, sw, axMult, extra, amp, const, coeff, T):
     """
     Simulation function used for fitting relaxation curves.
@@ -332,18 +369,64 @@ def relaxationFunc(x, freq, sw, axMult, extra, amp, const, coeff, T):
         The amplitude of the curve.
     const : float
         The constant.
-    coeff : float
+    coeff : float or ndarray
         The coefficient.
-    T : float
+    T : float or ndarray
         The relaxation time. Has the same units as x.
+        When arrays are given for coeff and T, the curves of all sites (last axis) are summed.
+        Leading axes of all parameters are batch axes, giving one curve per element.
 
     Returns
     -------
     ndarray
-        The relaxation curve. Has the same length as x[-1].
+        The relaxation curve. Has the same length as x[-1], with the batch axes in front.
     """
     x = x[-1]
-    return amp * (const + coeff * np.exp(-x / abs(T)))
+    amp = np.expand_dims(amp, (-1, -2))
+    const = np.expand_dims(const, (-1, -2))
+    coeff = np.expand_dims(np.atleast_1d(coeff), -1)
+    T = np.expand_dims(np.atleast_1d(T), -1)
+    return np.sum(amp * (const + coeff * np.exp(-x / np.abs(T))), axis=-2)
+
+def relaxationFuncGrad(x, freq, sw, axMult, extra, amp, const, coeff, T):
+    """
+    Derivatives of relaxationFunc with respect to its parameters.
+
+    Parameters
+    ----------
+    x : list of ndarray
+        A list of axes values for the simulation.
+        As this is a 1-D method only the last array in the list is used.
+    freq : list of float
+        The list of frequency per dimension in Hz (not used).
+    sw : list of float
+        The list of spectral width per dimension in Hz (not used).
+    axMult : float
+        The multiplier of the x-axis (not used).
+    extra : list
+        The extra parameters of the function (not used).
+    amp : float or ndarray
+        The amplitude of the curve.
+    const : float or ndarray
+        The constant.
+    coeff : float or ndarray
+        The coefficient.
+    T : float or ndarray
+        The relaxation time. Has the same units as x.
+        Arrays are batch axes, giving the derivatives of one curve per element.
+
+    Returns
+    -------
+    list of ndarray
+        The derivatives with respect to amp, const, coeff and T.
+    """
+    x = x[-1]
+    amp, const, coeff, T = [np.expand_dims(val, -1) for val in (amp, const, coeff, T)]
+    expo = np.exp(-x / np.abs(T))
+    return [const + coeff * expo,
+            amp * np.ones_like(x),
+            amp * expo,
+            amp * coeff * expo * x * np.sign(T) / T**2]
 
 def diffusionFunc(x, freq, sw, axMult, extra, amp, const, coeff, D):
     """
@@ -367,24 +450,72 @@ def diffusionFunc(x, freq, sw, axMult, extra, amp, const, coeff, D):
         The amplitude of the curve.
     const : float
         The constant.
-    coeff : float
+    coeff : float or ndarray
         The coefficient.
-    D : float
+    D : float or ndarray
         The diffusion constant in m^2/s.
+        When arrays are given for coeff and D, the curves of all sites (last axis) are summed.
+        Leading axes of all parameters are batch axes, giving one curve per element.
 
     Returns
     -------
     ndarray
-        The diffusion curve. Has the same length as x[-1].
+        The diffusion curve. Has the same length as x[-1], with the batch axes in front.
+    """
+    x = x[-1]
+    gamma, delta, triangle = extra
+    amp = np.expand_dims(amp, (-1, -2))
+    const = np.expand_dims(const, (-1, -2))
+    coeff = np.expand_dims(np.atleast_1d(coeff), -1)
+    D = np.expand_dims(np.atleast_1d(D), -1)
+    return np.sum(amp * (const + coeff * np.exp(-(abs(gamma) *1e6 * 2 * np.pi * abs(delta) * x)**2 * np.abs(D) * (abs(triangle) - abs(delta) / 3.0))), axis=-2)
+
+def diffusionFuncGrad(x, freq, sw, axMult, extra, amp, const, coeff, D):
+    """
+    Derivatives of diffusionFunc with respect to its parameters.
+
+    Parameters
+    ----------
+    x : list of ndarray
+        A list of axes values for the simulation.
+        As this is a 1-D method only the last array in the list is used.
+    freq : list of float
+        The list of frequency per dimension in Hz (not used).
+    sw : list of float
+        The list of spectral width per dimension in Hz (not used).
+    axMult : float
+        The multiplier of the x-axis (not used).
+    extra : list
+        The extra parameters of the function [gamma, delta, triangle].
+    amp : float or ndarray
+        The amplitude of the curve.
+    const : float or ndarray
+        The constant.
+    coeff : float or ndarray
+        The coefficient.
+    D : float or ndarray
+        The diffusion constant in m^2/s.
+        Arrays are batch axes, giving the derivatives of one curve per element.
+
+    Returns
+    -------
+    list of ndarray
+        The derivatives with respect to amp, const, coeff and D.
     """
     x = x[-1]
     gamma, delta, triangle = extra
-    return amp * (const + coeff * np.exp(-(abs(gamma) *1e6 * 2 * np.pi * abs(delta) * x)**2 * abs(D) * (abs(triangle) - abs(delta) / 3.0)))
+    factor = (abs(gamma) *1e6 * 2 * np.pi * abs(delta) * x)**2 * (abs(triangle) - abs(delta) / 3.0)
+    amp, const, coeff, D = [np.expand_dims(val, -1) for val in (amp, const, coeff, D)]
+    expo = np.exp(-factor * np.abs(D))
+    return [const + coeff * expo,
+            amp * np.ones_like(x),
+            amp * expo,
+            -amp * coeff * expo * factor * np.sign(D)]
 
 def functionRun(x, freq, sw, axMult, extra, *parameters):
     """
     Simulation function used for function fitting.
-    The words between @ symbols are replaced by the fit values and the resulting string is evaluated.
+    The words between @ symbols are the fit parameters. The function is compiled once and then evaluated with the fit values.
 
     Parameters
     ----------
@@ -410,9 +541,7 @@ def functionRun(x, freq, sw, axMult, extra, *parameters):
     """
     names, function = extra
     x = x[-1]
-    for i, elem in enumerate(names):
-        function = function.replace('@' + elem + '@', str(parameters[i]))
-    return safeEval(function, length=len(x), x=x)
+    return compileFunction(function, tuple(names))(parameters, length=len(x), x=x)
 
 def externalFitRunScript(x, freq, sw, axMult, extra, bgrnd, mult, *parameters):
     """
@@ -499,11 +628,10 @@ def fib(n):
     int
         The n+2 Fibonacci number.
     """
-    start = np.array([[1, 1], [1, 0]], dtype=np.int64)
-    temp = start[:]
+    fibN, fibN1 = 0, 1
     for i in range(n):
-        temp = np.dot(start, temp)
-    return temp[0, 0], temp[0, 1], temp[1, 1]
+        fibN, fibN1 = fibN1, fibN + fibN1
+    return fibN1 + fibN, fibN1, fibN
 
 def zcw_angles(m, symm=0):
     """
@@ -541,6 +669,144 @@ def zcw_angles(m, symm=0):
     weight = np.ones(samples) / samples
     return phi, theta, weight
 
+def simSettings():
+    """
+    Returns the settings of the simulations, such that they can be applied in worker processes.
+
+    Returns
+    -------
+    dict
+        The settings.
+    """
+    return {'linearBinning': LINEARBINNING}
+
+def setSimSettings(settings):
+    """
+    Applies the settings of the simulations.
+
+    Parameters
+    ----------
+    settings : dict
+        The settings, as returned by simSettings.
+        Settings that are not given are not changed.
+    """
+    global LINEARBINNING
+    LINEARBINNING = settings.get('linearBinning', LINEARBINNING)
+
+def setCacheDir(path, libSize=None):
+    """
+    Sets the directory in which the orientation sets and Czjzek libraries are stored.
+
+    Parameters
+    ----------
+    path : str or None
+        The cache directory. When None, the orientation sets are only kept in memory and the libraries are not stored.
+    libSize : int, optional
+        The maximum total size in bytes of the stored Czjzek libraries.
+        By default the size is not changed.
+    """
+    global CACHEDIR, LIBCACHESIZE
+    CACHEDIR = path
+    if libSize is not None:
+        LIBCACHESIZE = libSize
+
+def cachedOrientations(key, calc):
+    """
+    Returns an array from the orientation cache, calculating it when not yet available.
+    Arrays of Cheng numbers of at least PERSISTCHENG are also stored in and loaded from CACHEDIR.
+
+    Parameters
+    ----------
+    key : tuple
+        The (Cheng number, symmetry, rank) of the array.
+    calc : function
+        Calculates the array when it is not in the cache.
+
+    Returns
+    -------
+    ndarray
+        The read-only array.
+    """
+    with ORIENTATIONLOCK:
+        if key in ORIENTATIONCACHE:
+            return ORIENTATIONCACHE[key]
+        fileName = None
+        if CACHEDIR is not None and key[0] >= PERSISTCHENG:
+            fileName = os.path.join(CACHEDIR, 'zcw_%d_%d_%d.npy' % key)
+        data = None
+        if fileName is not None and os.path.isfile(fileName):
+            try:
+                data = np.load(fileName, mmap_mode='r')
+            except (OSError, ValueError):
+                data = None
+        if data is None:
+            data = calc()
+            if fileName is not None:
+                try:
+                    os.makedirs(CACHEDIR, exist_ok=True)
+                    tmpName = fileName + '.%d.tmp' % os.getpid()
+                    with open(tmpName, 'wb') as f:
+                        np.save(f, data)
+                    os.replace(tmpName, fileName)
+                except OSError:
+                    pass  # The cache directory is optional, keep the array in memory only
+        data = np.asarray(data)
+        data.flags.writeable = False
+        ORIENTATIONCACHE[key] = data
+        return data
+
+def zcwOrientations(cheng, symm=0):
+    """
+    Returns the cached ZCW powder averaging angles and weights.
+
+    Parameters
+    ----------
+    cheng : int
+        The Cheng number.
+    symm : {0, 1, 2}, optional
+        The symmetry of the problem, see zcw_angles.
+
+    Returns
+    -------
+    ndarray
+        The phi angles.
+    ndarray
+        The theta angles.
+    ndarray
+        The weights of the different orientations.
+    """
+    angles = cachedOrientations((int(cheng), symm, 0), lambda: np.array(zcw_angles(int(cheng), symm)))
+    return angles[0], angles[1], angles[2]
+
+def zcwTensors(cheng, symm=0, rank=2):
+    """
+    Returns the cached Wigner D-matrices of the ZCW powder averaging angles, with a zero gamma angle.
+
+    Parameters
+    ----------
+    cheng : int
+        The Cheng number.
+    symm : {0, 1, 2}, optional
+        The symmetry of the problem, see zcw_angles.
+    rank : {2, 4}, optional
+        The rank of the Wigner D-matrices.
+
+    Returns
+    -------
+    ndarray
+        A 3-D matrix with the Wigner D-matrices of all orientations.
+    """
+    if rank == 2:
+        tens = D2tens
+    elif rank == 4:
+        tens = D4tens
+    else:
+        raise SimException("Sim: Wigner matrices of rank " + str(rank) + " are not supported")
+    def calc():
+        alpha, beta, _ = zcwOrientations(cheng, symm)
+        return tens(alpha, beta, np.zeros_like(alpha))
+    return cachedOrientations((int(cheng), symm, rank), calc)
+
 def peakSim(x, freq, sw, axMult, extra, bgrnd, mult, pos, amp, lor, gauss):
     """
     Simulates an FID with Lorentzian and Gaussian broadening.
@@ -563,6 +829,65 @@ def peakSim(x, freq, sw, axMult, extra, bgrnd, mult, pos, amp, lor, gauss):
         The offset value added to the FID.
     mult : float
         The value by which the FID is multiplied.
+    pos : float or ndarray
+        The frequency of the peak (in Hz*axMult).
+    amp : float or ndarray
+        The amplitude of the peak.
+    lor : float or ndarray
+        The Lorentzian broadening of the peak.
+    gauss : float or ndarray
+        The Gaussian broadening of the peak (in Hz*axMult), corresponding to CS distribution.
+        When arrays are given for pos, amp, lor and gauss, the FIDs of all peaks are summed.
+
+    Returns
+    -------
+    ndarray
+        The simulated FID
+    """
+    x = x[-1]
+    pos, amp, lor, gauss = [np.reshape(item, (-1, 1)) for item in np.broadcast_arrays(pos, amp, lor, gauss)]
+    pos = pos / axMult
+    gauss = np.abs(gauss / axMult)
+    lor = np.abs(lor)
+    select = np.nonzero(((pos >= np.min(x)) & (pos <= np.max(x)))[:, 0])[0]
+    length = len(x)
+    # The FID at negative times is the complex conjugate of the FID at positive times,
+    # so only the positive half is calculated
+    half = length // 2 + 1
+    t = np.abs(np.fft.fftfreq(length, sw[-1]/float(length))[:half])
+    fid = np.zeros(half, dtype=complex)
+    for sites in siteBlocks(len(select), half):
+        sites = select[sites]
+        fid += np.sum(amp[sites] * np.exp(2j * np.pi * (pos[sites] - x[length//2]) * t - np.pi * lor[sites] * t - ((np.pi * gauss[sites] * t)**2) / (4 * np.log(2))), axis=0)
+    fullFid = np.empty(length, dtype=complex)
+    fullFid[:half] = fid
+    fullFid[half:] = np.conj(fid[length - half:0:-1])
+    if length % 2 == 0:
+        # The point at -length/2 has no positive counterpart
+        fullFid[length // 2] = np.conj(fid[-1])
+    return float(mult) / abs(sw[-1]) * fullFid
+
+def peakSimGrad(x, freq, sw, axMult, extra, bgrnd, mult, pos, amp, lor, gauss):
+    """
+    Derivatives of peakSim with respect to its parameters.
+
+    Parameters
+    ----------
+    x : list of ndarray
+        A list of axes values for the simulation.
+        As this is a 1-D method only the last array in the list is used.
+    freq : list of float
+        The list of frequency per dimension in Hz (not used).
+    sw : list of float
+        The list of spectral width per dimension in Hz.
+    axMult : float
+        The multiplier of the x-axis.
+    extra : list
+        The extra parameters of the function (not used).
+    bgrnd : float
+        The offset value added to the FID.
+    mult : float
+        The value by which the FID is multiplied.
     pos : float
         The frequency of the peak (in Hz*axMult).
     amp : float
@@ -574,19 +899,364 @@ def peakSim(x, freq, sw, axMult, extra, bgrnd, mult, pos, amp, lor, gauss):
 
     Returns
     -------
-    ndarray
-        The simulated FID
+    list of ndarray or None
+        The derivatives of the FID with respect to bgrnd, mult, pos, amp, lor and gauss.
+        None is used for parameters that do not change the FID.
     """
     x = x[-1]
     pos /= axMult
     gauss /= axMult
     if pos < np.min(x) or pos > np.max(x):
-        return np.zeros_like(x)
-    lor = np.abs(lor)
-    gauss = np.abs(gauss)
+        zeros = np.zeros_like(x)
+        return [None, zeros, zeros, zeros, zeros, zeros]
     length = len(x)
     t = np.fft.fftfreq(length, sw[-1]/float(length))
-    return float(mult) * float(amp) / abs(sw[-1]) * np.exp(2j * np.pi * (pos - x[length//2]) * t - np.pi * np.abs(lor * t) - ((np.pi * np.abs(gauss) * t)**2) / (4 * np.log(2)))
+    base = np.exp(2j * np.pi * (pos - x[length//2]) * t - np.pi * np.abs(lor * t) - ((np.pi * np.abs(gauss) * t)**2) / (4 * np.log(2))) / abs(sw[-1])
+    fid = float(mult) * float(amp) * base
+    return [None,
+            float(amp) * base,
+            fid * 2j * np.pi * t / axMult,
+            float(mult) * base,
+            -fid * np.pi * np.abs(t) * np.sign(lor),
+            -fid * (np.pi * t)**2 * gauss / (2 * np.log(2) * axMult)]
+
+def voigtLine(x, lor, gauss):
+    """
+    Calculates Voigt lines with unit integral.
+
+    Parameters
+    ----------
+    x : ndarray
+        The frequencies relative to the centre of the line in Hz.
+        A 2-D array gives a line per row.
+    lor : float or ndarray
+        The full width at half maximum of the Lorentzian part in Hz.
+    gauss : float or ndarray
+        The full width at half maximum of the Gaussian part in Hz.
+        Arrays of lor and gauss with shape (sites, 1) give a line per site.
+
+    Returns
+    -------
+    ndarray
+        The line(s).
+    """
+    gamma = np.abs(lor) / 2.0
+    sigma = np.abs(gauss) / (2 * np.sqrt(2 * np.log(2)))
+    if np.ndim(x) < 2:
+        if sigma == 0:
+            return gamma / np.pi / (x**2 + gamma**2)
+        return np.real(wofz((x + 1j * gamma) / (sigma * np.sqrt(2)))) / (sigma * np.sqrt(2 * np.pi))
+    gamma = np.broadcast_to(gamma, (len(x), 1))
+    sigma = np.broadcast_to(sigma, (len(x), 1))
+    line = np.empty(x.shape)
+    pure = sigma[:, 0] == 0
+    line[pure] = gamma[pure] / np.pi / (x[pure]**2 + gamma[pure]**2)
+    voigt = ~pure
+    line[voigt] = np.real(wofz((x[voigt] + 1j * gamma[voigt]) / (sigma[voigt] * np.sqrt(2)))) / (sigma[voigt] * np.sqrt(2 * np.pi))
+    return line
+
+def peakSimFreq(x, freq, sw, axMult, extra, bgrnd, mult, pos, amp, lor, gauss):
+    """
+    Frequency domain version of peakSim.
+    Evaluates the Voigt line directly on the x-axis, without Fourier transform.
+    As every point only depends on its own x value, it can be evaluated on part of the axis.
+
+    Parameters
+    ----------
+    x : list of ndarray
+        A list of axes values for the simulation.
+        As this is a 1-D method only the last array in the list is used.
+    freq : list of float
+        The list of frequency per dimension in Hz (not used).
+    sw : list of float
+        The list of spectral width per dimension in Hz (not used).
+    axMult : float
+        The multiplier of the x-axis.
+    extra : list
+        The extra parameters of the function (not used).
+    bgrnd : float
+        The offset value (not used).
+    mult : float
+        The value by which the spectrum is multiplied.
+    pos : float or ndarray
+        The frequency of the peak (in Hz*axMult).
+    amp : float or ndarray
+        The integral of the peak.
+    lor : float or ndarray
+        The Lorentzian broadening of the peak.
+    gauss : float or ndarray
+        The Gaussian broadening of the peak (in Hz*axMult), corresponding to CS distribution.
+        When arrays are given for pos, amp, lor and gauss, the spectra of all peaks are summed.
+
+    Returns
+    -------
+    ndarray
+        The simulated spectrum.
+    """
+    x = x[-1]
+    pos, amp, lor, gauss = [np.reshape(item, (-1, 1)) for item in np.broadcast_arrays(pos, amp, lor, gauss)]
+    pos = pos / axMult
+    gauss = gauss / axMult
+    inRange = ((pos >= np.min(x)) & (pos <= np.max(x)))[:, 0]
+    sharp = (lor == 0)[:, 0] & (gauss == 0)[:, 0]
+    spectrum = np.zeros_like(x, dtype=float)
+    if len(x) > 1:
+        for i in np.nonzero(inRange & sharp)[0]:
+            spectrum[np.argmin(np.abs(x - pos[i, 0]))] += amp[i, 0] / abs(x[1] - x[0])
+    select = np.nonzero(inRange & ~sharp)[0]
+    for sites in siteBlocks(len(select), len(x)):
+        sites = select[sites]
+        spectrum += np.sum(amp[sites] * voigtLine(x - pos[sites], lor[sites], gauss[sites]), axis=0)
+    return float(mult) * spectrum
+
+def peakSimFreqGrad(x, freq, sw, axMult, extra, bgrnd, mult, pos, amp, lor, gauss):
+    """
+    Derivatives of peakSimFreq with respect to its parameters.
+
+    Parameters
+    ----------
+    x : list of ndarray
+        A list of axes values for the simulation.
+        As this is a 1-D method only the last array in the list is used.
+    freq : list of float
+        The list of frequency per dimension in Hz (not used).
+    sw : list of float
+        The list of spectral width per dimension in Hz (not used).
+    axMult : float
+        The multiplier of the x-axis.
+    extra : list
+        The extra parameters of the function (not used).
+    bgrnd : float
+        The offset value (not used).
+    mult : float
+        The value by which the spectrum is multiplied.
+    pos : float
+        The frequency of the peak (in Hz*axMult).
+    amp : float
+        The integral of the peak.
+    lor : float
+        The Lorentzian broadening of the peak.
+    gauss : float
+        The Gaussian broadening of the peak (in Hz*axMult), corresponding to CS distribution.
+
+    Returns
+    -------
+    list of ndarray or None
+        The derivatives of the spectrum with respect to bgrnd, mult, pos, amp, lor and gauss.
+        None is used for parameters that do not change the spectrum.
+    """
+    x = x[-1]
+    pos /= axMult
+    gauss /= axMult
+    zeros = np.zeros_like(x)
+    if pos < np.min(x) or pos > np.max(x) or (lor == 0 and gauss == 0):
+        return [None, zeros, zeros, zeros, zeros, zeros]
+    scale = float(mult) * float(amp)
+    diff = x - pos
+    line = voigtLine(diff, lor, gauss)
+    gamma = abs(lor) / 2.0
+    if gauss == 0:
+        denom = diff**2 + gamma**2
+        dPos = 2 * gamma * diff / (np.pi * denom**2)
+        dGamma = (diff**2 - gamma**2) / (np.pi * denom**2)
+        dSigma = zeros
+    else:
+        sigma = abs(gauss) / (2 * np.sqrt(2 * np.log(2)))
+        z = (diff + 1j * gamma) / (sigma * np.sqrt(2))
+        faddeeva = wofz(z)
+        dFaddeeva = -2 * z * faddeeva + 2j / np.sqrt(np.pi)
+        norm = 1.0 / (sigma**2 * 2 * np.sqrt(np.pi))
+        dPos = -np.real(dFaddeeva) * norm
+        dGamma = -np.imag(dFaddeeva) * norm
+        dSigma = -np.real(dFaddeeva * z) / (sigma**2 * np.sqrt(2 * np.pi)) - line / sigma
+    return [None,
+            float(amp) * line,
+            scale * dPos / axMult,
+            float(mult) * line,
+            scale * dGamma * np.sign(lor) / 2.0,
+            scale * dSigma * np.sign(gauss) / (2 * np.sqrt(2 * np.log(2)) * axMult)]
+
+def binIndices(v, length, minV, maxV):
+    """
+    Calculates the bins of frequencies in a set of uniform bins.
+    The bins are equal to those of np.histogram with the same range and number of bins.
+
+    Parameters
+    ----------
+    v : ndarray
+        The frequencies, all should be between minV and maxV.
+    length : int
+        The number of bins.
+    minV, maxV : float
+        The outer edges of the bins.
+
+    Returns
+    -------
+    ndarray
+        The bin index of every frequency.
+    """
+    edges = np.linspace(minV, maxV, length + 1)
+    upper = edges[1:].copy()
+    upper[-1] = np.inf                   # The last bin includes its upper edge
+    pos = v - minV
+    pos *= length / (maxV - minV)
+    indices = pos.astype(np.intp)
+    indices[indices == length] -= 1
+    indices[v < edges[indices]] -= 1     # Correct the values within 1 ULP of the bin edges
+    indices[v >= upper[indices]] += 1
+    return indices
+
+def binPositions(v, length, minV, maxV, linear=False):
+    """
+    Calculates over which of a set of uniform bins frequencies are distributed.
+
+    Parameters
+    ----------
+    v : ndarray
+        The frequencies, all should be between minV and maxV.
+    length : int
+        The number of bins.
+    minV, maxV : float
+        The outer edges of the bins.
+    linear : bool, optional
+        When True every frequency is divided over the two nearest bin centres by linear interpolation.
+        Otherwise every frequency is in the bin that contains it.
+        False by default.
+
+    Returns
+    -------
+    list of tuple
+        Tuples of the bin indices and the fractions (None for a full contribution) of the frequencies in these bins.
+    """
+    if not linear:
+        return [(binIndices(v, length, minV, maxV), None)]
+    pos = (v - minV) / (maxV - minV) * length - 0.5
+    low = np.floor(pos)
+    frac = pos - low
+    low = low.astype(np.intp)
+    # Frequencies in the outer half bins are kept in the outer bins
+    return [(np.clip(low, 0, length - 1), 1 - frac), (np.clip(low + 1, 0, length - 1), frac)]
+
+def binFrequencies(v, weight, shape, ranges, linear=None):
+    """
+    Bins weighted frequencies in a uniform grid of one or more dimensions.
+    The bin indices are calculated arithmetically and all contributions are accumulated with a single bincount.
+    Frequencies outside the range of any of the dimensions are discarded.
+
+    Parameters
+    ----------
+    v : list of ndarray
+        The frequencies along every dimension, all with the same shape.
+    weight : ndarray
+        The real or complex weights of the frequencies. Should be broadcastable to the shape of the frequencies.
+    shape : tuple of int
+        The number of bins along every dimension.
+    ranges : list of tuple
+        The outer edges (min, max) of the bins along every dimension.
+    linear : bool, optional
+        When True every frequency is divided over the nearest bin centres by linear interpolation.
+        By default LINEARBINNING is used.
+
+    Returns
+    -------
+    ndarray
+        The binned weights with the given shape.
+    """
+    if linear is None:
+        linear = LINEARBINNING
+    v = [np.asarray(elem) for elem in v]
+    keep = np.ones(v[0].shape, dtype=bool)
+    for elem, (minV, maxV) in zip(v, ranges):
+        keep &= (elem >= minV) & (elem <= maxV)
+    if keep.all():  # Avoid copying the frequencies when none are discarded
+        v = [elem.ravel() for elem in v]
+        weight = np.broadcast_to(weight, keep.shape).ravel()
+    else:
+        v = [elem[keep] for elem in v]
+        weight = np.broadcast_to(weight, keep.shape)[keep]
+    terms = [(0, weight)]
+    for elem, length, (minV, maxV) in zip(v, shape, ranges):
+        positions = binPositions(elem, length, minV, maxV, linear)
+        terms = [(index * length + indices, termWeight if frac is None else termWeight * frac) for index, termWeight in terms for indices, frac in positions]
+    return accumulateBins(terms, int(np.prod(shape))).reshape(shape)
+
+def accumulateBins(terms, size):
+    """
+    Sums weights in bins with a single bincount.
+
+    Parameters
+    ----------
+    terms : list of tuple
+        Tuples of the flat bin indices and the real or complex weights that are added to these bins.
+    size : int
+        The number of bins.
+
+    Returns
+    -------
+    ndarray
+        The summed weights of every bin.
+    """
+    if len(terms) == 1:
+        indices, weight = terms[0]
+    else:
+        indices = np.concatenate([term[0] for term in terms])
+        weight = np.concatenate([term[1] for term in terms])
+    final = np.zeros(size, dtype=np.result_type(weight, float))
+    if np.iscomplexobj(final):
+        final.real = np.bincount(indices, weights=weight.real, minlength=size)
+        final.imag = np.bincount(indices, weights=weight.imag, minlength=size)
+    else:
+        final += np.bincount(indices, weights=weight, minlength=size)
+    return final
+
+def binSpectrum(x, v, weight):
+    """
+    Bins weighted frequencies on a frequency axis.
+
+    Parameters
+    ----------
+    x : ndarray
+        The frequency axis in Hz, the centres of the bins.
+    v : ndarray
+        The frequencies.
+    weight : ndarray
+        The weights corresponding to the frequencies. Should have the same length as v.
+
+    Returns
+    -------
+    ndarray
+        The binned spectrum. Has the same length as x.
+    """
+    diff = (x[1] - x[0]) * 0.5
+    return binFrequencies([v], weight, (len(x),), [(x[0] - diff, x[-1] + diff)])
+
+def binnedFid(final, sw, gauss, lor):
+    """
+    Creates an FID from a binned spectrum.
+    Also applies Lorentzian and Gaussian broadening.
+
+    Parameters
+    ----------
+    final : ndarray
+        The binned spectrum, as given by binSpectrum.
+    sw : float
+        The spectral width in Hz.
+    gauss : float
+        Gaussian broadening in Hz.
+    lor : float
+        Lorentzian broadening in Hz.
+
+    Returns
+    -------
+    ndarray
+        The FID. Has the same length as final.
+    """
+    length = len(final)
+    t = np.abs(np.fft.fftfreq(length, sw / float(length)))
+    apod = np.exp(-np.pi * np.abs(lor) * t - ((np.pi * np.abs(gauss) * t)**2) / (4 * np.log(2)))
+    inten = np.fft.ifft(final) * apod
+    inten *= len(inten)  / abs(sw)
+    return inten
 
 def makeSpectrum(x, sw, v, gauss, lor, weight):
     """
@@ -614,14 +1284,41 @@ def makeSpectrum(x, sw, v, gauss, lor, weight):
     ndarray
         The FID. Has the same length as x[-1].
     """
-    length = len(x)
-    t = np.abs(np.fft.fftfreq(length, sw / float(length)))
-    diff = (x[1] - x[0]) * 0.5
-    final, _ = np.histogram(v, length, range=[x[0]-diff, x[-1]+diff], weights=weight)
-    apod = np.exp(-np.pi * np.abs(lor) * t - ((np.pi * np.abs(gauss) * t)**2) / (4 * np.log(2)))
-    inten = np.fft.ifft(final) * apod
-    inten *= len(inten)  / abs(sw)
-    return inten
+    return binnedFid(binSpectrum(x, v, weight), sw, gauss, lor)
+
+def histogramRows(v, weight, length, minV, maxV, linear=None):
+    """
+    Calculates the histograms of the rows of a 2-D array of frequencies in one pass.
+    The bins are equal to those of binFrequencies.
+
+    Parameters
+    ----------
+    v : ndarray
+        A 2-D array with the frequencies, every row gives a separate histogram.
+    weight : ndarray
+        The weights of the frequencies. Should be broadcastable to the shape of v.
+    length : int
+        The number of bins.
+    minV, maxV : float
+        The outer edges of the bins.
+    linear : bool, optional
+        When True every frequency is divided over the two nearest bin centres by linear interpolation.
+        By default LINEARBINNING is used.
+
+    Returns
+    -------
+    ndarray
+        The histograms with shape (len(v), length).
+    """
+    if linear is None:
+        linear = LINEARBINNING
+    numRows = v.shape[0]
+    keep = (v >= minV) & (v <= maxV)
+    weight = np.broadcast_to(weight, v.shape)[keep]
+    rows = np.broadcast_to(np.arange(numRows)[:, np.newaxis], v.shape)[keep] * length
+    positions = binPositions(v[keep], length, minV, maxV, linear)
+    terms = [(rows + indices, weight if frac is None else weight * frac) for indices, frac in positions]
+    return accumulateBins(terms, numRows * length).reshape(numRows, length)
 
 def makeMQMASSpectrum(x, sw, v, gauss, lor, weight, slope):
     """
@@ -671,7 +1368,7 @@ def makeMQMASSpectrum(x, sw, v, gauss, lor, weight, slope):
     if minD2 > maxD2:
         minD2, maxD2 = maxD2, minD2
         v[1] *= -1
-    final, _, _ = np.histogram2d(v[0], v[1], [length1, length2], range=[[minD1, maxD1], [minD2, maxD2]], weights=weight)
+    final = binFrequencies(v, weight, (length1, length2), [(minD1, maxD1), (minD2, maxD2)])
     final = np.fft.ifftn(final)
     apod2 = np.exp(-np.pi * np.abs(lor[1] * t2) - 
                    ((np.pi * np.abs(gauss[1]) * (t2 + t1*slope))**2) / (4 * np.log(2)))
@@ -847,6 +1544,85 @@ def quadFreqBase(I, m1, m2, cq, eta, freq, angle, D2, D4, numssb, spinspeed):
         v = np.matmul(dat2, spinD2) + np.matmul(dat4, spinD4)
     return v, vConstant
 
+def quadFreqBatch(I, m1, m2, cq, eta, freq, angle, D2, D4, numssb, spinspeed):
+    """
+    Calculates the quadrupole frequencies of quadFreqBase for arrays of Cq and eta values at once.
+    The frequencies are linear in the components of the space tensors, so the Wigner matrices are only
+    combined once with these components and the result is shared by all Cq and eta values.
+
+    Parameters
+    ----------
+    I : float
+        The spin quantum number.
+    m1, m2 : float
+        The levels between which to calculate the frequency.
+    cq : array_like
+        The Cq values of the quadrupole coupling in Hz.
+    eta : array_like
+        The asymmetry parameters of the quadrupole coupling.
+        Should have the same length as cq.
+    freq : float
+        The Larmor frequency of the nucleus in Hz.
+    angle : float
+        The spinning angle in radians.
+    D2 : array_like
+        The second rank wigner rotation matrices used to calculate the quadrupole frequencies.
+        The first dimension should contain the angular dependence.
+    D4 : array_like
+        The fourth rank wigner rotation matrices used to calculate the quadrupole frequencies.
+        The first dimension should contain the angular dependence.
+        Should have the same length as D2.
+    numssb : int
+        The number of alpha angles to calculate.
+    spinspeed : float
+        The spinning frequency in Hz.
+
+    Returns
+    -------
+    ndarray
+        The array with frequencies with shape (len(cq), len(D2)), or (len(cq), len(D2), numssb) for finite spinning speeds.
+    ndarray or int
+        The isotropic frequencies with shape (len(cq), len(D2)) for finite spinning speeds, otherwise 0.
+    """
+    if freq == 0.0:
+        raise SimException("Sim: Frequency cannot be zero")
+    cq = np.asarray(cq, dtype=float)
+    eta = np.asarray(eta, dtype=float)
+    pre2 = -cq**2 / (4 * I *(2 * I - 1))**2 * 2 / freq
+    pre1 = cq / (4 * I *(2 * I - 1))
+    firstspin2 = firstQuadSpin(I, m1, m2)
+    secspin0, secspin2, secspin4 = secQuadSpin(I, m1, m2)
+    # The coefficients of the components 0 and +-2 of the rank 2 space tensors (see firstQuadSpace and secQuadSpace)
+    coeff2 = np.array([pre1 * firstspin2 + pre2 * secspin2 * (eta**2 - 3) / 14.0,
+                       (pre1 * firstspin2 * np.sqrt(1 / 6.0) + pre2 * secspin2 * np.sqrt(3.0 / 2) / 7.0) * eta]).T
+    # The coefficients of the components 0, +-2 and +-4 of the rank 4 space tensor
+    coeff4 = np.array([pre2 * secspin4 * (18 + eta**2) / 140.0,
+                       pre2 * secspin4 * 3.0 / 70 * np.sqrt(5.0 / 2) * eta,
+                       pre2 * secspin4 / (4 * np.sqrt(70)) * eta**2]).T
+    dat0 = pre2 * secspin0 * -1.0 / 5 * (3 + eta**2)
+    basis2 = np.array([D2[:, 2], D2[:, 0] + D2[:, 4]])
+    basis4 = np.array([D4[:, 4], D4[:, 2] + D4[:, 6], D4[:, 0] + D4[:, 8]])
+    d2 = d2tens(np.array([angle]))[0, :, 2]
+    d4 = d4tens(np.array([angle]))[0, :, 4]
+    if spinspeed == 0.0:
+        factor2 = 1.0
+        factor4 = 1.0
+    else:
+        factor2 = d2[2]
+        factor4 = d4[4]
+    v = np.matmul(coeff2, np.real(basis2[:, :, 2] * factor2)) + np.matmul(coeff4, np.real(basis4[:, :, 4] * factor4)) + dat0[:, np.newaxis]
+    if spinspeed in (0.0, np.inf):
+        return v, 0
+    vConstant = v
+    gammastep = 2 * np.pi / numssb
+    gval = np.arange(numssb) * gammastep
+    spinD2 = np.exp(1j * np.arange(-2, 3)[:, np.newaxis] * gval) * d2[:, np.newaxis]
+    spinD4 = np.exp(1j * np.arange(-4, 5)[:, np.newaxis] * gval) * d4[:, np.newaxis]
+    spinD2[2] = 0
+    spinD4[4] = 0
+    v = np.tensordot(coeff2, np.matmul(basis2, spinD2), axes=1) + np.tensordot(coeff4, np.matmul(basis4, spinD4), axes=1)
+    return v, vConstant
+
 def quadCSAFunc(x, freq, sw, axMult, extra, bgrnd, mult, spinspeed, t11, t22, t33, cq, eta, alphaCSA, betaCSA, gammaCSA, amp, lor, gauss, lorST):
     """
     Calculates an FID of a powder averaged site under influence of CSA and a quadrupole interaction.
@@ -929,7 +1705,7 @@ def quadCSAFunc(x, freq, sw, axMult, extra, bgrnd, mult, spinspeed, t11, t22, t3
     totalEff = len(mList) * (I**2 + I) - np.sum(mList * (mList + 1))
     if not satBool:
         mList = [-0.5]
-    spectrum = np.zeros(len(x), dtype=complex)
+    bins = {}                            # The binned transitions per Lorentzian broadening
     relativeD2 = D2tens(np.array([alphaCSA]), np.array([betaCSA]), np.array([gammaCSA]))
     vCSA, vConstantCSA = csaFreqBase(angle, tensor, np.matmul(relativeD2, D2), spinspeed, numssb)
     for m in mList:
@@ -949,7 +1725,13 @@ def quadCSAFunc(x, freq, sw, axMult, extra, bgrnd, mult, spinspeed, t11, t22, t3
             lb = lor
         else:
             lb = lorST
-        spectrum += eff * makeSpectrum(x, sw, v, gauss, lb, tot)
+        if lb in bins:
+            bins[lb] += eff * binSpectrum(x, v, tot)
+        else:
+            bins[lb] = eff * binSpectrum(x, v, tot)
+    spectrum = np.zeros(len(x), dtype=complex)
+    for lb, final in bins.items():
+        spectrum += binnedFid(final, sw, gauss, lb)
     return mult * amp * spectrum
 
 def quadCzjzekFunc(x, freq, sw, axMult, extra, bgrnd, mult, pos, sigma, cq0, eta0, amp, lor, gauss):
@@ -1202,9 +1984,225 @@ def mqmasCzjzekFunc(x, freq, sw, axMult, extra, bgrnd, mult, pos, sigmaCS, sigma
     fid = np.fft.fft(fid, axis=1) * shearMat
     return mult * amp * fid * length1 / length2
 
-def genLib(length, minCq, maxCq, minEta, maxEta, numCq, numEta, extra, freq, sw, spinspeed):
+def libCacheName(key):
+    """
+    Returns the file in the cache directory in which a Czjzek library is stored.
+
+    Parameters
+    ----------
+    key : tuple
+        All the values on which the library depends.
+
+    Returns
+    -------
+    str or None
+        The path of the .npy file, or None when there is no cache directory.
+    """
+    if CACHEDIR is None:
+        return None
+    name = hashlib.sha1(repr((LIBVERSION,) + tuple(key)).encode()).hexdigest()
+    return os.path.join(CACHEDIR, 'czjzek', name + '.npy')
+
+def loadCachedLib(fileName):
+    """
+    Loads a stored Czjzek library as a read-only memory map.
+    The modification time of the file is updated, such that it is evicted last by pruneLibCache.
+
+    Parameters
+    ----------
+    fileName : str
+        The path of the .npy file.
+
+    Returns
+    -------
+    ndarray or None
+        The library, or None when the file is not available.
+    """
+    if not os.path.isfile(fileName):
+        return None
+    try:
+        lib = np.load(fileName, mmap_mode='r')
+        os.utime(fileName)
+    except (OSError, ValueError):
+        return None
+    return np.asarray(lib)
+
+def createCachedLib(fileName, shape):
+    """
+    Creates a memory mapped array in the cache directory in which a Czjzek library can be generated.
+    The array is written to a temporary file, which is renamed to fileName by finishCachedLib.
+
+    Parameters
+    ----------
+    fileName : str
+        The path of the .npy file of the library.
+    shape : tuple
+        The shape of the library.
+
+    Returns
+    -------
+    memmap or None
+        The writable array, or None when the library is larger than LIBCACHESIZE or the file cannot be created.
+    """
+    if np.prod(shape) * np.dtype(complex).itemsize > LIBCACHESIZE:
+        return None
+    try:
+        os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        return np.lib.format.open_memmap(fileName + '.%d.tmp' % os.getpid(), mode='w+', dtype=complex, shape=shape)
+    except OSError:
+        return None  # The cache directory is optional, the library is only kept in memory
+
+def finishCachedLib(fileName, tmpName, keep):
+    """
+    Stores or discards a Czjzek library created with createCachedLib.
+    The memory map of the library should be closed, as open files cannot be renamed or removed on Windows.
+    After storing, the least recently used libraries are evicted when the cache gets too large.
+
+    Parameters
+    ----------
+    fileName : str
+        The path of the .npy file of the library.
+    tmpName : str
+        The path of the temporary file with the library.
+    keep : bool
+        When True the library is stored, otherwise the temporary file is removed.
+
+    Returns
+    -------
+    ndarray or None
+        The stored library as a read-only memory map, or None when the library is discarded.
+        When the library could not be stored, it is loaded into memory.
+    """
+    lib = None
+    if keep:
+        try:
+            os.replace(tmpName, fileName)
+        except OSError as error:
+            warnings.warn("The Czjzek library could not be stored in the cache: " + str(error))
+            lib = np.load(tmpName)
+        else:
+            pruneLibCache(os.path.dirname(fileName), keep=fileName)
+            return np.load(fileName, mmap_mode='r')
+    try:
+        os.remove(tmpName)
+    except OSError as error:
+        warnings.warn("The temporary Czjzek library could not be removed: " + str(error))
+    return lib
+
+def pruneLibCache(dirName, keep=None):
+    """
+    Removes the least recently used Czjzek libraries until their total size is at most LIBCACHESIZE.
+
+    Parameters
+    ----------
+    dirName : str
+        The directory with the stored libraries.
+    keep : str, optional
+        A file that should not be removed.
+    """
+    files = []
+    for name in os.listdir(dirName):
+        fullName = os.path.join(dirName, name)
+        if not name.endswith('.npy') or fullName == keep:
+            continue
+        try:
+            stat = os.stat(fullName)
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, fullName))
+    total = sum(elem[1] for elem in files)
+    if keep is not None and os.path.isfile(keep):
+        total += os.path.getsize(keep)
+    for _, size, fullName in sorted(files):
+        if total <= LIBCACHESIZE:
+            break
+        try:
+            os.remove(fullName)
+            total -= size
+        except OSError:
+            pass    # The file is still in use
+
+def genLibBlock(context, cq, eta):
+    """
+    Generates the FIDs of a part of a Czjzek library.
+
+    Parameters
+    ----------
+    context : tuple
+        The values that are the same for all FIDs of the library, as made by genLib.
+    cq : ndarray
+        The Cq values of the FIDs in Hz.
+    eta : ndarray
+        The eta values of the FIDs.
+
+    Returns
+    -------
+    ndarray
+        The FIDs with shape (len(cq), length).
+    """
+    x, sw, freq, satBool, I, numssb, angle, D2, D4, weight, spinspeed, linear = context
+    length = len(x)
+    final = np.zeros((len(cq), length), dtype=complex)
+    mList = np.arange(-I, I)
+    totalEff = len(mList) * (I**2 + I) - np.sum(mList * (mList + 1))
+    if not satBool:
+        mList = [-0.5]
+    diff = (x[1] - x[0]) * 0.5
+    carousel = spinspeed not in (0.0, np.inf)
+    eta = 1 - abs(abs(eta) % 2 - 1)
+    # The orientations are done in chunks to limit the size of the frequency arrays
+    chunk = max(1, LIBCHUNKSIZE // (len(cq) * (numssb if carousel else 1)))
+    for start in range(0, len(weight), chunk):
+        sl = slice(start, start + chunk)
+        for m in mList:
+            eff = I**2 + I - m * (m + 1)
+            eff /= totalEff
+            v, vConstant = quadFreqBatch(I, m, m+1, cq, eta, freq, angle, D2[sl], D4[sl], numssb, spinspeed)
+            if carousel:
+                v, tot = carouselAveraging(spinspeed, v.reshape(-1, numssb), np.tile(weight[sl], len(cq)), vConstant.reshape(-1))
+                v = v.reshape(len(cq), -1)
+                tot = tot.reshape(len(cq), -1)
+            else:
+                tot = weight[sl]
+            final += eff * histogramRows(v, tot, length, x[0] - diff, x[-1] + diff, linear)
+    lib = np.fft.ifft(final, axis=1)
+    lib *= length / abs(sw)
+    return lib
+
+LIBCONTEXT = None     # The context of the library that is generated by a worker process
+
+def initLibWorker(context):
+    """
+    Stores the library context in a worker process of genLib, such that it is only sent once.
+    """
+    global LIBCONTEXT
+    LIBCONTEXT = context
+
+def libWorker(task):
+    """
+    Generates a block of a library in a worker process of genLib.
+
+    Parameters
+    ----------
+    task : tuple
+        The index of the first FID of the block, and the Cq and eta values of the block.
+
+    Returns
+    -------
+    int
+        The index of the first FID of the block.
+    ndarray
+        The FIDs of the block.
+    """
+    start, cq, eta = task
+    return start, genLibBlock(LIBCONTEXT, cq, eta)
+
+def genLib(length, minCq, maxCq, minEta, maxEta, numCq, numEta, extra, freq, sw, spinspeed, cheng=None, numWorkers=1, progress=None):
     """
     Generate a library of FIDs for Czjzek distribution fitting.
+    When the Cheng number is given and a cache directory is set, the library is stored in and loaded from the cache directory.
+    The FIDs are generated in blocks of at most LIBBLOCKSIZE, which can run in parallel in a pool of worker processes.
+    A stored library is written directly into its memory mapped file, otherwise the blocks fill a preallocated array.
 
     Parameters
     ----------
@@ -1221,7 +2219,16 @@ def genLib(length, minCq, maxCq, minEta, maxEta, numCq, numEta, extra, freq, sw,
     sw : float
         The spectral width in Hz.
     spinspeed : float
-        The spinning frequency in Hz.
+        The spinning frequency in kHz.
+    cheng : int, optional
+        The Cheng number of the orientations in extra.
+        By default None, in which case the library is not cached.
+    numWorkers : int, optional
+        The number of worker processes.
+        By default 1, in which case the library is generated in this process.
+    progress : function, optional
+        Called with the number of finished FIDs and the total number of FIDs while the library is generated.
+        When it returns True, the generation is cancelled.
 
     Returns
     -------
@@ -1231,12 +2238,94 @@ def genLib(length, minCq, maxCq, minEta, maxEta, numCq, numEta, extra, freq, sw,
         The Cq values corresponding to the FIDs in library (in Hz).
     ndarray
         The eta values corresponding to the FIDs in library.
+    None is returned when the generation is cancelled.
     """
     cq, eta = np.meshgrid(np.linspace(minCq, maxCq, numCq), np.linspace(minEta, maxEta, numEta))
     cq = cq.flatten()
     eta = eta.flatten()
     x = np.fft.fftshift(np.fft.fftfreq(length, 1/float(sw)))
-    lib = np.zeros((len(cq), length), dtype=complex)
-    for i, (cqi, etai) in enumerate(zip(cq, eta)):
-        lib[i] = quadFunc([x], [freq], [sw], 1.0, extra, 0.0, 1.0, spinspeed, 0.0, cqi, etai, 1.0, 0.0, 0.0, 0.0)
+    satBool, I, numssb, angle, D2, D4, weight, MAStype = extra
+    if MAStype == 0:
+        spinspeed = 0.0
+    elif MAStype == 2:
+        spinspeed = np.inf
+    spinspeed *= 1e3
+    carousel = spinspeed not in (0.0, np.inf)
+    fileName = None
+    if cheng is not None:
+        key = (float(I), float(minCq), float(maxCq), int(numCq), float(minEta), float(maxEta), int(numEta), int(cheng),
+               int(numssb) if carousel else 0, float(spinspeed), float(angle), int(MAStype), bool(satBool), int(length), float(sw), float(freq), bool(LINEARBINNING))
+        fileName = libCacheName(key)
+    if fileName is not None:
+        lib = loadCachedLib(fileName)
+        if lib is not None and lib.shape == (len(cq), length):
+            return lib, cq*1e6, eta
+    if not satBool and (I % 1) == 0.0:
+        return np.zeros((len(cq), length), dtype=complex), cq*1e6, eta    # Integer spins have no central transition
+    lib = None
+    if fileName is not None:
+        lib = createCachedLib(fileName, (len(cq), length))
+    mapped = lib is not None
+    if not mapped:
+        lib = np.empty((len(cq), length), dtype=complex)
+    context = (x, sw, freq, satBool, I, numssb, angle, D2, D4, weight, spinspeed, LINEARBINNING)
+    # Several blocks per worker, such that the workers stay busy until the end
+    blockSize = max(1, min(LIBBLOCKSIZE, -(-len(cq) // (4 * max(1, numWorkers)))))
+    tasks = [(start, cq[start:start + blockSize] * 1e6, eta[start:start + blockSize]) for start in range(0, len(cq), blockSize)]
+    done = 0
+    cancelled = False
+    if numWorkers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(numWorkers, len(tasks)), initializer=initLibWorker, initargs=(context,))
+        try:
+            results = pool.imap_unordered(libWorker, tasks)
+            while done < len(cq):
+                if progress is not None and progress(done, len(cq)):
+                    cancelled = True
+                    break
+                try:
+                    start, block = results.next(0.1)
+                except multiprocessing.TimeoutError:
+                    continue
+                lib[start:start + len(block)] = block
+                done += len(block)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for start, cqBlock, etaBlock in tasks:
+            if progress is not None and progress(done, len(cq)):
+                cancelled = True
+                break
+            lib[start:start + len(cqBlock)] = genLibBlock(context, cqBlock, etaBlock)
+            done += len(cqBlock)
+    if progress is not None and not cancelled:
+        progress(done, len(cq))
+    if mapped:
+        tmpName = lib.filename
+        lib.flush()
+        del lib  # Closes the memory map, such that the file can be renamed
+        lib = finishCachedLib(fileName, tmpName, not cancelled)
+        if lib is not None:
+            lib = np.asarray(lib)
+            lib.flags.writeable = False
+    if cancelled:
+        return None
     return lib, cq*1e6, eta
+
+# The analytic derivatives of the simulation functions, used by the least-squares fitting
+GRADIENTS = {relaxationFunc: relaxationFuncGrad,
+             diffusionFunc: diffusionFuncGrad,
+             peakSim: peakSimGrad,
+             peakSimFreq: peakSimFreqGrad}
+
+# Functions that accept arrays with the values of all sites for the site dependent parameters.
+# These return the sum over the sites.
+VECTORIZED = (relaxationFunc, diffusionFunc, peakSim, peakSimFreq)
+
+# Functions of which every point only depends on the x value of that point.
+# These can be evaluated on the part of the axis that is used in the fit.
+POINTWISE = (relaxationFunc, diffusionFunc, peakSimFreq)
+
+# Functions (and their entries in GRADIENTS) that accept leading batch axes on all parameters.
+# These can fit many curves with the same parameter structure at once.
+BATCHED = (relaxationFunc, diffusionFunc)
@@ -250,6 +250,9 @@ class MainProgram(QtWidgets.QMainWindow):
         self.defaultNegColor = '#FF7F0E'
         self.defaultStartupBool = False
         self.defaultStartupDir = '~'
+        self.defaultCacheBool = False
+        self.defaultCacheDir = os.path.join(QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.GenericCacheLocation), 'ssNake')
+        self.defaultCacheSize = 1024
         self.defaultTooltips = True
         self.defaultToolbarActionList = ['File --> Open',
                                          'File -- > Save --> Matlab',
@@ -343,6 +346,13 @@ class MainProgram(QtWidgets.QMainWindow):
         self.defaultToolBar = settings.value("toolbar", self.defaultToolBar, bool)
         self.defaultStartupBool = settings.value("startupdiron", self.defaultStartupBool, bool)
         self.defaultStartupDir = settings.value("startupdir", self.defaultStartupDir, str)
+        self.defaultCacheBool = settings.value("cachediron", self.defaultCacheBool, bool)
+        self.defaultCacheDir = settings.value("cachedir", self.defaultCacheDir, str)
+        try:
+            self.defaultCacheSize = settings.value("cachesize", self.defaultCacheSize, int)
+        except TypeError:
+            self.dispMsg("Incorrect value in the config file for the cachesize")
+        self.setCacheDir()
         self.defaultTooltips = settings.value("tooltips", self.defaultTooltips, bool)
         try:
             self.defaultWidthRatio = settings.value("contour/width_ratio", self.defaultWidthRatio, float)
@@ -353,6 +363,12 @@ class MainProgram(QtWidgets.QMainWindow):
         except TypeError:
             self.dispMsg("Incorrect value in the config file for the contour/height_ratio")
 
+    def setCacheDir(self):
+        if self.defaultCacheBool and self.defaultCacheDir:
+            sim.setCacheDir(os.path.expanduser(self.defaultCacheDir), self.defaultCacheSize * 2**20)
+        else:
+            sim.setCacheDir(None)
+
     def saveDefaults(self):
         QtCore.QSettings.setDefaultFormat(QtCore.QSettings.IniFormat)
         QtCore.QCoreApplication.setOrganizationName("ssNake")
@@ -379,6 +395,10 @@ class MainProgram(QtWidgets.QMainWindow):
         settings.setValue("toolbar", self.defaultToolBar)
         settings.setValue("startupdiron", self.defaultStartupBool)
         settings.setValue("startupdir", self.defaultStartupDir)
+        settings.setValue("cachediron", self.defaultCacheBool)
+        settings.setValue("cachedir", self.defaultCacheDir)
+        settings.setValue("cachesize", self.defaultCacheSize)
+        self.setCacheDir()
         settings.setValue("tooltips", self.defaultTooltips)
         settings.setValue("contour/colourmap", self.defaultColorMap)
         settings.setValue("contour/constantcolours", self.defaultContourConst)
@@ -6925,6 +6945,26 @@ class PreferenceWindow(QtWidgets.QWidget):
         self.startupDirButton = QtWidgets.QPushButton("Browse", self)
         self.startupDirButton.clicked.connect(self.browseStartup)
         startupgrid.addWidget(self.startupDirButton, 0, 1)
+        self.cachegroupbox = QtWidgets.QGroupBox("Cache Directory")
+        self.cachegroupbox.setCheckable(True)
+        self.cachegroupbox.setChecked(self.father.defaultCacheBool)
+        self.cachegroupbox.setToolTip("Store the powder averaging orientation sets and generated Czjzek libraries of the fits on disk, so they are not recalculated in the next session")
+        grid1.addWidget(self.cachegroupbox, 9, 0, 1, 2)
+        cachegrid = QtWidgets.QGridLayout()
+        self.cachegroupbox.setLayout(cachegrid)
+        self.cacheDirEntry = QtWidgets.QLineEdit(self)
+        self.cacheDirEntry.setText(self.father.defaultCacheDir)
+        cachegrid.addWidget(self.cacheDirEntry, 0, 0)
+        self.cacheDirButton = QtWidgets.QPushButton("Browse", self)
+        self.cacheDirButton.clicked.connect(self.browseCache)
+        cachegrid.addWidget(self.cacheDirButton, 0, 1)
+        cachegrid.addWidget(wc.QLabel("Library size limit [MB]:"), 1, 0)
+        self.cacheSizeSpinBox = wc.SsnakeSpinBox()
+        self.cacheSizeSpinBox.setMaximum(1000000)
+        self.cacheSizeSpinBox.setMinimum(1)
+        self.cacheSizeSpinBox.setValue(self.father.defaultCacheSize)
+        self.cacheSizeSpinBox.setToolTip("When the stored Czjzek libraries exceed this size, the least recently used ones are removed")
+        cachegrid.addWidget(self.cacheSizeSpinBox, 1, 1)
         # grid2 definitions
         grid2.addWidget(QtWidgets.QLabel("Linewidth:"), 1, 0)
         self.lwSpinBox = wc.SsnakeDoubleSpinBox()
@@ -7039,6 +7079,11 @@ class PreferenceWindow(QtWidgets.QWidget):
         if newDir:
             self.startupDirEntry.setText(newDir)
 
+    def browseCache(self, *args):
+        newDir = QtWidgets.QFileDialog.getExistingDirectory(self, 'Select Directory', self.cacheDirEntry.text(), QtWidgets.QFileDialog.ShowDirsOnly)
+        if newDir:
+            self.cacheDirEntry.setText(newDir)
+
     def setColor(self, *args):
         tmp = QtWidgets.QColorDialog.getColor(QtGui.QColor(self.color))
         if tmp.isValid():
@@ -7066,6 +7111,9 @@ class PreferenceWindow(QtWidgets.QWidget):
         self.father.defaultToolbarActionList = self.currentToolbar
         self.father.defaultStartupBool = self.startupgroupbox.isChecked()
         self.father.defaultStartupDir = self.startupDirEntry.text()
+        self.father.defaultCacheBool = self.cachegroupbox.isChecked()
+        self.father.defaultCacheDir = self.cacheDirEntry.text()
+        self.father.defaultCacheSize = self.cacheSizeSpinBox.value()
         self.father.defaultLinewidth = self.lwSpinBox.value()
         self.father.defaultMinXTicks = self.xTicksSpinBox.value()
         self.father.defaultMinYTicks = self.yTicksSpinBox.value()
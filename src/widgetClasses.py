@@ -748,6 +748,13 @@ class FitQLineEdit(QLineEdit):
         super(FitQLineEdit, self).__init__(*args)
         self.fitParent = fitParent
         self.paramName = paramName
+        self.textEdited.connect(self.edited)
+
+    def edited(self, *args):
+        """
+        Tells the fitting parameter frame that the user changed the value.
+        """
+        self.fitParent.paramEdited()
 
     def contextMenuEvent(self, event):
         """